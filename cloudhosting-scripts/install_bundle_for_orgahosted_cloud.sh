@@ -33,20 +33,32 @@ if [ -f "etc/fstab" ]; then
   cp etc/fstab /dev/shm/
   cp root/.ssh/authorized_keys /dev/shm || true
 fi
-find . -maxdepth 1 ! -name . ! -name .. ! -name dev ! -name proc ! -name tmp ! -name run  ! -name sys ! -name 'lost+found' ! -name '*.tar.xz' ! -name '*.gpg' ! -name '*.sh' -exec rm -rf {} +
+find . -maxdepth 1 ! -name . ! -name .. ! -name dev ! -name proc ! -name tmp ! -name run  ! -name sys ! -name 'lost+found' ! -name '*.tar.xz' ! -name '*.tar.zst' ! -name '*.gpg' ! -name '*.sh' -exec rm -rf {} +
 echo "Disk is wiped."
 
 # Unpack to disk
+case "$1" in
+  *.tar.zst|*.tar.zst.gpg)
+    command -v zstd >/dev/null || apt-get install -y zstd
+    DECOMPRESS="zstd -d -c --long=27"
+    ;;
+  *.tar.gz|*.tar.gz.gpg)
+    DECOMPRESS="gzip -d -c"
+    ;;
+  *)
+    DECOMPRESS="xz -d -T0"
+    ;;
+esac
 if [[ "$1" == *.gpg ]]; then
   if [ $# -eq 1 ]; then
     echo "USAGE: $0 <vulnbox-archive> <password>"
     exit 1
   fi
   echo 'Unpacking with password ...'
-  echo "$2" | gpg --batch --passphrase-fd 0 -d "$ARCHIVE" | xz -d -T0 | tar --xattrs -xp
+  echo "$2" | gpg --batch --passphrase-fd 0 -d "$ARCHIVE" | $DECOMPRESS | tar --xattrs -xp
 else
   echo 'Unpacking without password ...'
-  tar --xattrs -xpf "$ARCHIVE"
+  $DECOMPRESS < "$ARCHIVE" | tar --xattrs -xp
 fi
 cp /dev/shm/grub.cfg boot/grub/
 mv etc/fstab etc/fstab.bak
@@ -0,0 +1,115 @@
+import ipaddress
+import tempfile
+import threading
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Any
+from unittest import mock
+
+from tests.utils.cases import TestCase
+from vulnbuild.utils.apt_proxy import AptCacheProxy, AptCacheStore, upstream_url
+
+
+class _Mirror(BaseHTTPRequestHandler):
+    requests: list[str] = []
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        _Mirror.requests.append(self.path)
+        if self.path.startswith('/missing'):
+            self.send_error(404)
+            return
+        body = (self.path * 100).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class AptCacheProxyTests(TestCase):
+    def setUp(self) -> None:
+        _Mirror.requests = []
+        self.mirror = ThreadingHTTPServer(('127.0.0.1', 0), _Mirror)
+        threading.Thread(target=self.mirror.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.mirror.server_close)
+        self.addCleanup(self.mirror.shutdown)
+        self.root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.store = AptCacheStore(self.root, max_size=10000)
+        self.proxy = AptCacheProxy(self.store, port=0, host='127.0.0.1', mirrors=['127.0.0.1'])
+        self.proxy.start()
+        self.addCleanup(self.proxy.stop)
+        self.opener = urllib.request.build_opener(urllib.request.ProxyHandler({'http': f'http://127.0.0.1:{self.proxy.port}'}))
+
+    def _get(self, path: str) -> bytes:
+        with self.opener.open(f'http://127.0.0.1:{self.mirror.server_address[1]}{path}', timeout=5) as response:
+            return response.read()
+
+    def test_detected_as_apt_cacher(self) -> None:
+        with urllib.request.urlopen(f'http://127.0.0.1:{self.proxy.port}/', timeout=5) as response:
+            self.assertIn(b'Apt-Cacher', response.read())
+
+    def test_packages_are_cached(self) -> None:
+        self.assertEqual(self._get('/pool/a.deb'), b'/pool/a.deb' * 100)
+        self.assertEqual(self._get('/pool/a.deb'), b'/pool/a.deb' * 100)
+        self.assertEqual(_Mirror.requests, ['/pool/a.deb'])
+        self.assertEqual(self.store.size, len(b'/pool/a.deb') * 100)
+
+    def test_indexes_are_not_cached(self) -> None:
+        self._get('/dists/bookworm/InRelease')
+        self._get('/dists/bookworm/InRelease')
+        self.assertEqual(len(_Mirror.requests), 2)
+        self.assertEqual(self.store.size, 0)
+
+    def test_errors_are_forwarded(self) -> None:
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            self._get('/missing.deb')
+        self.assertEqual(e.exception.code, 404)
+        self.assertEqual(self.store.size, 0)
+
+    def test_lru_eviction(self) -> None:
+        # each file has 1500 bytes, at most 6 fit into the cache
+        for i in range(6):
+            self._get(f'/pool/package{i:02d}.deb')
+        self._get('/pool/package00.deb')  # cache hit, package00 is now the most recently used one
+        self._get('/pool/package10.deb')
+        self.assertLessEqual(self.store.size, 10000)
+        self.assertIsNotNone(self.store.lookup(f'http://127.0.0.1:{self.mirror.server_address[1]}/pool/package00.deb'))
+        self.assertIsNone(self.store.lookup(f'http://127.0.0.1:{self.mirror.server_address[1]}/pool/package01.deb'))
+
+    def test_private_hosts_are_not_forwarded(self) -> None:
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            with self.opener.open(f'http://localhost:{self.mirror.server_address[1]}/pool/a.deb', timeout=5):
+                pass
+        self.assertEqual(e.exception.code, 403)
+        self.assertEqual(_Mirror.requests, [])
+        self.assertFalse(self.proxy.is_public_host('localhost'))
+        self.assertFalse(self.proxy.is_public_host('10.1.2.3'))
+        self.assertTrue(self.proxy.is_public_host('1.1.1.1'))
+
+    def test_other_repositories_are_forwarded_uncached(self) -> None:
+        # third-party repositories added by install scripts
+        self.enterContext(mock.patch.object(self.proxy, 'is_public_host', lambda host: host == 'localhost'))
+        for _ in range(2):
+            with self.opener.open(f'http://localhost:{self.mirror.server_address[1]}/pool/a.deb', timeout=5) as response:
+                self.assertEqual(response.read(), b'/pool/a.deb' * 100)
+        self.assertEqual(_Mirror.requests, ['/pool/a.deb'] * 2)
+        self.assertEqual(self.store.size, 0)
+
+    def test_https_upstream(self) -> None:
+        self.assertEqual(upstream_url('http://HTTPS///download.docker.com/linux/debian/dists/bookworm/InRelease'),
+                         'https://download.docker.com/linux/debian/dists/bookworm/InRelease')
+        self.assertEqual(upstream_url('http://deb.debian.org/debian/pool/a.deb'), 'http://deb.debian.org/debian/pool/a.deb')
+
+    def test_only_allowed_clients(self) -> None:
+        self.assertTrue(self.proxy.is_allowed_client('172.17.0.2'))
+        self.assertTrue(self.proxy.is_allowed_client('::ffff:127.0.0.1'))
+        self.assertFalse(self.proxy.is_allowed_client('192.168.1.20'))
+        self.assertFalse(self.proxy.is_allowed_client('10.0.0.5'))
+        self.proxy.clients = [ipaddress.ip_network('10.0.0.0/8')]
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            self._get('/pool/a.deb')
+        self.assertEqual(e.exception.code, 403)
+        self.assertEqual(_Mirror.requests, [])
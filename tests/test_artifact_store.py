@@ -0,0 +1,89 @@
+import os
+import random
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from tests.utils.cases import TestCase
+from vulnbuild.utils.artifact_store import ArtifactStore
+
+
+class ArtifactStoreTests(TestCase):
+    def setUp(self) -> None:
+        self.output = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.store = ArtifactStore(self.output, max_versions=2)
+        self.data = random.Random(1).randbytes(4 * 1024 * 1024)
+
+    def _artifact(self, name: str, data: bytes) -> Path:
+        f = self.output / name
+        f.parent.mkdir(parents=True, exist_ok=True)
+        f.write_bytes(data)
+        return f
+
+    def test_deduplication(self) -> None:
+        self.store.add(self._artifact('router/router.ova', self.data))
+        self.store.add(self._artifact('vulnbox/vulnbox.ova', self.data[:1_000_000] + b'services' + self.data[1_000_000:]))
+        self.assertLess(self.store.disk_usage(), len(self.data) * 1.2)
+        self.assertEqual(self.store.artifacts(), [self.output / 'router/router.ova', self.output / 'vulnbox/vulnbox.ova'])
+
+    def test_stash_and_restore(self) -> None:
+        f = self._artifact('vulnbox/vulnbox.ova', self.data)
+        self.store.add(f)
+        mtime = f.stat().st_mtime_ns
+        self.assertTrue(self.store.stash(f))
+        self.assertFalse(f.exists())
+        self.assertEqual(list((self.store.root / 'files').iterdir()), [])  # space is actually freed
+        self.store.restore(f)
+        self.assertEqual(f.read_bytes(), self.data)
+        self.assertEqual(f.stat().st_mtime_ns, mtime)  # doit's timestamp checks see an unchanged file
+
+    def test_restore_without_copy_file_range(self) -> None:
+        f = self._artifact('vulnbox/vulnbox.ova', self.data)
+        self.store.add(f)
+        self.assertTrue(self.store.stash(f))
+        write = os.write
+        # filesystems without copy_file_range, and writes that return early (pipes, signals, full disks)
+        with mock.patch('os.copy_file_range', side_effect=OSError('not supported')), \
+                mock.patch('os.write', side_effect=lambda fd, data: write(fd, data[:1000])):
+            self.store.restore(f)
+        self.assertEqual(f.read_bytes(), self.data)
+
+    def test_restore_unmodified_file_by_hardlink(self) -> None:
+        f = self._artifact('debian.ova', self.data)
+        self.store.add(f)
+        inode = f.stat().st_ino
+        f.unlink()
+        self.store.restore(f)
+        self.assertEqual(f.stat().st_ino, inode)
+        # a build that overwrites its output in place must not corrupt the stored file
+        f.write_bytes(b'modified')
+        self.assertFalse(self.store.stash(f))
+        f.unlink()
+        self.store.restore(f)
+        self.assertEqual(f.read_bytes(), self.data)
+
+    def test_modified_artifact_is_not_stashed(self) -> None:
+        f = self._artifact('vulnbox.7z', self.data)
+        self.store.add(f)
+        f.write_bytes(self.data[:100])
+        self.assertFalse(self.store.stash(f))
+        self.assertTrue(f.exists())
+        self.store.forget(f)
+        f.unlink()
+        self.store.restore(f)
+        self.assertFalse(f.exists())
+
+    def test_gc(self) -> None:
+        f = self._artifact('vulnbox.ova', b'')
+        for i in range(4):
+            f.write_bytes(random.Random(i).randbytes(1024 * 1024))
+            index = self.store.add(f)
+            os.utime(self.store.manifest_dir(f) / f'{index.sha256}.json', (i, i))
+        usage = self.store.disk_usage()
+        removed, freed = self.store.gc()
+        self.assertEqual(len(self.store.versions(f)), 2)
+        self.assertGreater(removed, 0)
+        self.assertEqual(self.store.disk_usage(), usage - freed)
+        f.unlink()
+        self.store.restore(f)
+        self.assertEqual(f.read_bytes(), random.Random(3).randbytes(1024 * 1024))
@@ -0,0 +1,48 @@
+import io
+import os
+import random
+import tempfile
+from pathlib import Path
+
+from tests.utils.cases import TestCase
+from vulnbuild.converter.compression import get_compressor
+from vulnbuild.project import CompressionConfig
+from vulnbuild.utils.chunking import ChunkIndex, iter_chunks, MAX_SIZE, MIN_SIZE
+
+
+class ChunkingTests(TestCase):
+    def setUp(self) -> None:
+        self.root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.data = random.Random(1).randbytes(8 * 1024 * 1024)
+
+    def test_chunk_sizes(self) -> None:
+        chunks = list(iter_chunks(io.BytesIO(self.data)))
+        self.assertEqual(b''.join(chunks), self.data)
+        self.assertTrue(all(MIN_SIZE <= len(c) <= MAX_SIZE for c in chunks[:-1]))
+        chunks = list(iter_chunks(io.BytesIO(bytes(MAX_SIZE * 3 + 5))))  # no marker at all
+        self.assertEqual([len(c) for c in chunks], [MAX_SIZE, MAX_SIZE, MAX_SIZE, 5])
+
+    def test_insertion_changes_few_chunks(self) -> None:
+        (self.root / 'old').write_bytes(self.data)
+        (self.root / 'new').write_bytes(self.data[:3_000_000] + b'inserted' + self.data[3_000_000:])
+        old = ChunkIndex.from_file(self.root / 'old')
+        new = ChunkIndex.from_file(self.root / 'new')
+        self.assertEqual(new.size, len(self.data) + 8)
+        self.assertLessEqual(len(new.missing_chunks(old)), 2)
+        self.assertLess(new.missing_bytes(old), 2 * MAX_SIZE)
+
+    def test_index_file(self) -> None:
+        f = self.root / 'image.ova'
+        f.write_bytes(self.data[:1_000_000])
+        index = ChunkIndex.for_file(f)
+        self.assertTrue((self.root / 'image.ova.chunks.json').exists())
+        self.assertEqual(ChunkIndex.load(ChunkIndex.index_file(f)), index)
+        f.write_bytes(self.data[:500_000])
+        os.utime(f, ns=(index.mtime_ns + 1000, index.mtime_ns + 1000))
+        self.assertEqual(ChunkIndex.for_file(f).size, 500_000)  # index is rebuilt when the file changes
+
+    def test_rsyncable_compression(self) -> None:
+        config = CompressionConfig(rsyncable=True)
+        self.assertIn('--rsyncable', get_compressor('zstd', config).compress_command())
+        self.assertIn('--rsyncable', get_compressor('gzip', config).compress_command())
+        self.assertNotIn('--rsyncable', get_compressor('zstd').compress_command())
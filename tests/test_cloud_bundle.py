@@ -0,0 +1,247 @@
+import hashlib
+import io
+import shutil
+import subprocess
+import tarfile
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from tests.utils.cases import TestCase
+from vulnbuild.converter.cloud_bundle import ArchiveCloudConverter, BundleOutput, GuestfishExtractor, OvaConsumer, OvaExtractor
+from vulnbuild.converter.compression import compressor_for_file, get_compressor
+from vulnbuild.converter.encryption import GpgEncryptor
+from vulnbuild.project import CompressionConfig
+from vulnbuild.utils.tarstream import MemberHasher
+
+
+def _image_archive(files: dict[str, bytes], prefix: str = '') -> io.BytesIO:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for name in ('etc', 'etc/iptables', 'root'):
+            info = tarfile.TarInfo(prefix + name)
+            info.type = tarfile.DIRTYPE
+            tar.addfile(info)
+        for name, content in files.items():
+            info = tarfile.TarInfo(prefix + name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    buffer.seek(0)
+    return buffer
+
+
+class ArchiveCloudConverterTests(TestCase):
+    def setUp(self) -> None:
+        self.tmp = Path(self.enterContext(tempfile.TemporaryDirectory()))
+
+    def _convert(self, output_name: str, files: dict[str, bytes], prefix: str = '') -> dict[str, bytes | None]:
+        output = self.tmp / output_name
+        ArchiveCloudConverter([BundleOutput(compressor_for_file(output_name), plain_file=output)]).convert(_image_archive(files, prefix))
+        self.assertFalse((self.tmp / f'{output_name}.tmp').exists())
+        result: dict[str, bytes | None] = {}
+        with tarfile.open(output, 'r:*') as tar:
+            for member in tar:
+                f = tar.extractfile(member)
+                result[member.name] = f.read() if f else None
+        return result
+
+    def test_filter_members(self) -> None:
+        content = self._convert('bundle.tar.xz', {
+            'etc/iptables/rules.v4': b'*filter\nCOMMIT\n',
+            'etc/crontab': b'# crontab',
+            'root/.bash_profile': b'/root/setup-network.py --check\n',
+            'root/data.bin': bytes(range(256)) * 1000,
+        })
+        self.assertIn(b'--dport 22 -j ACCEPT\n', content['etc/iptables/rules.v4'] or b'')
+        self.assertEqual(content['etc/crontab'], b'# crontab\n@reboot root /cloud-scripts/install-hetzner-cloud.sh\n')
+        self.assertEqual(content['root/.bash_profile'], b'/root/setup-password.py --check\n')
+        self.assertEqual(content['root/data.bin'], bytes(range(256)) * 1000)
+        self.assertIn('cloud-scripts/install-hetzner-cloud.sh', content)
+
+    def test_gzip(self) -> None:
+        self._convert('bundle.tar.gz', {'etc/hostname': b'vulnbox\n'})
+        self.assertEqual((self.tmp / 'bundle.tar.gz').read_bytes()[:2], b'\x1f\x8b')
+
+    def test_zstd(self) -> None:
+        if not shutil.which('zstd'):
+            self.skipTest('zstd not installed')
+        output = self.tmp / 'bundle.tar.zst'
+        compressor = get_compressor('zstd', CompressionConfig(levels={'zstd': 3}))
+        ArchiveCloudConverter([BundleOutput(compressor, plain_file=output)]).convert(_image_archive({'etc/hostname': b'vulnbox\n'}))
+        data = subprocess.check_output(get_compressor('zstd').decompress_command(), stdin=open(output, 'rb'))
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r') as tar:
+            self.assertIn('etc/hostname', tar.getnames())
+
+    def test_encrypted(self) -> None:
+        if not shutil.which('gpg'):
+            self.skipTest('gpg not installed')
+        password_file = self.tmp / 'password.txt'
+        password_file.write_text('secret')
+        encryptor = GpgEncryptor(password_file)
+        output = self.tmp / 'bundle.tar.gz.gpg'
+        outputs = [BundleOutput(get_compressor('gzip'), encrypted_file=output, encryptor=encryptor)]
+        ArchiveCloudConverter(outputs).convert(_image_archive({'etc/hostname': b'vulnbox\n'}))
+        self.assertFalse((self.tmp / 'bundle.tar.gz.gpg.tmp').exists())
+        with tarfile.open(fileobj=io.BytesIO(encryptor.decrypt_file(output)), mode='r:gz') as tar:
+            self.assertIn('etc/hostname', tar.getnames())
+        # an existing bundle is encrypted as it is
+        encryptor.encrypt_file(output, self.tmp / 'twice.gpg')
+        self.assertEqual(encryptor.decrypt_file(self.tmp / 'twice.gpg'), output.read_bytes())
+
+    def test_encryption_password_is_stripped(self) -> None:
+        if not shutil.which('gpg'):
+            self.skipTest('gpg not installed')
+        # 7z gets PasswordTask.get_password(), gpg must use the same password
+        password_file = self.tmp / 'password.txt'
+        password_file.write_bytes(b' secret \r\n')
+        (self.tmp / 'plain').write_bytes(b'data')
+        GpgEncryptor(password_file).encrypt_file(self.tmp / 'plain', self.tmp / 'plain.gpg')
+        decrypted = subprocess.check_output(['gpg', '--batch', '--no-options', '--quiet', '--pinentry-mode', 'loopback',
+                                             '--passphrase', 'secret', '-d', str(self.tmp / 'plain.gpg')], stderr=subprocess.DEVNULL)
+        self.assertEqual(decrypted, b'data')
+
+    def test_multiple_outputs(self) -> None:
+        if not shutil.which('gpg'):
+            self.skipTest('gpg not installed')
+        password_file = self.tmp / 'password.txt'
+        password_file.write_text('secret')
+        encryptor = GpgEncryptor(password_file)
+        outputs = [
+            BundleOutput(get_compressor('xz'), plain_file=self.tmp / 'bundle.tar.xz'),
+            BundleOutput(get_compressor('gzip'), self.tmp / 'bundle.tar.gz', self.tmp / 'bundle.tar.gz.gpg', encryptor),
+        ]
+        converter = ArchiveCloudConverter(outputs, checksum_jobs=1)
+        converter.convert(_image_archive({'etc/hostname': b'vulnbox\n', 'root/data.bin': bytes(range(256)) * 1000}))
+        self.assertEqual(sorted(f.name for f in self.tmp.iterdir()), [
+            'bundle.tar.gz', 'bundle.tar.gz.gpg', 'bundle.tar.gz.manifest.json', 'bundle.tar.xz', 'bundle.tar.xz.manifest.json', 'password.txt'])
+        self.assertEqual(encryptor.decrypt_file(self.tmp / 'bundle.tar.gz.gpg'), (self.tmp / 'bundle.tar.gz').read_bytes())
+        with tarfile.open(self.tmp / 'bundle.tar.xz') as xz, tarfile.open(self.tmp / 'bundle.tar.gz') as gz:
+            self.assertEqual(xz.getnames(), gz.getnames())
+            self.assertEqual(xz.extractfile('root/data.bin').read(), gz.extractfile('root/data.bin').read())  # type: ignore
+
+    def test_guestfish_member_names(self) -> None:
+        # guestfish tar-out archives "." of the guest file system
+        content = self._convert('bundle.tar.gz', {'etc/crontab': b'# crontab', 'root/data.bin': b'data'}, prefix='./')
+        self.assertEqual(content['etc/crontab'], b'# crontab\n@reboot root /cloud-scripts/install-hetzner-cloud.sh\n')
+        self.assertIn('root/data.bin', content)
+        self.assertNotIn('.', content)
+
+    def _members(self, tar_format: int, prefix: str) -> io.BytesIO:
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w', format=tar_format) as tar:
+            for name, data in [('usr/bin/tool', b'tool' * 1000), ('var/big.img', bytes(3 * 1024 * 1024 + 7)),
+                               ('usr/share/' + 'long/' * 30 + 'file', b'long name'), ('root/.bash_profile', b'/root/setup-network.py\n')]:
+                info = tarfile.TarInfo(prefix + name)
+                info.size = len(data)
+                info.mode = 0o751
+                info.uid = 1000
+                tar.addfile(info, io.BytesIO(data))
+            link = tarfile.TarInfo(prefix + 'usr/bin/tool2')
+            link.type = tarfile.LNKTYPE
+            link.linkname = prefix + 'usr/bin/tool'
+            tar.addfile(link)
+            symlink = tarfile.TarInfo(prefix + 'usr/bin/sym')
+            symlink.type = tarfile.SYMTYPE
+            symlink.linkname = './tool'
+            tar.addfile(symlink)
+        buffer.seek(0)
+        return buffer
+
+    def test_members_copied_unchanged(self) -> None:
+        self.addCleanup(setattr, MemberHasher, 'threaded_size', MemberHasher.threaded_size)
+        MemberHasher.threaded_size = 1024
+        for tar_format in (tarfile.GNU_FORMAT, tarfile.PAX_FORMAT, tarfile.USTAR_FORMAT):
+            for prefix in ('', './'):
+                output = self.tmp / 'bundle.tar.gz'
+                source = self._members(tar_format, prefix)
+                converter = ArchiveCloudConverter([BundleOutput(get_compressor('gzip'), plain_file=output)], checksum_jobs=2)
+                converter.convert(source)
+                source.seek(0)
+                with tarfile.open(fileobj=source) as expected, tarfile.open(output) as tar:
+                    members = {m.name: m for m in tar}
+                    for member in expected:
+                        name = member.name.removeprefix(prefix)
+                        self.assertEqual(members[name].mode, member.mode)
+                        self.assertEqual(members[name].uid, member.uid)
+                        if member.isfile() and name != 'root/.bash_profile':
+                            data = expected.extractfile(member).read()  # type: ignore
+                            self.assertEqual(tar.extractfile(members[name]).read(), data)  # type: ignore
+                            self.assertEqual(converter.checksums[name], hashlib.sha256(data).hexdigest())
+                    self.assertEqual(members['usr/bin/tool2'].linkname, 'usr/bin/tool')
+                    self.assertEqual(members['usr/bin/sym'].linkname, './tool')
+                    self.assertEqual(tar.extractfile('root/.bash_profile').read(), b'/root/setup-password.py --check\n')  # type: ignore
+                    self.assertEqual(converter.checksums['root/.bash_profile'], hashlib.sha256(b'/root/setup-password.py --check\n').hexdigest())
+
+
+class OvaExtractorTests(TestCase):
+    def test_ova_consumers(self) -> None:
+        tmp = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        disk = bytes(range(256)) * 10000
+        with tarfile.open(tmp / 'vulnbox.ova', 'w') as ova:
+            info = tarfile.TarInfo('vulnbox-disk001.vmdk')
+            info.size = len(disk)
+            ova.addfile(info, io.BytesIO(disk))
+        (tmp / 'extract').mkdir()
+        consumer = OvaConsumer(['sh', '-c', f'cat > {tmp / "copy.ova"}'], tmp / 'copy.ova', 'copy')
+        extractor = OvaExtractor(tmp / 'vulnbox.ova', tmp / 'extract', [consumer])
+        self.assertEqual(extractor._extract_stage, 'extract ova + copy')
+        vmdk = extractor._extract_ova()
+        self.assertEqual(vmdk.read_bytes(), disk)
+        self.assertEqual((tmp / 'copy.ova').read_bytes(), (tmp / 'vulnbox.ova').read_bytes())
+
+    def test_failed_ova_consumer(self) -> None:
+        tmp = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        with tarfile.open(tmp / 'vulnbox.ova', 'w') as ova:
+            info = tarfile.TarInfo('vulnbox-disk001.vmdk')
+            ova.addfile(info, io.BytesIO())
+        (tmp / 'extract').mkdir()
+        consumer = OvaConsumer(['sh', '-c', f'cat > {tmp / "copy.ova"}; exit 2'], tmp / 'copy.ova', 'copy')
+        with self.assertRaises(subprocess.CalledProcessError):
+            OvaExtractor(tmp / 'vulnbox.ova', tmp / 'extract', [consumer])._extract_ova()
+        self.assertFalse((tmp / 'copy.ova').exists())
+
+    def test_ova_consumer_exits_early(self) -> None:
+        tmp = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        disk = bytes(range(256)) * 20000
+        with tarfile.open(tmp / 'vulnbox.ova', 'w') as ova:
+            info = tarfile.TarInfo('vulnbox-disk001.vmdk')
+            info.size = len(disk)
+            ova.addfile(info, io.BytesIO(disk))
+        (tmp / 'extract').mkdir()
+        # like 7z failing right away, the pipe breaks while the ova is written to it.
+        # Small reads leave data in the pipe's write buffer, closing it raises again.
+        self.enterContext(mock.patch('vulnbuild.converter.cloud_bundle.COPY_BUFSIZE', 4096))
+        consumer = OvaConsumer(['sh', '-c', f'echo partial > {tmp / "copy.ova"}; exit 2'], tmp / 'copy.ova', 'copy')
+        with self.assertRaises(subprocess.CalledProcessError):
+            OvaExtractor(tmp / 'vulnbox.ova', tmp / 'extract', [consumer])._extract_ova()
+        self.assertFalse((tmp / 'copy.ova').exists())
+
+
+    def test_stdout_of_keeps_the_error(self) -> None:
+        tmp = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        extractor = OvaExtractor(tmp / 'vulnbox.ova', tmp)
+        with self.assertRaisesRegex(ValueError, 'filter failed'):
+            with extractor._stdout_of(subprocess.Popen(['yes'], stdout=subprocess.PIPE)) as stream:
+                stream.read(10)
+                raise ValueError('filter failed')
+        with self.assertRaises(subprocess.CalledProcessError):
+            with extractor._stdout_of(subprocess.Popen(['sh', '-c', 'echo x; exit 3'], stdout=subprocess.PIPE)) as stream:
+                stream.read()
+
+
+class GuestfishExtractorTests(TestCase):
+    def test_excludes(self) -> None:
+        tmp = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        extractor = GuestfishExtractor(tmp / 'vulnbox.ova', tmp)
+        cmd = extractor.tar_out_command(tmp / 'disk.vmdk')
+        self.assertEqual(cmd[:4], ['guestfish', '--ro', '-a', str(tmp / 'disk.vmdk')])
+        excludes = cmd[-1].removeprefix('excludes:').split(' ')
+        # guestfish runs "tar -C /sysroot -cf - --exclude=... ." in its appliance
+        root = tmp / 'root'
+        for name in ('proc/1/status', 'tmp/x', 'var/tmp/y', 'root/setup-network.py', 'root/.bashrc'):
+            (root / name).parent.mkdir(parents=True, exist_ok=True)
+            (root / name).write_text(name)
+        data = subprocess.check_output(['tar', '-C', str(root), '-cf', '-'] + [f'--exclude={e}' for e in excludes] + ['.'])
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r') as tar:
+            files = sorted(m.name for m in tar if m.isfile())
+        self.assertEqual(files, ['./root/.bashrc', './var/tmp/y'])
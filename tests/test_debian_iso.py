@@ -0,0 +1,57 @@
+import hashlib
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import requests
+
+from tests.utils.cases import TestCase
+from vulnbuild.hcl.parser import HclParser
+from vulnbuild.project import ProjectConfig
+from vulnbuild.utils.initial_checks import ProbeCache
+from vulnbuild.vmbuilder.backends import backend
+from vulnbuild.vmbuilder.backends.virtualbox import VirtualboxBackend
+from vulnbuild.vmbuilder.debian_iso import DebianIsoStore
+
+
+class DebianIsoStoreTests(TestCase):
+    def setUp(self) -> None:
+        self.root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.store = DebianIsoStore(self.root / 'iso')
+        self.enterContext(mock.patch.object(backend, 'debian_iso_store', return_value=self.store))
+        self.enterContext(mock.patch.object(backend, 'probe_cache', ProbeCache(self.root / 'probes.json')))
+
+    def _add_iso(self, version: str, content: bytes = b'iso content') -> None:
+        iso = self.store.iso_path(version)
+        iso.parent.mkdir(parents=True)
+        iso.write_bytes(content)
+        self.store.checksums_path(version).write_text(f'{hashlib.sha512(b"iso content").hexdigest()}  {iso.name}\n')
+
+    def test_local_iso(self) -> None:
+        self._add_iso('12.9.0')
+        self._add_iso('12.10.0')
+        self._add_iso('12.8.0', b'corrupted')
+        self.assertEqual(self.store.local_iso('12.9.0'), self.store.iso_path('12.9.0'))
+        self.assertIsNone(self.store.local_iso('12.8.0'))
+        self.assertEqual(self.store.versions(), ['12.10.0', '12.9.0'])
+
+    def test_offline_version_resolution(self) -> None:
+        self._add_iso('12.9.0')
+        with mock.patch('requests.get', side_effect=requests.ConnectionError('offline')):
+            self.assertEqual(backend.get_current_debian_version.__wrapped__(), '12.9.0')  # type: ignore
+            backend.probe_cache.set('debian_version', '12.10.0')
+            with mock.patch('time.time', return_value=2 ** 40):  # cached version is outdated, but better than nothing
+                self.assertEqual(backend.get_current_debian_version.__wrapped__(), '12.10.0')  # type: ignore
+
+    def test_packer_uses_local_iso(self) -> None:
+        self._add_iso('12.9.0')
+        hcl = HclParser.parse('''
+            source "virtualbox-iso" "debian" {
+                iso_checksum = "file:https://cdimage.debian.org/cdimage/release/${var.debian_version}/amd64/iso-cd/SHA512SUMS"
+                iso_url = "https://cdimage.debian.org/cdimage/release/${var.debian_version}/amd64/iso-cd/debian-${var.debian_version}-amd64-netinst.iso"
+            }
+        ''')
+        VirtualboxBackend(ProjectConfig(self.root))._use_local_iso(hcl, {'debian_version': '12.9.0'})
+        source = hcl.get_blocks('source')[0]
+        self.assertEqual(source.get_argument('iso_url').get_raw_value(), self.store.iso_path('12.9.0').as_uri())  # type: ignore
+        self.assertEqual(source.get_argument('iso_checksum').get_raw_value(), f'sha512:{hashlib.sha512(b"iso content").hexdigest()}')  # type: ignore
@@ -1,14 +1,21 @@
+import io
+import os
 import re
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
 
 from tests.utils.cases import TestCase
 from vulnbuild.config import GlobalConfig
+from vulnbuild.hcl.hcl import HclFile, HclEntity, HclBlock, HclArgument, HclValue
 from vulnbuild.hcl.parser import HclParser
 
 
 class HclTests(TestCase):
     def _prepare_for_comparison(self, s: str) -> str:
-        s = re.sub(r'#[^n]*\n', '\n', s)
-        s = re.sub('\s+', '', s)
+        s = re.sub(r'#[^\n]*\n', '\n', s)
+        s = re.sub(r'\s+', '', s)
         s = s.replace(',]', ']').replace(',}', '}')
         return s
 
@@ -48,3 +55,68 @@ class HclTests(TestCase):
         print('\n', f)
         txt2 = f.to_string()
         self.assertEqual(txt, txt2)
+
+    def test_parse_file_cache(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            f = Path(tmp) / 'test.pkr.hcl'
+            f.write_text('a = 1')
+            hcl = HclParser.parse_file(f)
+            self.assertIs(hcl, HclParser.parse_file(f))
+            f.write_text('a = 22')
+            os.utime(f, ns=(0, 0))
+            self.assertEqual(HclParser.parse_file(f).to_string(), 'a = 22')
+
+    def test_clone(self) -> None:
+        hcl = HclParser.parse('source "docker" "x" {\n  a = [1, {b = "c"}]\n}\n')
+        clone = hcl.clone()
+        self.assertEqual(hcl, clone)
+        clone.get_blocks('source')[0].set_argument('a', 2)
+        clone.get_blocks('source')[0].labels.append('y')
+        self.assertNotEqual(hcl.to_string(), clone.to_string())
+        self.assertEqual(hcl.get_blocks('source')[0].labels, ['docker', 'x'])
+
+    def test_disk_cache(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(HclParser, 'cache_dir', Path(tmp) / 'cache'):
+            source = Path(tmp) / 'a.pkr.hcl'
+            hcl = HclParser.parse('a = "disk cache"', source)
+            self.assertEqual(len(list((Path(tmp) / 'cache').glob('*.pickle'))), 1)
+            with mock.patch.object(HclParser, '_parse', side_effect=AssertionError('cache not used')):
+                self.assertEqual(HclParser.parse('a = "disk cache"', source), hcl)
+            # a new version of the file replaces the old one in the cache
+            HclParser.parse('a = "changed"', source)
+            HclParser.parse('a = "other file"', Path(tmp) / 'b.pkr.hcl')
+            self.assertEqual(len(list((Path(tmp) / 'cache').glob('*.pickle'))), 2)
+            with mock.patch.object(HclParser, '_parse', side_effect=AssertionError('cache not used')):
+                self.assertEqual(HclParser.parse('a = "changed"', source).to_string(), 'a = "changed"')
+
+    def _large_template(self, blocks: int, lines: int) -> HclFile:
+        provisioners: list[HclEntity] = [
+            HclBlock('provisioner', ['shell'], [
+                HclArgument('inline', HclValue([f'echo "line {j} of service {i}" >> /root/install.log' for j in range(lines)])),
+                HclArgument('environment_vars', HclValue({'SERVICE': f'service{i}', 'INDEX': i})),
+            ]) for i in range(blocks)
+        ]
+        children: list[HclEntity] = [HclArgument('sources', HclValue(['source.docker.vulnbox']))]
+        return HclFile([HclBlock('build', [], children + provisioners)])
+
+    def test_large_template_roundtrip(self) -> None:
+        hcl = self._large_template(30, 20)
+        txt = hcl.to_string()
+        with mock.patch.object(HclParser, 'cache_dir', None):
+            self.assertEqual(HclParser.parse(txt).to_string(), txt)
+
+    def test_large_template_write(self) -> None:
+        hcl = self._large_template(300, 100)
+        t = time.perf_counter()
+        out = io.StringIO()
+        hcl.write(out)
+        # 1.6 MB, takes well below 0.1s. The bound only catches a return to quadratic string concatenation.
+        self.assertLess(time.perf_counter() - t, 2.0)
+        txt = out.getvalue()
+        self.assertEqual(txt, hcl.to_string())
+        self.assertEqual(txt.count('provisioner "shell" {'), 300)
+        with tempfile.TemporaryDirectory() as tmp:
+            f = Path(tmp) / 'temp-large.pkr.hcl'
+            with f.open('w') as fh:
+                hcl.write(fh)
+            self.assertEqual(f.read_text(), txt)
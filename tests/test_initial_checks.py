@@ -0,0 +1,61 @@
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+from tests.utils.cases import TestCase
+from vulnbuild.project import ProjectConfig
+from vulnbuild.utils.initial_checks import ProbeCache, InitialCheckers
+
+
+def _slow_check() -> None:
+    time.sleep(0.3)
+
+
+def _slow_probe() -> bool:
+    time.sleep(0.3)
+    return True
+
+
+def _failing_check() -> None:
+    raise Exception('Tool missing: Test')
+
+
+class ProbeCacheTests(TestCase):
+    def test_ttl(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ProbeCache(Path(tmp) / 'probes.json')
+            self.assertIsNone(cache.get('tool', 60))
+            cache.set('tool', True)
+            self.assertTrue(ProbeCache(Path(tmp) / 'probes.json').get('tool', 60))  # persisted
+            with mock.patch('time.time', return_value=time.time() + 120):
+                self.assertIsNone(cache.get('tool', 60))
+
+
+class InitialCheckersTests(TestCase):
+    def setUp(self) -> None:
+        self.checkers = InitialCheckers(ProjectConfig(Path('/tmp/project'), vm_builder='virtualbox'))
+        self.enterContext(mock.patch('vulnbuild.utils.initial_checks._probe_apt_cacher_ng', _slow_probe))
+        self.enterContext(mock.patch.object(InitialCheckers, '_prefetches', return_value=[_slow_check]))
+
+    def test_concurrent_probes(self) -> None:
+        # the three checks and the apt-cacher-ng probe only pass the barrier if they all run at the same time
+        barrier = threading.Barrier(4, timeout=10)
+
+        def check() -> None:
+            barrier.wait()
+
+        def probe() -> bool:
+            barrier.wait()
+            return True
+
+        with mock.patch.object(InitialCheckers, '_required_programs', return_value=[check] * 3), \
+                mock.patch('vulnbuild.utils.initial_checks._probe_apt_cacher_ng', probe):
+            self.checkers.check_required_programs()
+        self.assertTrue(self.checkers._apt_cacher_ng)
+
+    def test_missing_program(self) -> None:
+        with mock.patch.object(InitialCheckers, '_required_programs', return_value=[_slow_check, _failing_check]):
+            with self.assertRaisesRegex(Exception, 'Tool missing'):
+                self.checkers.check_required_programs()
@@ -0,0 +1,90 @@
+import hashlib
+import io
+import random
+import tarfile
+import tempfile
+from pathlib import Path
+
+from tests.utils.cases import TestCase
+from vulnbuild.converter.cloud_bundle import ArchiveCloudConverter, BundleOutput
+from vulnbuild.converter.compression import XzCompressor, compressor_for_file
+from vulnbuild.converter.manifest import BundleManifest
+
+
+def _archive(files: dict[str, tuple[bytes, int]]) -> io.BytesIO:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for name, (content, mode) in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mode = mode
+            tar.addfile(info, io.BytesIO(content))
+        link = tarfile.TarInfo('etc/link')
+        link.type = tarfile.SYMTYPE
+        link.linkname = 'hostname'
+        tar.addfile(link)
+    buffer.seek(0)
+    return buffer
+
+
+class BundleManifestTests(TestCase):
+    def setUp(self) -> None:
+        self.tmp = Path(self.enterContext(tempfile.TemporaryDirectory()))
+
+    def _bundle(self, name: str, files: dict[str, tuple[bytes, int]]) -> BundleManifest:
+        output = self.tmp / name
+        ArchiveCloudConverter([BundleOutput(compressor_for_file(name), plain_file=output)], checksum_jobs=1).convert(_archive(files))
+        return BundleManifest.load(BundleManifest.manifest_file(output))
+
+    def test_manifest_written(self) -> None:
+        manifest = self._bundle('a.tar.gz', {'etc/hostname': (b'vulnbox\n', 0o644), 'etc/crontab': (b'# crontab', 0o600)})
+        self.assertTrue((self.tmp / 'a.tar.gz.manifest.json').exists())
+        hostname = manifest.entries['etc/hostname']
+        self.assertEqual((hostname.mode, hostname.size), (0o644, 8))
+        self.assertEqual(hostname.digest, hashlib.sha256(b'vulnbox\n').hexdigest())
+        self.assertEqual(manifest.entries['etc/link'].digest, 'hostname')
+        self.assertEqual(manifest.entries['etc/crontab'].size, len(b'# crontab\n@reboot root /cloud-scripts/install-hetzner-cloud.sh\n'))
+        self.assertEqual(len(manifest.entries['cloud-scripts/install-hetzner-cloud.sh'].digest), 64)
+
+    def test_diff(self) -> None:
+        old = self._bundle('old.tar.gz', {'etc/hostname': (b'vulnbox\n', 0o644), 'etc/motd': (b'hi', 0o644), 'bin/x': (b'x', 0o755)})
+        new = self._bundle('new.tar.gz', {'etc/hostname': (b'testbox\n', 0o644), 'etc/issue': (b'hi', 0o644), 'bin/x': (b'x', 0o700)})
+        self.assertEqual(new.diff(old), {
+            'bin/x': 'mode 755 -> 700',
+            'etc/hostname': 'content',
+            'etc/issue': 'A',
+            'etc/motd': 'D',
+        })
+        self.assertEqual(new.diff(new), {})
+
+    def test_read_file(self) -> None:
+        output = self.tmp / 'a.tar.xz'
+        big = random.Random(1).randbytes(3 * 1024 * 1024)
+        files = {'etc/hostname': (b'vulnbox\n', 0o644), 'var/big': (big, 0o644), 'etc/crontab': (b'# crontab', 0o600)}
+        compressor = XzCompressor(block_size=1024 * 1024)
+        ArchiveCloudConverter([BundleOutput(compressor, plain_file=output)], checksum_jobs=1).convert(_archive(files))
+        manifest = BundleManifest.load(BundleManifest.manifest_file(output))
+        self.assertGreaterEqual(len(manifest.blocks), 3)
+        self.assertEqual(manifest.read_file(output, '/var/big'), big)
+        self.assertEqual(manifest.read_file(output, 'etc/hostname'), b'vulnbox\n')
+        self.assertTrue(manifest.read_file(output, 'etc/crontab').endswith(b'install-hetzner-cloud.sh\n'))
+        with self.assertRaises(ValueError):
+            manifest.read_file(output, 'etc/link')
+        # without block table and offsets
+        manifest.blocks = []
+        self.assertEqual(manifest.read_file(output, 'var/big'), big)
+        manifest.entries['etc/hostname'].offset = -1
+        self.assertEqual(manifest.read_file(output, 'etc/hostname'), b'vulnbox\n')
+
+    def test_outdated_manifest(self) -> None:
+        output = self.tmp / 'a.tar.gz'
+        files = {'etc/hostname': (b'vulnbox\n', 0o644)}
+        manifest = self._bundle('a.tar.gz', files)
+        self.assertEqual(manifest.read_file(output, 'etc/hostname'), b'vulnbox\n')
+        with open(output, 'ab') as f:
+            f.write(b'\0')
+        with self.assertRaises(ValueError):
+            manifest.read_file(output, 'etc/hostname')
+        # a bundle without manifest removes the one of its predecessor
+        ArchiveCloudConverter([BundleOutput(compressor_for_file(output.name), plain_file=output)]).convert(_archive(files))
+        self.assertFalse(BundleManifest.manifest_file(output).exists())
@@ -0,0 +1,84 @@
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from tests.utils.cases import TestCase
+from vulnbuild.services.cache import ServiceBuildCache
+from vulnbuild.services.package_cache import PackageCacheVolumes
+from vulnbuild.utils.hashing import tree_digest
+
+
+class ServiceBuildCacheTests(TestCase):
+    def setUp(self) -> None:
+        self.root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.cache = ServiceBuildCache(self.root / 'cache', max_entries=2)
+
+    def _build(self, digest: str, content: str) -> None:
+        staging = self.cache.staging_dir('svc', digest)
+        staging.mkdir(parents=True)
+        (staging / 'install.sh').write_text(content)
+        self.cache.add('svc', digest)
+        self.cache.activate('svc', digest)
+
+    def test_activate_and_restore(self) -> None:
+        self._build('aaa', 'first')
+        self._build('bbb', 'second')
+        self.assertEqual(self.cache.active_digest('svc'), 'bbb')
+        self.assertEqual((self.cache.active_dir('svc') / 'install.sh').read_text(), 'second')
+        self.assertIsNotNone(self.cache.lookup('svc', 'aaa'))
+        self.cache.activate('svc', 'aaa')
+        self.assertEqual(self.cache.active_digest('svc'), 'aaa')
+        self.assertEqual((self.cache.active_dir('svc') / 'install.sh').read_text(), 'first')
+
+    def test_lru_eviction(self) -> None:
+        for i, digest in enumerate(['aaa', 'bbb', 'ccc']):
+            self._build(digest, digest)
+            os.utime(self.cache.entry('svc', digest), (i, i))
+        self.cache.lookup('svc', 'aaa')  # aaa is now the most recently used build
+        evicted = self.cache.evict('svc')
+        self.assertEqual([e.name for e in evicted], ['bbb'])
+        self.assertEqual([e.name for e in self.cache.entries('svc')], ['aaa', 'ccc'])
+
+    def test_tree_digest(self) -> None:
+        folder = self.root / 'service'
+        (folder / '.git').mkdir(parents=True)
+        (folder / 'build.sh').write_text('echo 1')
+        digest = tree_digest(folder)
+        (folder / '.git' / 'HEAD').write_text('ref: refs/heads/other')
+        self.assertEqual(digest, tree_digest(folder))
+        (folder / 'build.sh').write_text('echo 2')
+        self.assertNotEqual(digest, tree_digest(folder))
+        (folder / 'build.sh').write_text('echo 1')
+        self.assertEqual(digest, tree_digest(folder))
+        (folder / 'build.sh').chmod(0o755)
+        self.assertNotEqual(digest, tree_digest(folder))
+
+    def test_tree_digest_symlinked_folder(self) -> None:
+        folder = self.root / 'service'
+        (folder / 'a').mkdir(parents=True)
+        (folder / 'b').mkdir()
+        (folder / 'data').symlink_to('a')
+        digest = tree_digest(folder)
+        (folder / 'data').unlink()
+        self.assertNotEqual(digest, tree_digest(folder))
+        (folder / 'data').symlink_to('b')
+        self.assertNotEqual(digest, tree_digest(folder))
+
+
+class PackageCacheVolumesTests(TestCase):
+    def test_docker_args(self) -> None:
+        volumes = PackageCacheVolumes()
+        with mock.patch('subprocess.check_call') as check_call:
+            args = volumes.docker_args('saarsec/saarctf-ci-base:latest')
+            volumes.docker_args('saarsec/saarctf-ci-base:latest')
+        self.assertEqual(check_call.call_count, len(PackageCacheVolumes.paths))  # volumes are created once
+        self.assertIn('vulnbuild-cache-saarsec_saarctf-ci-base_latest-pip:/root/.cache/pip', args)
+        self.assertIn('vulnbuild-cache-saarsec_saarctf-ci-base_latest-apt:/var/cache/apt/archives', args)
+
+    def test_no_apt_for_concurrent_builds(self) -> None:
+        volumes = PackageCacheVolumes(include_apt=False)
+        with mock.patch('subprocess.check_call'):
+            args = volumes.docker_args('debian')
+        self.assertFalse(any(arg.endswith(':/var/cache/apt/archives') for arg in args))
+        self.assertIn('vulnbuild-cache-debian-npm:/root/.npm', args)
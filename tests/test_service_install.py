@@ -0,0 +1,117 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from tests.utils.cases import TestCase
+from vulnbuild.project import CompressionConfig
+from vulnbuild.services.cache import ServiceBuildCache
+from vulnbuild.services.services import Service
+from vulnbuild.vmbuilder.actions import ServiceAction, ServiceBatchAction
+
+
+class ServiceBatchActionTests(TestCase):
+    def setUp(self) -> None:
+        self.root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.cache = ServiceBuildCache(self.root / 'cache')
+        self.vm_tmp = self.root / 'vm'
+        self.vm_tmp.mkdir()
+        self.enterContext(mock.patch.object(ServiceBatchAction, 'apt_lock_config', str(self.root / 'apt.conf.d' / 'lock')))
+
+    def _service(self, name: str, install: str) -> ServiceAction:
+        staging = self.cache.staging_dir(name, 'digest')
+        (staging / 'gamelib' / 'ci' / 'buildscripts').mkdir(parents=True)
+        (staging / 'gamelib' / 'ci' / 'buildscripts' / 'prepare-install.sh').write_text('export SERVICE_PREPARED=1\n')
+        (staging / 'gamelib' / 'ci' / 'buildscripts' / 'post-install.sh').write_text('#!/bin/sh\necho post-install\n')
+        (staging / 'install.sh').write_text(f'#!/bin/bash\nset -e\necho "prepared=$SERVICE_PREPARED"\n{install}\n')
+        for f in ['install.sh', 'gamelib/ci/buildscripts/post-install.sh']:
+            (staging / f).chmod(0o755)
+        self.cache.add(name, 'digest')
+        self.cache.activate(name, 'digest')
+        return ServiceAction(Service(name, self.root / 'services' / name), self.cache.active_dir(name))
+
+    def _install(self, action: ServiceBatchAction) -> subprocess.CompletedProcess:
+        action.prepare()
+        upload, shell = action.provisioners(tmp_dir=str(self.vm_tmp))
+        (self.vm_tmp / action.bundle.name).write_bytes(Path(upload.children[0].get_raw_value()).read_bytes())  # type: ignore
+        script = '\n'.join(shell.get_argument('inline').get_raw_value())  # type: ignore
+        return subprocess.run(['bash', '-e', '-c', script], capture_output=True, text=True)
+
+    def test_install_all(self) -> None:
+        action = ServiceBatchAction([self._service('svc1', 'echo one'), self._service('svc2', 'echo two')],
+                                    self.root / 'cache' / 'services.tar.gz', CompressionConfig())
+        result = self._install(action)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('[svc1] prepared=1\n[svc1] one\n[svc1] post-install\n', result.stdout)
+        self.assertIn('[svc2] two\n', result.stdout)
+        self.assertFalse((self.vm_tmp / 'vulnbuild-services').exists())
+
+    def test_failed_install_stops(self) -> None:
+        action = ServiceBatchAction([self._service('svc1', 'false'), self._service('svc2', 'echo two')],
+                                    self.root / 'cache' / 'services.tar.gz', CompressionConfig())
+        result = self._install(action)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertNotIn('post-install', result.stdout)
+        self.assertNotIn('svc2', result.stdout)
+
+    def test_bundle_reused(self) -> None:
+        action = ServiceBatchAction([self._service('svc1', 'echo one')], self.root / 'cache' / 'services.tar.gz', CompressionConfig())
+        action.prepare()
+        mtime = action.bundle.stat().st_mtime_ns
+        action.prepare()
+        self.assertEqual(action.bundle.stat().st_mtime_ns, mtime)
+        fingerprint = action.fingerprint({})
+        (self.cache.root / 'svc1.digest').write_text('other\n')
+        self.assertNotEqual(action.fingerprint({}), fingerprint)
+
+    def test_parallel_install(self) -> None:
+        # each service waits until the other one has started
+        wait_for = 'for i in $(seq 50); do [ -f {0}/started-{1} ] && break; sleep 0.1; done; [ -f {0}/started-{1} ]'
+        services = [
+            self._service('svc1', f'touch {self.root}/started-svc1; {wait_for.format(self.root, "svc2")}; echo one'),
+            self._service('svc2', f'touch {self.root}/started-svc2; {wait_for.format(self.root, "svc1")}; echo two'),
+        ]
+        action = ServiceBatchAction(services, self.root / 'cache' / 'services.tar.gz', CompressionConfig(), jobs=2)
+        result = self._install(action)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        self.assertIn('[svc1] one\n', result.stdout)
+        self.assertIn('[svc2] two\n', result.stdout)
+
+    def test_parallel_install_failure(self) -> None:
+        services = [self._service('svc1', 'false'), self._service('svc2', 'echo two'), self._service('svc3', 'exit 3')]
+        action = ServiceBatchAction(services, self.root / 'cache' / 'services.tar.gz', CompressionConfig(), jobs=2)
+        result = self._install(action)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('[svc2] post-install\n', result.stdout)
+        self.assertNotIn('[svc1] post-install', result.stdout)
+        self.assertIn('Installation failed: svc1 svc3', result.stdout)
+
+    def test_parallel_install_locks_package_managers(self) -> None:
+        if shutil.which('dpkg') is None or shutil.which('flock') is None:
+            self.skipTest('dpkg / flock not installed')
+        services = [self._service('svc1', 'cat $(command -v dpkg)')]
+        action = ServiceBatchAction(services, self.root / 'cache' / 'services.tar.gz', CompressionConfig(), jobs=2)
+        result = self._install(action)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        self.assertIn('exec flock /run/lock/vulnbuild-apt.lock', result.stdout)
+
+    def test_parallel_install_nested_package_managers(self) -> None:
+        if shutil.which('flock') is None:
+            self.skipTest('flock not installed')
+        # like dpkg, called from maintainer scripts while apt-get holds the lock
+        tools = self.root / 'tools'
+        tools.mkdir()
+        (tools / 'outer-tool').write_text('#!/bin/sh\ninner-tool\n')
+        (tools / 'inner-tool').write_text('#!/bin/sh\necho inner\n')
+        for tool in tools.iterdir():
+            tool.chmod(0o755)
+        self.enterContext(mock.patch.dict(os.environ, {'PATH': f'{tools}:{os.environ["PATH"]}'}))
+        self.enterContext(mock.patch.object(ServiceBatchAction, 'locked_tools', {'test': ['outer-tool', 'inner-tool']}))
+        services = [self._service('svc1', 'timeout 20 outer-tool'), self._service('svc2', 'timeout 20 inner-tool')]
+        action = ServiceBatchAction(services, self.root / 'cache' / 'services.tar.gz', CompressionConfig(), jobs=2)
+        result = self._install(action)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        self.assertIn('[svc1] inner\n', result.stdout)
+        self.assertIn('[svc2] inner\n', result.stdout)
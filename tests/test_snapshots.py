@@ -0,0 +1,55 @@
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from tests.utils.cases import TestCase
+from vulnbuild.project import ProjectConfig
+from vulnbuild.vmbuilder.actions import PackerAction
+from vulnbuild.vmbuilder.backends.containers import DockerBackend
+from vulnbuild.vmbuilder.build_targets import VmBuildTarget
+
+
+class PackerActionFingerprintTests(TestCase):
+    def setUp(self) -> None:
+        self.root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(mock.patch('builtins.print'))
+
+    def _action(self, source: str) -> PackerAction:
+        f = self.root / 'scripts' / '40_upload.packer.pkr.hcl'
+        f.parent.mkdir(exist_ok=True)
+        f.write_text(f'provisioner "file" {{\n    source      = "{source}"\n    destination = "/root/x"\n}}\n')
+        return PackerAction.from_file(f)
+
+    def test_relative_source(self) -> None:
+        # relative to the template, not to the working directory
+        action = self._action('upload.txt')
+        (self.root / 'scripts' / 'upload.txt').write_text('one')
+        fingerprint = action.fingerprint({})
+        (self.root / 'scripts' / 'upload.txt').write_text('two')
+        self.assertNotEqual(action.fingerprint({}), fingerprint)
+
+    def test_variable_source(self) -> None:
+        (self.root / 'upload.txt').write_text('one')
+        action = self._action('${var.base}/upload.txt')
+        fingerprint = action.fingerprint({'base': str(self.root)})
+        self.assertEqual(action.fingerprint({'base': str(self.root)}), fingerprint)
+        (self.root / 'upload.txt').write_text('two')
+        self.assertNotEqual(action.fingerprint({'base': str(self.root)}), fingerprint)
+
+    def test_unresolved_variable(self) -> None:
+        action = self._action('${var.unknown}/upload.txt')
+        self.assertNotEqual(action.fingerprint({}), action.fingerprint({}))  # never taken for unchanged
+
+
+class DockerSnapshotBaseTests(TestCase):
+    def test_base_image_id(self) -> None:
+        root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        template = root / 'vulnbox-docker.pkr.hcl'
+        template.write_text('source "docker" "vulnbox" {\n    image = "debian"\n}\n')
+        backend = DockerBackend(ProjectConfig(root))
+        target = VmBuildTarget('vulnbox', ProjectConfig(root), template)
+        with mock.patch('subprocess.call') as call, \
+                mock.patch('vulnbuild.vmbuilder.backends.containers.docker_image_id', side_effect=['sha256:aaa', 'sha256:bbb']):
+            self.assertEqual(backend.snapshot_base_id(target), 'sha256:aaa')
+            self.assertEqual(backend.snapshot_base_id(target), 'sha256:bbb')  # the tag moved
+        self.assertEqual(call.call_args.args[0], ['docker', 'pull', '-q', 'debian'])
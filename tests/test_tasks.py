@@ -0,0 +1,69 @@
+import os
+import tempfile
+from dataclasses import replace
+from pathlib import Path
+
+from tests.utils.cases import TestCase
+from vulnbuild.config import GlobalConfig
+from vulnbuild.converter.cloud_bundle_encrypt import CloudBundleEncryptTask
+from vulnbuild.converter.release import ReleaseTask
+from vulnbuild.project import ProjectConfig
+from vulnbuild.tasks import TaskCreator
+
+
+class ConversionGraphTests(TestCase):
+    def setUp(self) -> None:
+        self.creator = TaskCreator(ProjectConfig.from_path(GlobalConfig.projects / 'saarctf-2023'))
+
+    def test_no_duplicates(self) -> None:
+        names = [task.fullname for task in self.creator.converter_tasks]
+        self.assertEqual(len(names), len(set(names)))
+
+    def test_chains_resolved(self) -> None:
+        graph = self.creator.converter_graph
+        for task in graph.tasks.values():
+            self.assertIn(task.base.fullname, graph.tasks.keys() | {t.fullname for t in self.creator.vms.values()}
+                          | {t.fullname for t in self.creator.service_tasks} | {'password', 'sshkey'})
+            self.assertIn(task, graph.derived_tasks(task.base))
+        self.assertIn('upload:vm:vulnbox:cloudbundle:gpg:saarsec', graph.tasks)
+        self.assertIn('vm:vulnbox:cloudbundle:zst:gpg', graph.tasks)
+
+    def test_artifact_store(self) -> None:
+        self.assertIsNone(self.creator.artifact_store)
+        project = ProjectConfig.from_path(GlobalConfig.projects / 'saarctf-2023')
+        project.artifact_store = True
+        creator = TaskCreator(project)
+        task = next(t for t in creator.get_converter_tasks() if t.get('basename') == 'vm:vulnbox:7z')
+        restore = task['uptodate'][0]
+        self.assertEqual(restore.args, (project.output_dir / 'vulnbox' / 'vulnbox.7z',))  # type: ignore
+        self.assertEqual(task['actions'][-1][0], creator._store_artifact)  # type: ignore
+
+    def test_release(self) -> None:
+        release = self.creator.converter_graph.tasks['vm:vulnbox:release']
+        assert isinstance(release, ReleaseTask)
+        self.assertEqual([m.fullname for m in release.members], ['vm:vulnbox:7z', 'vm:vulnbox:cloudbundle', 'vm:vulnbox:cloudbundle:gpg'])
+        self.assertNotIn('vm:testbox:release', self.creator.converter_graph.tasks)  # only the bundle, nothing to share
+        tasks = {t.get('basename'): t for t in self.creator.get_converter_tasks()}
+        self.assertEqual(tasks['vm:vulnbox:7z']['actions'][0][0], self.creator.release_converter.build_member)  # type: ignore
+        self.assertNotIn('vm:vulnbox:release', tasks['vm:vulnbox:7z']['task_dep'])
+        self.assertEqual(tasks['vm:vulnbox:release']['task_dep'], ['vm:vulnbox', 'password'])
+
+        project = ProjectConfig.from_path(GlobalConfig.projects / 'saarctf-2023')
+        project.release_fan_out = True
+        tasks = {t.get('basename'): t for t in TaskCreator(project).get_converter_tasks()}
+        for name in ('vm:vulnbox:7z', 'vm:vulnbox:cloudbundle', 'vm:vulnbox:cloudbundle:gpg'):
+            self.assertIn('vm:vulnbox:release', tasks[name]['task_dep'])
+        self.assertNotIn('vm:vulnbox:release', tasks['vm:vulnbox:cloudbundle:zst']['task_dep'])
+
+    def test_encrypted_bundle_outdated(self) -> None:
+        tmp = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        gpg_task = self.creator.converter_graph.tasks['vm:vulnbox:cloudbundle:gpg']
+        assert isinstance(gpg_task, CloudBundleEncryptTask)
+        task = replace(gpg_task, bundle_file=tmp / 'vulnbox.tar.xz')
+        converter = self.creator.task_builder(task)
+        self.assertFalse(converter.is_built(task))
+        (tmp / 'vulnbox.tar.xz.gpg').write_bytes(b'old')
+        self.assertTrue(converter.is_built(task))  # built without a plain bundle
+        (tmp / 'vulnbox.tar.xz').write_bytes(b'rebuilt')
+        os.utime(tmp / 'vulnbox.tar.xz.gpg', (1, 1))
+        self.assertFalse(converter.is_built(task))
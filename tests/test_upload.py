@@ -0,0 +1,88 @@
+import shutil
+import subprocess
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any
+from unittest import mock
+
+from tests.utils.cases import TestCase
+from vulnbuild.builds import BuildTask
+from vulnbuild.converter.upload import UploadScheduler, UploadTask
+from vulnbuild.project import ProjectConfig, UploadConfig
+
+
+class UploadSchedulerTests(TestCase):
+    def setUp(self) -> None:
+        self.root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.project = ProjectConfig(self.root)
+
+    def _task(self, filename: str, host: str, path: str, chmod: int | None = None) -> UploadTask:
+        f = self.root / filename
+        f.write_text(filename)
+        base = mock.Mock(spec=BuildTask)
+        return UploadTask(f'{filename}:{host}', self.project, base, f, UploadConfig(filename, host, path, chmod))
+
+    def test_rsync_command(self) -> None:
+        scheduler = UploadScheduler(jobs=4, bwlimit=10000)
+        self.addCleanup(scheduler.close)
+        cmd = scheduler.rsync_command(self._task('a.ova', 'server', '/srv/', 0o644))
+        self.assertIn('--chmod=F644', cmd)
+        self.assertIn('--bwlimit=2500', cmd)  # shared by 4 parallel uploads
+        self.assertIn('ControlMaster=auto', cmd[cmd.index('-e') + 1])
+        self.assertEqual(cmd[-2:], [str(self.root / 'a.ova'), 'server:/srv/'])
+        cmd = scheduler.rsync_command(self._task('b.ova', 'local', '/mnt/share/'))
+        self.assertNotIn('-e', cmd)
+        self.assertEqual(cmd[-1], '/mnt/share/')
+
+    def test_chunk_index_upload(self) -> None:
+        calls: list[list[str]] = []
+        scheduler = UploadScheduler()
+        self.addCleanup(scheduler.close)
+        for path in ['/srv/', '/srv/latest.ova']:
+            task = self._task('a.ova', 'server', path)
+            task.upload_config.chunk_index = True
+            with mock.patch('subprocess.check_call', lambda cmd, **kwargs: calls.append(cmd)), mock.patch('subprocess.call'):
+                scheduler.submit(task)
+        self.assertTrue((self.root / 'a.ova.chunks.json').exists())
+        uploads = [cmd[-2:] for cmd in calls if cmd[0] == 'rsync']
+        index = str(self.root / 'a.ova.chunks.json')
+        self.assertEqual(uploads[1], [index, 'server:/srv/'])
+        self.assertEqual(uploads[3], [index, 'server:/srv/latest.ova.chunks.json'])
+
+    def test_parallel_uploads_share_connections(self) -> None:
+        calls: list[list[str]] = []
+        lock = threading.Lock()
+
+        def check_call(cmd: list[str], **kwargs: Any) -> int:
+            with lock:
+                calls.append(cmd)
+            if cmd[0] == 'rsync' and cmd[-1] == 'b:/fail/':
+                raise subprocess.CalledProcessError(1, cmd)
+            return 0
+
+        scheduler = UploadScheduler(jobs=3)
+        self.addCleanup(scheduler.close)
+        with mock.patch('subprocess.check_call', check_call), mock.patch('subprocess.call'):
+            for i in range(4):
+                scheduler.submit(self._task(f'file{i}', 'a', '/srv/'))
+            scheduler.submit(self._task('file4', 'b', '/srv/'))
+            scheduler.submit(self._task('file5', 'b', '/fail/'))
+            with self.assertRaisesRegex(Exception, 'Upload failed: file5:b'):
+                scheduler.wait()
+        masters = [cmd[-2] for cmd in calls if cmd[0] == 'ssh']
+        self.assertEqual(sorted(masters), ['a', 'b'])  # one connection per host
+        self.assertEqual(len([cmd for cmd in calls if cmd[0] == 'rsync']), 6)
+        self.assertEqual(scheduler.failed, ['file5:b'])
+
+    def test_local_upload(self) -> None:
+        if shutil.which('rsync') is None:
+            self.skipTest('rsync not installed')
+        target = self.root / 'target'
+        target.mkdir()
+        scheduler = UploadScheduler(jobs=2)
+        for i in range(3):
+            scheduler.submit(self._task(f'file{i}', 'local', f'{target}/', 0o640))
+        scheduler.wait()
+        self.assertEqual(sorted(f.name for f in target.iterdir()), ['file0', 'file1', 'file2'])
+        self.assertEqual((target / 'file0').stat().st_mode & 0o777, 0o640)
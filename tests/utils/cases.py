@@ -2,6 +2,9 @@ import sys
 import unittest
 from contextlib import AbstractContextManager
 from typing import TypeVar, Any, Callable
+from unittest import mock
+
+from vulnbuild.hcl.parser import HclParser
 
 _T = TypeVar("_T")
 
@@ -29,3 +32,11 @@ class TestCase(unittest.TestCase):
         def enterContext(self, cm: AbstractContextManager[_T]) -> _T:
             result: _T = _enter_context(cm, self.addCleanup)
             return result
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        # tests must not leave parsed templates in the repository's .build_cache
+        patcher = mock.patch.object(HclParser, 'cache_dir', None)
+        patcher.start()
+        cls.addClassCleanup(patcher.stop)
@@ -1,12 +1,19 @@
 import json
 import os
 import sys
+from pathlib import Path
 from typing import Iterable
 
-import doit  # type: ignore
+from doit.cmd_base import ModuleTaskLoader  # type: ignore
+from doit.doit_cmd import DoitMain  # type: ignore
 
 from vulnbuild.config import GlobalConfig
-from vulnbuild.tasks import TaskCreatorFactory
+from vulnbuild.converter.manifest import BundleManifest
+from vulnbuild.project import ProjectConfig
+from vulnbuild.services.package_cache import PackageCacheVolumes
+from vulnbuild.tasks import TaskCreatorFactory, TaskCreator
+from vulnbuild.utils.artifact_store import ArtifactStore
+from vulnbuild.utils.timings import ENV_VARIABLE, load_timings, compare_timings
 
 
 def import_credentials() -> None:
@@ -50,14 +57,137 @@ class CliChecker:
                     raise ValueError(f'Target {repr(target)} must come before any service targets!')
 
 
+def compare_timings_main(args: list[str]) -> None:
+    if len(args) != 2:
+        print('USAGE: vulnbuild timings-compare <old.json> <new.json>', file=sys.stderr)
+        sys.exit(1)
+    print(compare_timings(load_timings(Path(args[0])), load_timings(Path(args[1]))), end='')
+
+
+def clean_package_cache_main() -> None:
+    volumes = PackageCacheVolumes.remove_all()
+    print(f'[*] Removed {len(volumes)} package cache volumes.')
+
+
+def _format_size(size: int) -> str:
+    return f'{size / 1024 / 1024 / 1024:.1f} GB'
+
+
+def stash_artifacts_main() -> None:
+    store = ArtifactStore(GlobalConfig.base / 'output')
+    freed = 0
+    for f in store.artifacts():
+        size = f.stat().st_size if f.is_file() else 0
+        if store.stash(f):
+            print(f'[-] Stashed {f.relative_to(store.output_root)}')
+            freed += size
+    print(f'[*] Freed {_format_size(freed)}, stored chunks use {_format_size(store.disk_usage())}.')
+
+
+def gc_artifacts_main(args: list[str]) -> None:
+    if len(args) > 1 or (args and not args[0].isdigit()):
+        print('USAGE: vulnbuild gc-artifacts [<versions to keep per artifact>]', file=sys.stderr)
+        sys.exit(1)
+    store = ArtifactStore(GlobalConfig.base / 'output', int(args[0]) if args else 3)
+    removed, freed = store.gc()
+    print(f'[*] Removed {removed} chunks ({_format_size(freed)}), stored chunks use {_format_size(store.disk_usage())}.')
+
+
+def _bundle_file(name: str, project_name: str) -> Path:
+    """A bundle given by filename or by task name (vm:vulnbox:cloudbundle)"""
+    if Path(name).exists() or not project_name:
+        return Path(name)
+    creator = TaskCreator(ProjectConfig.from_path(GlobalConfig.projects / project_name))
+    task = creator.converter_graph.tasks.get(name)
+    output = creator.task_builder(task).get_output_file(task) if task else None
+    if output is None:
+        raise ValueError(f'No task {repr(name)} with an output file in project {project_name}')
+    return output
+
+
+def _load_manifest(bundle: Path) -> BundleManifest:
+    f = bundle if bundle.name.endswith('.manifest.json') else BundleManifest.manifest_file(bundle)
+    if not f.exists() and not bundle.exists():
+        raise ValueError(f'{bundle} does not exist')
+    if not f.exists():
+        raise ValueError(f'No manifest for {bundle} (bundles built with cloud_bundle_manifest: false have none)')
+    manifest = BundleManifest.load(f)
+    bundle = f.with_name(f.name.removesuffix('.manifest.json'))
+    if bundle.exists():
+        manifest.check_bundle(bundle)  # the manifest of a deleted bundle is still good for diffs
+    return manifest
+
+
+def diff_main(args: list[str], project_name: str) -> None:
+    if len(args) != 2:
+        print('USAGE: vulnbuild [project=abc] diff <task or bundle> <old bundle>', file=sys.stderr)
+        sys.exit(1)
+    try:
+        new = _load_manifest(_bundle_file(args[0], project_name))
+        changes = new.diff(_load_manifest(Path(args[1])))
+    except ValueError as e:
+        print(f'[!] {str(e)}', file=sys.stderr)
+        sys.exit(1)
+    for name, change in changes.items():
+        if change in ('A', 'D'):
+            print(f'{change} {name}')
+        else:
+            print(f'M {name}  ({change})')
+    print(f'[*] {len(changes)} paths differ.')
+
+
+def cat_main(args: list[str], project_name: str) -> None:
+    if len(args) != 2:
+        print('USAGE: vulnbuild [project=abc] cat <task or bundle> <path>', file=sys.stderr)
+        sys.exit(1)
+    try:
+        bundle = _bundle_file(args[0], project_name)
+        data = _load_manifest(bundle).read_file(bundle, args[1])
+    except ValueError as e:
+        print(f'[!] {str(e)}', file=sys.stderr)
+        sys.exit(1)
+    sys.stdout.buffer.write(data)
+    sys.stdout.buffer.flush()
+
+
 def main() -> None:
     import_credentials()
+    args = sys.argv[1:]
+    if args and args[0] == 'timings-compare':
+        compare_timings_main(args[1:])
+        return
+    if args and args[0] == 'clean-package-cache':
+        clean_package_cache_main()
+        return
+    commands = [a for a in args if '=' not in a]
+    if commands and commands[0] == 'diff':
+        project_name = next((a[8:] for a in args if a.startswith('project=')), os.environ.get('PROJECT_NAME', ''))
+        diff_main(commands[1:], project_name)
+        return
+    if commands and commands[0] == 'cat':
+        project_name = next((a[8:] for a in args if a.startswith('project=')), os.environ.get('PROJECT_NAME', ''))
+        cat_main(commands[1:], project_name)
+        return
+    if args and args[0] == 'stash-artifacts':
+        stash_artifacts_main()
+        return
+    if args and args[0] == 'gc-artifacts':
+        gc_artifacts_main(args[1:])
+        return
+    if '--timings' in args:
+        # record timings of all tasks to output/<project>/timings/
+        args.remove('--timings')
+        os.environ[ENV_VARIABLE] = '1'
     try:
-        CliChecker().ensure_valid_args(sys.argv[1:])
+        CliChecker().ensure_valid_args(args)
     except ValueError as e:
         print(f'[!] {str(e)}', file=sys.stderr)
         sys.exit(1)
-    doit.run(TaskCreatorFactory().get_task_builders())
+    factory = TaskCreatorFactory()
+    result = DoitMain(ModuleTaskLoader(factory.get_task_builders())).run(args)
+    if result == 0 and factory.background_failed():
+        result = 1
+    sys.exit(result)
 
 
 if __name__ == '__main__':
@@ -4,38 +4,117 @@ import shutil
 import subprocess
 import sys
 import tarfile
+from contextlib import contextmanager
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Sequence, IO, Literal
+from typing import Any, Sequence, IO, Iterator, Callable, cast
 
 from vulnbuild.builds import BuildTask, Builder
 from vulnbuild.config import GlobalConfig
+from vulnbuild.converter.compression import Compressor, XzCompressor, get_compressor, xz_blocks
 from vulnbuild.converter.converter import ConverterTask, Converter
+from vulnbuild.converter.encryption import GpgEncryptor
+from vulnbuild.converter.manifest import BundleManifest
+from vulnbuild.utils.hashing import file_digest
 from vulnbuild.utils.sudo import SudoHelper
+from vulnbuild.utils.tarstream import COPY_BUFSIZE, ArchiveReader, ArchiveWriter, MemberHasher, iter_members, strip_dot_header
+from vulnbuild.utils.timings import timings
 from vulnbuild.vmbuilder.build_targets import VmBuildTarget
 
 
 @dataclass
 class CloudBundleTask(ConverterTask):
     ova_file: Path
+    compression: str = 'xz'
 
     @property
     def doc(self) -> str:
-        return f'Create a .tar.gz for cloud deployment out of {self.ova_file.name} (requires sudo)'
+        suffix = get_compressor(self.compression).suffix
+        sudo = ' (requires sudo)' if self.project.cloud_bundle_extractor == 'guestmount' else ''
+        return f'Create a .tar.{suffix} for cloud deployment out of {self.ova_file.name}{sudo}'
+
+
+@dataclass
+class OvaConsumer:
+    """Command that reads the ova from stdin and writes `output_file` (e.g. an encrypted archive of it)"""
+    command: list[str]
+    output_file: Path
+    stage: str = ''
+
+
+def _tmp_file(f: Path) -> Path:
+    return f.parent / f'{f.name}.tmp'
+
+
+def _close_stdin(process: subprocess.Popen) -> None:
+    try:
+        cast(IO[bytes], process.stdin).close()
+    except BrokenPipeError:
+        pass  # the process exited before reading everything, its exit code tells why
+
+
+@dataclass
+class BundleOutput:
+    """
+    A bundle written by ArchiveCloudConverter: the plain file, an encrypted file or both.
+    If both are written, the output of the compressor is passed through tee to gpg, it is compressed only once.
+    """
+    compressor: Compressor
+    plain_file: Path | None = None
+    encrypted_file: Path | None = None
+    encryptor: GpgEncryptor | None = None
+
+    @property
+    def files(self) -> list[Path]:
+        return [f for f in (self.plain_file, self.encrypted_file) if f is not None]
+
+    @property
+    def stage_name(self) -> str:
+        return self.compressor.name + (f' + {self.encryptor.suffix}' if self.encrypted_file and self.encryptor else '')
+
+    def start(self) -> list[subprocess.Popen]:
+        """Processes writing the .tmp files, the first one (the compressor) reads the archive from stdin"""
+        processes: list[subprocess.Popen] = []
+        sink: IO[bytes]
+        if self.encrypted_file is not None:
+            assert self.encryptor is not None
+            with open(_tmp_file(self.encrypted_file), 'wb') as f:
+                processes.append(self.encryptor.start_encryption(stdin=subprocess.PIPE, stdout=f))
+            sink = cast(IO[bytes], processes[0].stdin)
+            if self.plain_file is not None:
+                processes.insert(0, subprocess.Popen(['tee', str(_tmp_file(self.plain_file))], stdin=subprocess.PIPE, stdout=sink))
+                sink.close()  # only the child processes write to it
+                sink = cast(IO[bytes], processes[0].stdin)
+        elif self.plain_file is not None:
+            sink = open(_tmp_file(self.plain_file), 'wb')
+        else:
+            raise ValueError('Bundle output without files')
+        processes.insert(0, subprocess.Popen(self.compressor.compress_command(), stdin=subprocess.PIPE, stdout=sink))
+        sink.close()
+        return processes
 
 
 class CloudBundleConverter(Converter[CloudBundleTask]):
-    def __init__(self, name: str = '') -> None:
+    checksum_jobs = 2  # threads hashing large files for the manifest
+
+    def __init__(self, name: str = '', formats: Sequence[str] = ('xz', 'zstd')) -> None:
         self._contains_name = name
-        self._compression: Literal['gz', 'xz'] = 'xz'
+        self._formats = formats
 
     def get_conversion_targets(self, task: BuildTask, builder: Builder) -> Sequence[CloudBundleTask]:
         if isinstance(task, VmBuildTarget):
             ova = builder.get_output_file(task)
             if ova and ova.suffix == '.ova' and self._contains_name in ova.name:
-                return [CloudBundleTask(name=f'vm:{task.name}:cloudbundle', project=task.project, base=task, ova_file=ova)]
+                return [self._task(task, ova, compression) for compression in self._formats]
         return []
 
+    def _task(self, task: VmBuildTarget, ova: Path, compression: str) -> CloudBundleTask:
+        # xz is the default format, other bundles get a suffix (vm:vulnbox:cloudbundle:zst)
+        name = f'vm:{task.name}:cloudbundle'
+        if compression != 'xz':
+            name += ':' + get_compressor(compression).suffix
+        return CloudBundleTask(name=name, project=task.project, base=task, ova_file=ova, compression=compression)
+
     @classmethod
     def accepts(cls, task: BuildTask) -> bool:
         return isinstance(task, CloudBundleTask)
@@ -44,29 +123,55 @@ class CloudBundleConverter(Converter[CloudBundleTask]):
         return self.get_output_file(task).exists()
 
     def get_output_file(self, task: CloudBundleTask) -> Path:
-        return task.ova_file.parent / f'{task.ova_file.name[:-4]}.tar.{self._compression}'
+        return task.ova_file.parent / f'{task.ova_file.name[:-4]}.tar.{get_compressor(task.compression).suffix}'
 
     def build(self, task: CloudBundleTask) -> Any:
         print(f'[.] Creating cloud bundle archive from {task.ova_file.name}.')
-        print(f'[!] This process might require sudo, be prepared to enter your password if asked')
+        compressor = get_compressor(task.compression, task.project.compression)
+        self.convert(task, [BundleOutput(compressor, plain_file=self.get_output_file(task))])
+        print(f'[*] Created cloud bundle {self.get_output_file(task).name}')
+
+    def convert(self, task: CloudBundleTask, outputs: Sequence[BundleOutput], ova_consumers: Sequence[OvaConsumer] = ()) -> None:
+        """
+        Bundles of the task's ova, all from a single read of the disk image.
+        `ova_consumers` are commands that get the ova on stdin while it is read for extraction.
+        """
         print(f'[!] No virtualbox VM must be running during conversion.')
-        tmp_folder = Path('/dev/shm/ovafun')
+        # the extracted disk image is stored next to the ova, not in RAM
+        tmp_folder = task.ova_file.parent / '.cloudbundle-tmp'
         tmp_folder.mkdir(parents=True, exist_ok=True)
-        image_archive = tmp_folder / 'image.tar'
         try:
-            SudoHelper.run_as_root(self._extract_image, task.ova_file, image_archive)
-            ArchiveCloudConverter(image_archive, self.get_output_file(task), tmp_folder).convert()
+            with_manifest = task.project.cloud_bundle_manifest and any(output.plain_file for output in outputs)
+            checksum_jobs = self.checksum_jobs if with_manifest else 0
+            if task.project.cloud_bundle_extractor == 'guestmount':
+                print(f'[!] This process might require sudo, be prepared to enter your password if asked')
+                SudoHelper.run_as_root(self._convert_image, task.ova_file, outputs, tmp_folder, checksum_jobs, ova_consumers)
+            else:
+                self._convert_image_direct(task.ova_file, outputs, tmp_folder, checksum_jobs, ova_consumers)
         finally:
             shutil.rmtree(tmp_folder)
-        print(f'[*] Created cloud bundle {self.get_output_file(task).name}')
 
-    def _extract_image(self, image: Path, output_archive: Path) -> None:
-        OvaExtractor(image, output_archive, output_archive.parent).extract()
-        if output_archive.exists():
-            os.chown(output_archive, SudoHelper.original_uid, SudoHelper.original_gid)
+    def _convert_image(self, image: Path, outputs: Sequence[BundleOutput], tmp_folder: Path, checksum_jobs: int,
+                       ova_consumers: Sequence[OvaConsumer] = ()) -> None:
+        with OvaExtractor(image, tmp_folder, ova_consumers).archive_stream() as stream:
+            ArchiveCloudConverter(outputs, checksum_jobs=checksum_jobs).convert(stream)
+        files = [f for output in outputs for f in output.files] + [consumer.output_file for consumer in ova_consumers]
+        for f in files + [BundleManifest.manifest_file(f) for f in files]:
+            if f.exists():
+                os.chown(f, SudoHelper.original_uid, SudoHelper.original_gid)
+
+    def _convert_image_direct(self, image: Path, outputs: Sequence[BundleOutput], tmp_folder: Path, checksum_jobs: int,
+                              ova_consumers: Sequence[OvaConsumer] = ()) -> None:
+        with GuestfishExtractor(image, tmp_folder, ova_consumers).archive_stream() as stream:
+            ArchiveCloudConverter(outputs, checksum_jobs=checksum_jobs).convert(stream)
 
     def clean(self, task: CloudBundleTask) -> None:
         self.get_output_file(task).unlink(missing_ok=True)
+        BundleManifest.manifest_file(self.get_output_file(task)).unlink(missing_ok=True)
+
+
+def _padded(size: int) -> int:
+    return -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
 
 
 def _print_filesize(fname: str | Path) -> None:
@@ -77,32 +182,80 @@ def _print_filesize(fname: str | Path) -> None:
 
 class OvaExtractor:
     excludes_root = ('proc', 'dev', 'tmp', 'run', 'sys', 'lost+found')
-    excludes: list[str] = ['--exclude', 'root/setup-network.py', '--exclude', 'etc/dhcp/dhclient-exit-hooks.d/setupnetwork']
+    excluded_files = ('root/setup-network.py', 'etc/dhcp/dhclient-exit-hooks.d/setupnetwork')
 
-    def __init__(self, input_file: Path, output_file: Path, tmp_folder: Path) -> None:
+    def __init__(self, input_file: Path, tmp_folder: Path, ova_consumers: Sequence[OvaConsumer] = ()) -> None:
         self.input_file = input_file.absolute()
-        self.output_file = output_file.absolute()
+        self.ova_consumers = ova_consumers  # get the ova while the disk image is extracted, it is read only once
         self._tmp_folder = tmp_folder
         self._mnt_folder = self._tmp_folder / 'mnt'
 
-    def extract(self) -> None:
-        vmdk_file = self._extract_ova()
+    @contextmanager
+    def archive_stream(self) -> Iterator[IO[bytes]]:
+        """Mount the disk image and stream a tar archive of its content"""
+        with timings.stage(self._extract_stage):
+            vmdk_file = self._extract_ova()
         try:
-            self._mount_vmdk(vmdk_file)
+            with timings.stage('guestmount'):
+                self._mount_vmdk(vmdk_file)
             try:
-                self._pack_archive()
+                with self._stdout_of(self._pack_archive()) as stream:
+                    yield stream
             finally:
                 self._umount()
         finally:
             vmdk_file.unlink(missing_ok=True)
 
+    @contextmanager
+    def _stdout_of(self, proc: subprocess.Popen) -> Iterator[IO[bytes]]:
+        assert proc.stdout is not None
+        try:
+            yield proc.stdout
+        except BaseException:
+            # the producer dies of the closed pipe, its exit code must not hide the actual error
+            proc.kill()
+            proc.stdout.close()
+            proc.wait()
+            raise
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+
+    @property
+    def _extract_stage(self) -> str:
+        return ' + '.join(['extract ova'] + [consumer.stage for consumer in self.ova_consumers if consumer.stage])
+
     def _extract_ova(self) -> Path:
         print('[.] Extract vmdk from ova file ...')
-        subprocess.check_call(['tar', '--no-same-owner', '-xf', str(self.input_file)], cwd=self._tmp_folder)
+        if self.ova_consumers:
+            self._extract_ova_tee()
+        else:
+            subprocess.check_call(['tar', '--no-same-owner', '-xf', str(self.input_file)], cwd=self._tmp_folder)
         vmdk_file: Path = [f for f in self._tmp_folder.iterdir() if f.name.endswith('.vmdk')][0]
         _print_filesize(vmdk_file)
         return vmdk_file
 
+    def _extract_ova_tee(self) -> None:
+        commands = [['tar', '--no-same-owner', '-xf', '-']] + [consumer.command for consumer in self.ova_consumers]
+        processes = [subprocess.Popen(cmd, stdin=subprocess.PIPE, cwd=self._tmp_folder) for cmd in commands]
+        success = False
+        try:
+            with open(self.input_file, 'rb') as f:
+                while data := f.read(COPY_BUFSIZE):
+                    for process in processes:
+                        cast(IO[bytes], process.stdin).write(data)
+            success = True
+        finally:
+            for process in processes:
+                _close_stdin(process)
+            failed = [process for process in processes if process.wait() != 0]
+            if failed or not success:
+                # a partial 7z archive must not be taken for a complete one
+                for consumer in self.ova_consumers:
+                    consumer.output_file.unlink(missing_ok=True)
+                if failed:
+                    raise subprocess.CalledProcessError(failed[0].returncode, failed[0].args)
+
     def _mount_vmdk(self, vmdk: Path) -> None:
         # sudo LIBGUESTFS_BACKEND=direct guestmount -a saarctf-testbox-disk001.vmdk -i --ro /mnt/tmp
         self._mnt_folder.mkdir(parents=True, exist_ok=True)
@@ -119,12 +272,43 @@ class OvaExtractor:
         if self._mnt_folder.exists():
             self._mnt_folder.rmdir()
 
-    def _pack_archive(self) -> None:
-        # pack stuff into the archive
-        print('[.] Pack image archive ...')
+    def _pack_archive(self) -> subprocess.Popen:
+        # pack stuff into an archive on stdout
+        print('[.] Pack, filter and compress image archive ...')
         filelist = [fname for fname in os.listdir(self._mnt_folder) if fname not in self.excludes_root]
-        subprocess.check_call(['tar', '--xattrs', '--numeric-owner'] + self.excludes + ['-cpf', str(self.output_file)] + filelist,
-                              cwd=self._mnt_folder)
+        excludes = [arg for f in self.excluded_files for arg in ('--exclude', f)]
+        return subprocess.Popen(['tar', '--xattrs', '--numeric-owner'] + excludes + ['-cpf', '-'] + filelist,
+                                cwd=self._mnt_folder, stdout=subprocess.PIPE)
+
+
+class GuestfishExtractor(OvaExtractor):
+    """
+    Streams the file system of the disk image with guestfish tar-out, which reads the vmdk directly in the libguestfs appliance.
+    No FUSE mount and no root required (only a readable kernel in /boot for the appliance).
+    Archive members are named ./etc/... instead of etc/..., ArchiveCloudConverter handles both.
+    """
+
+    @contextmanager
+    def archive_stream(self) -> Iterator[IO[bytes]]:
+        with timings.stage(self._extract_stage):
+            vmdk_file = self._extract_ova()
+        try:
+            with self._stdout_of(self._tar_out(vmdk_file)) as stream:
+                yield stream
+        finally:
+            vmdk_file.unlink(missing_ok=True)
+
+    def tar_out_command(self, vmdk: Path) -> list[str]:
+        # tar-out archives "." of the guest file system, excludes are tar patterns, separated by spaces
+        excludes = ' '.join(f'./{name}' for name in self.excludes_root + self.excluded_files)
+        return ['guestfish', '--ro', '-a', str(vmdk), '-i',
+                'tar-out', '/', '-', 'numericowner:true', 'xattrs:true', f'excludes:{excludes}']
+
+    def _tar_out(self, vmdk: Path) -> subprocess.Popen:
+        print('[.] Pack, filter and compress image archive (guestfish) ...')
+        env = dict(os.environ.items())
+        env['LIBGUESTFS_BACKEND'] = 'direct'
+        return subprocess.Popen(self.tar_out_command(vmdk), stdout=subprocess.PIPE, env=env)
 
 
 class ArchiveCloudConverter:
@@ -140,76 +324,134 @@ class ArchiveCloudConverter:
         '-A INPUT -j DROP',
     ]
 
-    def __init__(self, image_archive: Path, output_file: Path, tmp_folder: Path) -> None:
-        self.image_archive = image_archive.absolute()
-        self.output_file = output_file.absolute()
-        self._tmp_folder = tmp_folder
-
-    def convert(self) -> None:
-        self._tmp_folder.mkdir(parents=True, exist_ok=True)
-        tmp2 = self._filter_archive(self.image_archive)
-        self.image_archive.unlink(missing_ok=True)
-        self.output_file.unlink(missing_ok=True)
-        shutil.move(self._compress(tmp2), self.output_file)
-        _print_filesize(self.output_file)
-
-    def _compress(self, archive: Path) -> Path:
-        if self.output_file.name.endswith('.tar.gz'):
-            print('[.] Compressing ...')
-            subprocess.check_call(['gzip', str(archive)])
-            return archive.parent / f'{archive.name}.gz'
-        elif self.output_file.name.endswith('.tar.xz'):
-            print('[.] Compressing ...')
-            subprocess.check_call(['xz', '-T', '0', str(archive)])
-            return archive.parent / f'{archive.name}.xz'
-        else:
-            raise ValueError(f'Unknown compression format for {self.output_file.name}')
-
-    def _filter_archive(self, archive: Path) -> Path:
-        output = self._tmp_folder / 'tmp2.tar'
-        dependencies_archive = self._pack_dependencies()
-        with tarfile.open(archive, 'r') as fi:
-            with tarfile.open(output, 'w', format=fi.format) as fo:
-                for member in fi.getmembers():
-                    if member.isdir() and not member.issym():
-                        extracted = fi.extractfile(member)
-                        fo.addfile(member, extracted)
-                    elif member.isfile() and not member.issym():
-                        extracted = fi.extractfile(member)
-                        if extracted is None:
-                            raise Exception('Could not extract file')
-                        if member.name == 'root/.bash_profile':
-                            extracted = self.filter_bash_profile(member, extracted)
-                        elif member.name == 'etc/crontab':
-                            extracted = self.filter_crontab(member, extracted)
-                        elif member.name == 'etc/iptables/rules.v4':
-                            extracted = self.filter_iptables(member, extracted)
-                        elif member.name == 'etc/iptables/rules.v6':
-                            extracted = self.filter_iptables6(member, extracted)
-                        elif member.name == 'etc/initramfs-tools/conf.d/resume':
-                            extracted = self.filter_resume(member, extracted)
-                        fo.addfile(member, extracted)
-                    else:
-                        fo.addfile(member)
-                with tarfile.open(dependencies_archive, 'r') as fi2:
-                    for member in fi2.getmembers():
-                        if (member.isdir() or member.isfile()) and not member.issym():
-                            extracted = fi2.extractfile(member)
-                            member.uid = 0
-                            member.gid = 0
-                            member.uname = 'root'
-                            member.gname = 'root'
-                            fo.addfile(member, extracted)
+    def __init__(self, outputs: Sequence[BundleOutput], checksum_jobs: int = 0) -> None:
+        self.outputs = list(outputs)
+        self.checksum_jobs = checksum_jobs  # >0 writes a manifest with a digest of every file, hashed in that many threads
+        self.checksums: dict[str, str] = {}
+        self.manifest = BundleManifest() if checksum_jobs > 0 else None
+        self._filters: dict[str, Callable[[tarfile.TarInfo, IO[bytes]], io.BytesIO]] = {
+            'root/.bash_profile': self.filter_bash_profile,
+            'etc/crontab': self.filter_crontab,
+            'etc/iptables/rules.v4': self.filter_iptables,
+            'etc/iptables/rules.v6': self.filter_iptables6,
+            'etc/initramfs-tools/conf.d/resume': self.filter_resume,
+        }
+
+    def convert(self, image_archive: IO[bytes]) -> None:
+        """Filter a (streamed) tar archive once and compress it into all outputs, without intermediate files"""
+        stage = 'tar pack + filter + ' + ' + '.join(output.stage_name for output in self.outputs)
+        processes: list[subprocess.Popen] = []
+        compressors: list[subprocess.Popen] = []
+        success = False
+        try:
+            for output in self.outputs:
+                pipeline = output.start()
+                compressors.append(pipeline[0])
+                processes += pipeline
+            with timings.stage(stage):
+                self._filter_archive(image_archive, [cast(IO[bytes], c.stdin) for c in compressors])
+            success = True
+        finally:
+            for compressor in compressors:
+                _close_stdin(compressor)
+            failed = [process for process in processes if process.wait() != 0]
+            if failed or not success:
+                for output in self.outputs:
+                    for f in output.files:
+                        _tmp_file(f).unlink(missing_ok=True)
+                if failed:
+                    raise subprocess.CalledProcessError(failed[0].returncode, failed[0].args)
+        for output in self.outputs:
+            if output.plain_file is not None:
+                # the manifest of the previous bundle must not describe the new one, not even if writing this one fails
+                BundleManifest.manifest_file(output.plain_file).unlink(missing_ok=True)
+            for f in output.files:
+                _tmp_file(f).rename(f)
+                _print_filesize(f)
+        if self.manifest is not None:
+            self.manifest.set_digests(self.checksums)
+            for output in self.outputs:
+                if output.plain_file is not None:
+                    blocks = isinstance(output.compressor, XzCompressor)
+                    self.manifest.blocks = xz_blocks(output.plain_file) if blocks else []
+                    self.manifest.set_bundle(output.plain_file)
+                    self.manifest.save(BundleManifest.manifest_file(output.plain_file))
+
+    def _filter_archive(self, archive: IO[bytes], outputs: Sequence[IO[bytes]]) -> None:
+        # Unmodified members (almost all) are copied verbatim with their original header, in large blocks.
+        # Only filtered files pass through tarfile, re-encoding every header would make this CPU-bound.
+        reader, writer = ArchiveReader(archive), ArchiveWriter(*outputs)
+        hasher = MemberHasher(self.checksum_jobs) if self.checksum_jobs > 0 else None
+        reader.start_recording(0)
+        try:
+            with tarfile.open(fileobj=cast(IO[bytes], reader), mode='r:') as fi:
+                with tarfile.open(fileobj=cast(IO[bytes], writer), mode='w:', format=fi.format) as fo:
+                    for member, header in iter_members(fi, reader):
+                        if member.name == '.':
+                            continue  # root folder of guestfish tar-out
+                        if member.name.startswith('./'):
+                            self._strip_dot(member)
+                            header = strip_dot_header(header) or member.tobuf(fo.format, fo.encoding, fo.errors)
+                        hashed = hasher is not None and member.isfile() and not member.issparse()
+                        if hashed and hasher is not None:
+                            hasher.start(member.name, member.size)
+                        if member.isfile() and member.name in self._filters:
+                            extracted = fi.extractfile(member)
+                            if extracted is None:
+                                raise Exception('Could not extract file')
+                            data = self._filters[member.name](member, extracted)
+                            if hashed and hasher is not None:
+                                hasher.update(data.getvalue())
+                            fo.addfile(member, data)
                         else:
-                            fo.addfile(member)
-
-        return output
-
-    def _pack_dependencies(self) -> Path:
-        output = self._tmp_folder / 'tmp3.tar'
-        subprocess.check_call(['tar', '--numeric-owner', '-cpf', str(output), 'cloud-scripts'],
-                              cwd=GlobalConfig.resources)
-        return output
+                            writer.write(header)
+                            remaining = member.size if hashed else 0
+                            # data and padding up to the next header, fi.offset points there
+                            for block in reader.copy(fi.offset - reader.tell()):
+                                writer.write(block)
+                                if remaining > 0 and hasher is not None:
+                                    hasher.update(block[:remaining])
+                                    remaining -= len(block)
+                            fo.offset = writer.tell()
+                        if hashed and hasher is not None:
+                            hasher.finish()
+                        if self.manifest is not None:
+                            # after filters changed the size, the output ends with the (padded) file content
+                            offset = writer.tell() - _padded(member.size) if member.isfile() and not member.issparse() else -1
+                            self.manifest.add(member, offset)
+                        fo.members.clear()  # type: ignore[attr-defined]
+                    self._add_dependencies(fo)
+            reader.drain()  # the end-of-archive padding, the producer of the stream must not fail writing it
+        finally:
+            if hasher is not None:
+                self.checksums.update(hasher.close())
+
+    @staticmethod
+    def _strip_dot(member: tarfile.TarInfo) -> None:
+        member.name = member.name[2:]
+        if member.islnk() and member.linkname.startswith('./'):
+            member.linkname = member.linkname[2:]  # hardlink targets are member names, symlink targets are kept
+        # pax headers take precedence over name and linkname when the header is written
+        pax_headers = dict(member.pax_headers)
+        if 'path' in pax_headers:
+            pax_headers['path'] = member.name
+        if member.islnk() and 'linkpath' in pax_headers:
+            pax_headers['linkpath'] = member.linkname
+        member.pax_headers = pax_headers
+
+    def _add_dependencies(self, fo: tarfile.TarFile) -> None:
+        def owned_by_root(member: tarfile.TarInfo) -> tarfile.TarInfo:
+            member.uid = 0
+            member.gid = 0
+            member.uname = 'root'
+            member.gname = 'root'
+            if self.manifest is not None:
+                self.manifest.add(member)
+                if member.isfile():
+                    self.checksums[member.name] = file_digest(GlobalConfig.resources / member.name)
+            return member
+
+        fo.add(GlobalConfig.resources / 'cloud-scripts', arcname='cloud-scripts', filter=owned_by_root)
 
     def filter_bash_profile(self, member: tarfile.TarInfo, r: IO[bytes]) -> io.BytesIO:
         # Remove setup-network
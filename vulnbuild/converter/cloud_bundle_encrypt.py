@@ -1,12 +1,14 @@
-import subprocess
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any, Sequence
 
 from vulnbuild.builds import BuildTask, Builder
-from vulnbuild.converter.cloud_bundle import CloudBundleTask
-from vulnbuild.converter.converter import ConverterTask, Converter
+from vulnbuild.converter.cloud_bundle import CloudBundleTask, CloudBundleConverter, BundleOutput
+from vulnbuild.converter.compression import is_bundle, get_compressor
+from vulnbuild.converter.converter import ConverterTask, Converter, is_current
+from vulnbuild.converter.encryption import GpgEncryptor
 from vulnbuild.targets.password import PasswordTask
+from vulnbuild.utils.timings import timings
 
 
 @dataclass
@@ -19,13 +21,18 @@ class CloudBundleEncryptTask(ConverterTask):
 
 
 class CloudBundleEncryptConverter(Converter[CloudBundleEncryptTask]):
+    """
+    Encrypts a cloud bundle with gpg (without gpg's compression). If the plain bundle is not there (or older than the ova),
+    the encrypted bundle is created from the ova directly, gpg runs inline after the compressor.
+    """
+
     def __init__(self, name: str = '') -> None:
         self._contains_name = name
 
     def get_conversion_targets(self, task: BuildTask, builder: Builder) -> Sequence[CloudBundleEncryptTask]:
         if isinstance(task, CloudBundleTask):
             bundle = builder.get_output_file(task)
-            if bundle and (bundle.name.endswith('.tar.gz') or bundle.name.endswith('.tar.xz')) and self._contains_name in bundle.name:
+            if bundle and is_bundle(bundle.name) and self._contains_name in bundle.name:
                 return [CloudBundleEncryptTask(name=f'{task.name}:gpg', project=task.project, base=task, bundle_file=bundle)]
         return []
 
@@ -34,21 +41,38 @@ class CloudBundleEncryptConverter(Converter[CloudBundleEncryptTask]):
         return isinstance(task, CloudBundleEncryptTask)
 
     def is_built(self, task: CloudBundleEncryptTask) -> bool:
-        return self.get_output_file(task).exists()
+        # the plain bundle is no dependency, but a rebuilt one must be encrypted again
+        return is_current(self.get_output_file(task), [task.bundle_file])
 
     def get_output_file(self, task: CloudBundleEncryptTask) -> Path:
         return task.bundle_file.parent / f'{task.bundle_file.name}.gpg'
 
     def dependencies(self, task: CloudBundleEncryptTask) -> list[BuildTask]:
-        return super().dependencies(task) + [PasswordTask(task.project)]
+        # the vm, not the plain bundle, which is only used if it has been built anyway
+        bundle_task = task.base
+        assert isinstance(bundle_task, CloudBundleTask)
+        return [bundle_task.base, PasswordTask(task.project)]
+
+    def _plain_bundle_usable(self, task: CloudBundleEncryptTask) -> bool:
+        bundle_task = task.base
+        assert isinstance(bundle_task, CloudBundleTask)
+        return is_current(task.bundle_file, [bundle_task.ova_file])
 
     def build(self, task: CloudBundleEncryptTask) -> Any:
         print(f'[.] Encrypting file {task.bundle_file.name} ...')
 
         output = self.get_output_file(task)
         output.parent.mkdir(parents=True, exist_ok=True)
-        passwd = PasswordTask(task.project).get_password()
-        subprocess.check_call(['gpg', '--batch', '--passphrase', passwd, '--no-options', '-c', str(task.bundle_file)])
+        encryptor = GpgEncryptor(PasswordTask(task.project).password_file)
+        if self._plain_bundle_usable(task):
+            with timings.stage('gpg'):
+                encryptor.encrypt_file(task.bundle_file, output)
+        else:
+            bundle_task = task.base
+            assert isinstance(bundle_task, CloudBundleTask)
+            print(f'[.] No current {task.bundle_file.name}, encrypting while creating the bundle from {bundle_task.ova_file.name}.')
+            compressor = get_compressor(bundle_task.compression, task.project.compression)
+            CloudBundleConverter().convert(bundle_task, [BundleOutput(compressor, encrypted_file=output, encryptor=encryptor)])
 
         print(f'[.] Created file {output.name} ...')
         return str(output)
@@ -7,7 +7,9 @@ from typing import Any, Sequence
 from vulnbuild.builds import BuildTask, Builder
 from vulnbuild.config import GlobalConfig
 from vulnbuild.converter.cloud_bundle import CloudBundleTask
+from vulnbuild.converter.compression import is_bundle
 from vulnbuild.converter.converter import ConverterTask, Converter
+from vulnbuild.utils.timings import timings
 
 
 @dataclass
@@ -26,7 +28,7 @@ class CloudImageConverter(Converter[CloudImageTask]):
     def get_conversion_targets(self, task: BuildTask, builder: Builder) -> Sequence[CloudImageTask]:
         if isinstance(task, CloudBundleTask):
             bundle = builder.get_output_file(task)
-            if bundle and (bundle.name.endswith('.tar.gz') or bundle.name.endswith('.tar.xz')) and self._contains_name in bundle.name:
+            if bundle and is_bundle(bundle.name) and self._contains_name in bundle.name:
                 return [CloudImageTask(name=f'{task.name}:hetzner', project=task.project, base=task, bundle_file=bundle)]
         return []
 
@@ -46,8 +48,10 @@ class CloudImageConverter(Converter[CloudImageTask]):
             print('[!] You should have set the environment variable "HCLOUD_TOKEN"')
             raise Exception('Missing Hetzner Token (HCLOUD_TOKEN=...)')
 
-        subprocess.check_call(['packer', 'build', '-var', f'archive_file={task.bundle_file.absolute()}', 'vulnbox-cloud.json'],
-                              cwd=GlobalConfig.base)
+        with timings.stage('packer build vulnbox-cloud.json'):
+            subprocess.check_call(['packer', 'build', '-var', f'archive_file={task.bundle_file.absolute()}',
+                                   '-var', f'archive_name=bundle{"".join(task.bundle_file.suffixes[-2:])}', 'vulnbox-cloud.json'],
+                                  cwd=GlobalConfig.base)
 
         print(f'[*] Created cloud image.')
 
@@ -0,0 +1,128 @@
+import shutil
+import subprocess
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+
+from vulnbuild.project import CompressionConfig
+
+
+@dataclass
+class Compressor(ABC):
+    level: int | None = None
+    threads: int = 0  # 0 = all cores
+    rsyncable: bool = False
+    block_size: int = 0  # bytes, 0 = default
+
+    name: str = ''
+    suffix: str = ''
+
+    @abstractmethod
+    def compress_command(self) -> list[str]:
+        """Command that compresses stdin to stdout"""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def decompress_command(self) -> list[str]:
+        """Command that decompresses stdin to stdout"""
+        raise NotImplementedError()
+
+
+@dataclass
+class XzCompressor(Compressor):
+    """xz has no rsyncable mode"""
+    name: str = 'xz'
+    suffix: str = 'xz'
+
+    def compress_command(self) -> list[str]:
+        cmd = ['xz', '-c', '-T', str(self.threads)]
+        if self.block_size > 0:
+            cmd.append(f'--block-size={self.block_size}')
+        if self.level is not None:
+            cmd.append(f'-{self.level}')
+        return cmd
+
+    def decompress_command(self) -> list[str]:
+        return ['xz', '-d', '-c', '-T', str(self.threads)]
+
+
+@dataclass
+class ZstdCompressor(Compressor):
+    name: str = 'zstd'
+    suffix: str = 'zst'
+    window_log: int = 27  # --long window (128MB), decompression needs the same --long
+
+    def compress_command(self) -> list[str]:
+        cmd = ['zstd', '-c', '-q', f'-T{self.threads}', f'--long={self.window_log}']
+        if self.rsyncable:
+            cmd.append('--rsyncable')
+        if self.level is not None:
+            if self.level > 19:
+                cmd.append('--ultra')
+            cmd.append(f'-{self.level}')
+        return cmd
+
+    def decompress_command(self) -> list[str]:
+        return ['zstd', '-d', '-c', '-q', f'--long={self.window_log}']
+
+
+@dataclass
+class GzipCompressor(Compressor):
+    """pigz if installed, gzip otherwise (same file format)"""
+    name: str = 'gzip'
+    suffix: str = 'gz'
+
+    def compress_command(self) -> list[str]:
+        if shutil.which('pigz'):
+            cmd = ['pigz', '-c']
+            if self.threads > 0:
+                cmd += ['-p', str(self.threads)]
+        else:
+            cmd = ['gzip', '-c']
+        if self.rsyncable:
+            cmd.append('--rsyncable')
+        if self.level is not None:
+            cmd.append(f'-{self.level}')
+        return cmd
+
+    def decompress_command(self) -> list[str]:
+        return ['pigz' if shutil.which('pigz') else 'gzip', '-d', '-c']
+
+
+_compressors: dict[str, type[Compressor]] = {
+    'xz': XzCompressor,
+    'zstd': ZstdCompressor,
+    'gzip': GzipCompressor,
+}
+
+bundle_suffixes: tuple[str, ...] = ('.tar.gz', '.tar.xz', '.tar.zst')
+
+
+def get_compressor(name: str, config: CompressionConfig | None = None) -> Compressor:
+    if name not in _compressors:
+        raise ValueError(f'Unknown compression format: {name}')
+    config = config or CompressionConfig()
+    return _compressors[name](level=config.levels.get(name), threads=config.threads, rsyncable=config.rsyncable,
+                              block_size=config.block_size * 1024 * 1024)
+
+
+def compressor_for_file(filename: str, config: CompressionConfig | None = None) -> Compressor:
+    for name, cls in _compressors.items():
+        if filename.endswith(f'.{cls.suffix}'):
+            return get_compressor(name, config)
+    raise ValueError(f'Unknown compression format for {filename}')
+
+
+def xz_blocks(f: Path) -> list[list[int]]:
+    """Compressed offset, uncompressed offset, compressed size and uncompressed size of all blocks in an .xz file"""
+    output = subprocess.check_output(['xz', '--robot', '--list', '-vv', str(f)], text=True)
+    blocks = []
+    for line in output.splitlines():
+        fields = line.split('\t')
+        if fields[0] == 'block':
+            blocks.append([int(fields[4]), int(fields[5]), int(fields[6]), int(fields[7])])
+    return blocks
+
+
+def is_bundle(filename: str) -> bool:
+    return filename.endswith(bundle_suffixes)
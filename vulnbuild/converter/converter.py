@@ -1,6 +1,8 @@
 from abc import abstractmethod
+from collections import deque
 from dataclasses import dataclass
-from typing import TypeVar, Generic, Sequence
+from pathlib import Path
+from typing import TypeVar, Generic, Sequence, Callable, Iterable
 
 from vulnbuild.builds import Builder, BuildTask
 
@@ -17,6 +19,14 @@ class ConverterTask(BuildTask):
 _BuildTaskT = TypeVar('_BuildTaskT', bound=ConverterTask)
 
 
+def is_current(f: Path, inputs: Iterable[Path]) -> bool:
+    """`f` exists and is not older than any of the inputs that exist"""
+    if not f.exists():
+        return False
+    mtime = f.stat().st_mtime
+    return all(mtime >= i.stat().st_mtime for i in inputs if i.exists())
+
+
 class Converter(Builder[_BuildTaskT], Generic[_BuildTaskT]):
     @abstractmethod
     def get_conversion_targets(self, task: BuildTask, builder: Builder) -> Sequence[_BuildTaskT]:
@@ -25,3 +35,32 @@ class Converter(Builder[_BuildTaskT], Generic[_BuildTaskT]):
 
     def dependencies(self, task: _BuildTaskT) -> list[BuildTask]:
         return [task.base]
+
+
+class ConversionGraph:
+    """
+    Applies all converters to all tasks - including converted ones - until no new tasks appear.
+    Every (converter, task) pair is visited once, tasks are deduplicated by fullname.
+    """
+
+    def __init__(self, converters: Sequence[Converter], task_builder: Callable[[BuildTask], Builder]) -> None:
+        self.converters = converters
+        self.task_builder = task_builder
+        self.tasks: dict[str, ConverterTask] = {}
+        self.derived: dict[str, list[ConverterTask]] = {}  # base task fullname => tasks converted from it
+
+    def resolve(self, roots: Iterable[BuildTask]) -> list[ConverterTask]:
+        worklist: deque[BuildTask] = deque(roots)
+        while worklist:
+            task = worklist.popleft()
+            builder = self.task_builder(task)
+            for converter in self.converters:
+                for target in converter.get_conversion_targets(task, builder):
+                    if target.fullname not in self.tasks:
+                        self.tasks[target.fullname] = target
+                        self.derived.setdefault(task.fullname, []).append(target)
+                        worklist.append(target)
+        return list(self.tasks.values())
+
+    def derived_tasks(self, task: BuildTask) -> list[ConverterTask]:
+        return self.derived.get(task.fullname, [])
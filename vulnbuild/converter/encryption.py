@@ -0,0 +1,68 @@
+import os
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+
+@dataclass
+class GpgEncryptor:
+    """
+    Symmetric gpg encryption as pipeline stage (stdin to stdout), decrypted with a plain `gpg -d`.
+    Bundles and images are compressed already, gpg's own compression (zlib by default) would only cost CPU time.
+    AES is hardware-accelerated by libgcrypt where the CPU supports it.
+    """
+    password_file: Path
+    cipher: str = 'AES256'
+
+    suffix: str = 'gpg'
+
+    @property
+    def password(self) -> str:
+        # the same password 7z gets (PasswordTask.get_password), --passphrase-file would keep whitespace and \r
+        return self.password_file.read_text(encoding='utf-8').strip()
+
+    def _passphrase_fd(self) -> int:
+        # the password is passed through a pipe, it does not show up in the process list
+        fd_read, fd_write = os.pipe()
+        try:
+            os.write(fd_write, self.password.encode() + b'\n')
+        finally:
+            os.close(fd_write)
+        return fd_read
+
+    def _start(self, args: list[str], **kwargs: Any) -> subprocess.Popen:
+        fd = self._passphrase_fd()
+        try:
+            return subprocess.Popen(['gpg', '--batch', '--no-options', '--quiet', '--passphrase-fd', str(fd)] + args,
+                                    pass_fds=(fd,), **kwargs)
+        finally:
+            os.close(fd)
+
+    def start_encryption(self, **kwargs: Any) -> subprocess.Popen:
+        """gpg encrypting stdin to stdout, `kwargs` are passed to Popen"""
+        return self._start(['--symmetric', '--cipher-algo', self.cipher, '--compress-algo', 'none', '-o', '-'], **kwargs)
+
+    def start_decryption(self, **kwargs: Any) -> subprocess.Popen:
+        return self._start(['-d'], **kwargs)
+
+    def encrypt_file(self, source: Path, output: Path) -> None:
+        """Encrypt to a .tmp file that is renamed to `output` on success"""
+        tmp_output = output.parent / f'{output.name}.tmp'
+        try:
+            with open(source, 'rb') as fin, open(tmp_output, 'wb') as fout:
+                proc = self.start_encryption(stdin=fin, stdout=fout)
+                if proc.wait() != 0:
+                    raise subprocess.CalledProcessError(proc.returncode, proc.args)
+        except BaseException:
+            tmp_output.unlink(missing_ok=True)
+            raise
+        tmp_output.rename(output)
+
+    def decrypt_file(self, source: Path) -> bytes:
+        with open(source, 'rb') as fin:
+            proc = self.start_decryption(stdin=fin, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            data, _ = proc.communicate()
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+        return data
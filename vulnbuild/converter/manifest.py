@@ -0,0 +1,156 @@
+import bisect
+import json
+import lzma
+import subprocess
+import tarfile
+from dataclasses import dataclass, field, astuple
+from pathlib import Path
+
+from vulnbuild.converter.compression import compressor_for_file
+
+
+@dataclass
+class ManifestEntry:
+    type: str  # tar member type: 0 file, 1 hardlink, 2 symlink, 5 directory, ...
+    mode: int
+    uid: int
+    gid: int
+    size: int
+    digest: str = ''  # content digest of files, target of links
+    offset: int = -1  # of the file content in the uncompressed archive, if known
+
+    @classmethod
+    def from_member(cls, member: tarfile.TarInfo, offset: int = -1) -> 'ManifestEntry':
+        digest = member.linkname if member.issym() or member.islnk() else ''
+        return cls(member.type.decode(), member.mode, member.uid, member.gid, member.size if member.isfile() else 0, digest, offset)
+
+    def changes(self, old: 'ManifestEntry') -> list[str]:
+        result = []
+        if self.type != old.type:
+            result.append('type')
+        elif self.digest != old.digest or self.size != old.size:
+            result.append('content' if self.isfile() else 'target')
+        if self.mode != old.mode:
+            result.append(f'mode {old.mode:o} -> {self.mode:o}')
+        if (self.uid, self.gid) != (old.uid, old.gid):
+            result.append(f'owner {old.uid}:{old.gid} -> {self.uid}:{self.gid}')
+        return result
+
+    def isfile(self) -> bool:
+        return self.type.encode() in tarfile.REGULAR_TYPES
+
+
+@dataclass
+class BundleManifest:
+    """
+    Path, type, mode, owner, size and digest of every member of a cloud bundle, stored next to it as <bundle>.manifest.json.
+    Two bundles can be compared without decompressing them.
+    With file offsets and the block table of .xz bundles, single files can be read by decompressing only the blocks that contain them.
+    Size and mtime of the bundle are stored as well, a manifest is not used for a bundle that has been replaced since.
+    """
+    algorithm: str = 'sha256'
+    entries: dict[str, ManifestEntry] = field(default_factory=dict)
+    blocks: list[list[int]] = field(default_factory=list)  # xz blocks: compressed offset, offset, compressed size, size
+    bundle_size: int = -1
+    bundle_mtime_ns: int = -1
+
+    @classmethod
+    def manifest_file(cls, bundle: Path) -> Path:
+        return bundle.with_name(bundle.name + '.manifest.json')
+
+    def add(self, member: tarfile.TarInfo, offset: int = -1) -> None:
+        self.entries[member.name] = ManifestEntry.from_member(member, offset)
+
+    def set_digests(self, digests: dict[str, str]) -> None:
+        for name, digest in digests.items():
+            if name in self.entries and self.entries[name].isfile():
+                self.entries[name].digest = digest
+
+    def set_bundle(self, bundle: Path) -> None:
+        st = bundle.stat()
+        self.bundle_size, self.bundle_mtime_ns = st.st_size, st.st_mtime_ns
+
+    def check_bundle(self, bundle: Path) -> None:
+        """Raise if `bundle` is not the file this manifest has been written for"""
+        st = bundle.stat()
+        if (st.st_size, st.st_mtime_ns) != (self.bundle_size, self.bundle_mtime_ns):
+            raise ValueError(f'The manifest of {bundle.name} is outdated, the bundle has been replaced or modified since')
+
+    def save(self, f: Path) -> None:
+        data = {'algorithm': self.algorithm, 'entries': {name: astuple(e) for name, e in self.entries.items()}, 'blocks': self.blocks,
+                'bundle': [self.bundle_size, self.bundle_mtime_ns]}
+        tmp = f.with_name(f.name + '.tmp')
+        tmp.write_text(json.dumps(data, separators=(',', ':')))
+        tmp.rename(f)
+
+    @classmethod
+    def load(cls, f: Path) -> 'BundleManifest':
+        data = json.loads(f.read_text())
+        return cls(data['algorithm'], {name: ManifestEntry(*e) for name, e in data['entries'].items()}, data.get('blocks', []),
+                   *data.get('bundle', [-1, -1]))
+
+    def diff(self, old: 'BundleManifest') -> dict[str, str]:
+        """Changed paths compared to an older manifest: 'A' (added), 'D' (deleted) or the list of changes"""
+        if old.algorithm != self.algorithm:
+            raise ValueError(f'Manifests use different digests ({old.algorithm} and {self.algorithm})')
+        result: dict[str, str] = {}
+        for name in sorted(self.entries.keys() | old.entries.keys()):
+            if name not in old.entries:
+                result[name] = 'A'
+            elif name not in self.entries:
+                result[name] = 'D'
+            elif changes := self.entries[name].changes(old.entries[name]):
+                result[name] = ', '.join(changes)
+        return result
+
+    def read_file(self, bundle: Path, name: str) -> bytes:
+        """Content of a file in the bundle"""
+        self.check_bundle(bundle)
+        entry = self.entries.get(name.lstrip('/'))
+        if entry is not None and entry.type == tarfile.LNKTYPE.decode():
+            return self.read_file(bundle, entry.digest)
+        if entry is None or not entry.isfile():
+            raise ValueError(f'{name} is not a file in {bundle.name}' + (f' (link to {entry.digest})' if entry and entry.digest else ''))
+        if entry.offset < 0:
+            return self._read_from_archive(bundle, name.lstrip('/'))
+        if self.blocks and entry.size > 0:
+            return self._read_from_blocks(bundle, entry.offset, entry.size)
+        return self._read_from_stream(bundle, entry.offset, entry.size)
+
+    def _read_from_blocks(self, bundle: Path, offset: int, size: int) -> bytes:
+        first = bisect.bisect_right([b[1] for b in self.blocks], offset) - 1
+        last = bisect.bisect_right([b[1] for b in self.blocks], offset + size - 1) - 1
+        with open(bundle, 'rb') as f:
+            stream_header = f.read(12)
+            f.seek(self.blocks[first][0])
+            data = f.read(self.blocks[last][0] + self.blocks[last][2] - self.blocks[first][0])
+        # the decompressor outputs the blocks and then waits for the rest of the stream, which is never needed
+        start = offset - self.blocks[first][1]
+        return lzma.LZMADecompressor(format=lzma.FORMAT_XZ).decompress(stream_header + data, start + size)[start:]
+
+    def _read_from_stream(self, bundle: Path, offset: int, size: int) -> bytes:
+        """Decompress everything up to the file"""
+        with open(bundle, 'rb') as f:
+            proc = subprocess.Popen(compressor_for_file(bundle.name).decompress_command(), stdin=f, stdout=subprocess.PIPE)
+            assert proc.stdout is not None
+            try:
+                while offset > 0 and (skipped := len(proc.stdout.read(min(offset, 1024 * 1024)))) > 0:
+                    offset -= skipped
+                return proc.stdout.read(size)
+            finally:
+                proc.kill()
+                proc.wait()
+
+    def _read_from_archive(self, bundle: Path, name: str) -> bytes:
+        with open(bundle, 'rb') as f:
+            proc = subprocess.Popen(compressor_for_file(bundle.name).decompress_command(), stdin=f, stdout=subprocess.PIPE)
+            try:
+                with tarfile.open(fileobj=proc.stdout, mode='r|') as tar:
+                    for member in tar:
+                        if member.name == name:
+                            extracted = tar.extractfile(member)
+                            return extracted.read() if extracted else b''
+            finally:
+                proc.kill()
+                proc.wait()
+        raise ValueError(f'{name} not found in {bundle.name}')
@@ -6,6 +6,7 @@ from typing import Any, Sequence
 from vulnbuild.builds import BuildTask, Builder
 from vulnbuild.converter.converter import ConverterTask, Converter
 from vulnbuild.targets.password import PasswordTask
+from vulnbuild.utils.timings import timings
 from vulnbuild.vmbuilder.build_targets import VmBuildTarget
 
 
@@ -47,11 +48,22 @@ class OvaEncryptConverter(Converter[OvaEncryptTask]):
 
         output = self.get_output_file(task)
         output.parent.mkdir(parents=True, exist_ok=True)
-        passwd = PasswordTask(task.project).get_password()
-        subprocess.run(['7z', 'a', '-mx9', f'-p{passwd}', str(output), str(task.ova_file)])
+        with timings.stage('7z'):
+            subprocess.run(self.archive_command(task, output) + [str(task.ova_file)])
 
         print(f'[.] Created file {output.name} ...')
         return str(output)
 
+    def archive_command(self, task: OvaEncryptTask, output: Path, from_stdin: bool = False) -> list[str]:
+        """7z command that adds the ova to `output`, read from stdin if `from_stdin` (otherwise append the ova file)"""
+        passwd = PasswordTask(task.project).get_password()
+        config = task.project.compression
+        threads = f'-mmt{config.threads}' if config.threads > 0 else '-mmt=on'
+        # the disk images in an ova are compressed already, by default 7z only stores (and encrypts) them
+        cmd = ['7z', 'a', f'-mx{config.levels.get("7z", 0)}', threads, f'-p{passwd}']
+        if from_stdin:
+            cmd.append(f'-si{task.ova_file.name}')
+        return cmd + [str(output)]
+
     def clean(self, task: OvaEncryptTask) -> None:
         self.get_output_file(task).unlink(missing_ok=True)
@@ -0,0 +1,165 @@
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Sequence
+
+from vulnbuild.builds import BuildTask, Builder
+from vulnbuild.converter.cloud_bundle import CloudBundleTask, CloudBundleConverter, BundleOutput, OvaConsumer
+from vulnbuild.converter.cloud_bundle_encrypt import CloudBundleEncryptTask, CloudBundleEncryptConverter
+from vulnbuild.converter.compression import get_compressor
+from vulnbuild.converter.converter import ConverterTask, Converter, is_current
+from vulnbuild.converter.encryption import GpgEncryptor
+from vulnbuild.converter.ova_encrypt import OvaEncryptTask, OvaEncryptConverter
+from vulnbuild.targets.password import PasswordTask
+from vulnbuild.utils.timings import timings
+from vulnbuild.vmbuilder.build_targets import VmBuildTarget
+
+
+@dataclass
+class ReleaseTask(ConverterTask):
+    ova_file: Path
+    archive: OvaEncryptTask | None
+    bundles: list[CloudBundleTask]
+    encrypted_bundles: list[CloudBundleEncryptTask]
+
+    @property
+    def members(self) -> list[ConverterTask]:
+        archive: list[ConverterTask] = [self.archive] if self.archive else []
+        return archive + self.bundles + self.encrypted_bundles
+
+    @property
+    def doc(self) -> str:
+        return f'Create {", ".join(m.name for m in self.members)} with a single read of {self.ova_file.name}'
+
+
+class ReleaseConverter(Converter[ReleaseTask]):
+    """
+    Creates the encrypted ova archive, the cloud bundles and their encrypted versions in one pass (vm:<vm>:release).
+    The ova is read once (7z gets it while the disk image is extracted), the disk image is read and filtered once,
+    every bundle format is compressed once and passed through tee to gpg.
+    The member tasks skip building if their output has been created by the release since (see <ova>.release.json).
+    """
+
+    def __init__(self, ova_encrypt: OvaEncryptConverter, cloud_bundle: CloudBundleConverter,
+                 cloud_bundle_encrypt: CloudBundleEncryptConverter, formats: Sequence[str] = ('xz',)) -> None:
+        self._ova_encrypt = ova_encrypt
+        self._cloud_bundle = cloud_bundle
+        self._cloud_bundle_encrypt = cloud_bundle_encrypt
+        self._formats = formats
+
+    def get_conversion_targets(self, task: BuildTask, builder: Builder) -> Sequence[ReleaseTask]:
+        if not isinstance(task, VmBuildTarget):
+            return []
+        ova = builder.get_output_file(task)
+        archives = self._ova_encrypt.get_conversion_targets(task, builder)
+        bundles = [b for b in self._cloud_bundle.get_conversion_targets(task, builder) if b.compression in self._formats]
+        encrypted = [e for b in bundles for e in self._cloud_bundle_encrypt.get_conversion_targets(b, self._cloud_bundle)]
+        if ova is None or len(archives) + len(bundles) + len(encrypted) < 2:
+            return []  # nothing to share
+        return [ReleaseTask(name=f'vm:{task.name}:release', project=task.project, base=task, ova_file=ova,
+                            archive=archives[0] if archives else None, bundles=bundles, encrypted_bundles=encrypted)]
+
+    @classmethod
+    def accepts(cls, task: BuildTask) -> bool:
+        return isinstance(task, ReleaseTask)
+
+    def _builder(self, member: ConverterTask) -> Builder:
+        for converter in (self._ova_encrypt, self._cloud_bundle, self._cloud_bundle_encrypt):
+            if converter.accepts(member):
+                return converter
+        raise NotImplementedError(f'No builder for {member.name}')
+
+    def _output_file(self, member: ConverterTask) -> Path:
+        output = self._builder(member).get_output_file(member)
+        assert output is not None
+        return output
+
+    def _is_current(self, task: ReleaseTask, member: ConverterTask) -> bool:
+        """output exists and is newer than the ova, the password and (for encrypted bundles) the plain bundle"""
+        inputs = [task.ova_file, PasswordTask(task.project).password_file]
+        if isinstance(member, CloudBundleEncryptTask):
+            inputs.append(member.bundle_file)
+        return is_current(self._output_file(member), inputs)
+
+    def is_built(self, task: ReleaseTask) -> bool:
+        return all(self._is_current(task, member) for member in task.members)
+
+    def get_output_file(self, task: ReleaseTask) -> None:
+        return None
+
+    def dependencies(self, task: ReleaseTask) -> list[BuildTask]:
+        return super().dependencies(task) + [PasswordTask(task.project)]
+
+    @staticmethod
+    def stamp_file(task: ReleaseTask) -> Path:
+        return task.ova_file.with_name(f'{task.ova_file.name}.release.json')
+
+    def _load_stamp(self, task: ReleaseTask) -> dict[str, int]:
+        try:
+            return json.loads(self.stamp_file(task).read_text())
+        except FileNotFoundError:
+            return {}
+
+    def released(self, task: ReleaseTask, member: ConverterTask) -> bool:
+        """The output of `member` has been created by the release and is still current"""
+        output = self._output_file(member)
+        return self._is_current(task, member) and self._load_stamp(task).get(output.name) == output.stat().st_mtime_ns
+
+    def build_member(self, task: ReleaseTask, member: ConverterTask) -> Any:
+        """Build action of member tasks"""
+        if self.released(task, member):
+            print(f'[.] {self._output_file(member).name} has been created by {task.name} already.')
+            return str(self._output_file(member))
+        return self._builder(member).build(member)
+
+    def build(self, task: ReleaseTask) -> Any:
+        needed = [member for member in task.members if not self._is_current(task, member)]
+        if not needed:
+            print(f'[.] All outputs of {task.name} are up to date.')
+            return
+        print(f'[.] Creating {", ".join(self._output_file(m).name for m in needed)} from {task.ova_file.name} ...')
+        encryptor = GpgEncryptor(PasswordTask(task.project).password_file)
+
+        ova_consumers = []
+        if task.archive is not None and task.archive in needed:
+            archive_file = self._output_file(task.archive)
+            tmp_archive = archive_file.with_name(f'{archive_file.name}.tmp')
+            tmp_archive.unlink(missing_ok=True)  # 7z would add to an existing archive
+            ova_consumers.append(OvaConsumer(self._ova_encrypt.archive_command(task.archive, tmp_archive, from_stdin=True), tmp_archive, '7z'))
+
+        outputs = []
+        encrypt_only = []
+        for bundle in task.bundles:
+            plain_file = self._output_file(bundle) if bundle in needed else None
+            for encrypted in task.encrypted_bundles:
+                if encrypted in needed and encrypted.base == bundle:
+                    if plain_file is None:
+                        encrypt_only.append((self._output_file(bundle), self._output_file(encrypted)))
+                    else:
+                        compressor = get_compressor(bundle.compression, task.project.compression)
+                        outputs.append(BundleOutput(compressor, plain_file, self._output_file(encrypted), encryptor))
+                        plain_file = None
+            if plain_file is not None:
+                outputs.append(BundleOutput(get_compressor(bundle.compression, task.project.compression), plain_file))
+
+        if outputs:
+            self._cloud_bundle.convert(task.bundles[0], outputs, ova_consumers)
+        elif task.archive is not None and ova_consumers:
+            self._ova_encrypt.build(task.archive)
+            ova_consumers = []
+        for consumer in ova_consumers:
+            consumer.output_file.rename(consumer.output_file.with_suffix(''))
+        for plain_file, encrypted_file in encrypt_only:
+            # the plain bundle is current, encrypting it costs less than compressing again
+            with timings.stage('gpg'):
+                encryptor.encrypt_file(plain_file, encrypted_file)
+
+        stamp = self._load_stamp(task)
+        for member in needed:
+            output = self._output_file(member)
+            stamp[output.name] = output.stat().st_mtime_ns
+        self.stamp_file(task).write_text(json.dumps(stamp, indent=2))
+        print(f'[*] Created {", ".join(self._output_file(m).name for m in needed)}')
+
+    def clean(self, task: ReleaseTask) -> None:
+        self.stamp_file(task).unlink(missing_ok=True)
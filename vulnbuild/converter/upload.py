@@ -1,5 +1,11 @@
+import atexit
 import os
+import shutil
 import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any, Sequence
@@ -9,6 +15,8 @@ from vulnbuild.config import GlobalConfig
 from vulnbuild.converter.cloud_bundle import CloudBundleTask
 from vulnbuild.converter.converter import ConverterTask, Converter
 from vulnbuild.project import UploadConfig
+from vulnbuild.utils.chunking import ChunkIndex
+from vulnbuild.utils.timings import timings
 
 
 @dataclass
@@ -29,9 +37,109 @@ class UploadTask(ConverterTask):
         return f'Upload {self.base_file.name} to {self.upload_config.host}'
 
 
+LOCAL_HOST = 'local'  # uploads to a path on this machine (e.g. a mounted share), without ssh
+
+
+class UploadScheduler:
+    """
+    Runs uploads with rsync, at most `jobs` at once, with a shared bandwidth limit (KiB/s, 0 = unlimited).
+    All transfers to a host share one SSH connection (ControlMaster), permissions are set by rsync in the same transfer.
+    With jobs > 1 uploads run in background threads, doit considers them done on submission, wait() collects the results.
+    """
+
+    def __init__(self, jobs: int = 1, bwlimit: int = 0) -> None:
+        self.jobs = jobs
+        self.bwlimit = bwlimit
+        self._executor: ThreadPoolExecutor | None = None
+        self._futures: dict[str, Future[None]] = {}
+        self._control_dir: str | None = None
+        self._masters: set[str] = set()
+        self._lock = threading.Lock()
+        self.failed: list[str] = []
+
+    def ssh_command(self) -> list[str]:
+        if self._control_dir is None:
+            self._control_dir = tempfile.mkdtemp(prefix='vulnbuild-ssh-')
+            atexit.register(self.close)
+        return ['ssh', '-o', 'ControlMaster=auto', '-o', f'ControlPath={self._control_dir}/%C', '-o', 'ControlPersist=120']
+
+    def _ensure_master(self, host: str) -> None:
+        """Open the shared connection once per host, before transfers start in parallel"""
+        with self._lock:
+            if host not in self._masters:
+                subprocess.check_call(self.ssh_command() + [host, 'true'])
+                self._masters.add(host)
+
+    def destination(self, task: UploadTask, suffix: str = '') -> str:
+        path = task.upload_config.path
+        if suffix and not path.endswith('/'):
+            path += suffix  # path is a filename
+        if task.upload_config.host == LOCAL_HOST:
+            return path
+        return f'{task.upload_config.host}:{path}'
+
+    def rsync_command(self, task: UploadTask, source: Path | None = None, suffix: str = '') -> list[str]:
+        cmd = ['rsync', '-ap', '--partial']
+        if self.jobs <= 1:
+            cmd.append('--progress')  # unreadable with concurrent uploads
+        if task.upload_config.chmod:
+            cmd.append(f'--chmod=F{task.upload_config.chmod:o}')
+        if self.bwlimit > 0:
+            cmd.append(f'--bwlimit={max(1, self.bwlimit // max(1, self.jobs))}')
+        if task.upload_config.host != LOCAL_HOST:
+            cmd += ['-e', ' '.join(self.ssh_command())]
+        return cmd + [str(source or task.base_file), self.destination(task, suffix)]
+
+    def upload(self, task: UploadTask) -> None:
+        print(f'[.] Uploading {task.base_file.name} to {task.upload_config.host} ...')
+        if task.upload_config.host != LOCAL_HOST:
+            self._ensure_master(task.upload_config.host)
+        with timings.stage('rsync', task=task.fullname):
+            subprocess.check_call(self.rsync_command(task))
+        if task.upload_config.chunk_index:
+            with timings.stage('chunk index', task=task.fullname):
+                ChunkIndex.for_file(task.base_file)
+            index_file = ChunkIndex.index_file(task.base_file)
+            subprocess.check_call(self.rsync_command(task, index_file, index_file.name[len(task.base_file.name):]))
+        print(f'[*] Uploaded {task.base_file.name} to {task.upload_config.host}.')
+
+    def submit(self, task: UploadTask) -> None:
+        if self.jobs <= 1:
+            self.upload(task)
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix='upload')
+        print(f'[-] Upload {task.name} queued ({self.jobs} parallel uploads)')
+        self._futures[task.name] = self._executor.submit(self.upload, task)
+
+    def wait(self) -> None:
+        """Block until all submitted uploads are finished, raise if any of them failed"""
+        errors: list[str] = []
+        for name, future in sorted(self._futures.items()):
+            try:
+                future.result()
+            except Exception as e:
+                print(f'[!] Upload {name} failed: {e}', file=sys.stderr)
+                errors.append(name)
+        self._futures.clear()
+        if errors:
+            self.failed += errors
+            raise Exception(f'Upload failed: {", ".join(errors)}')
+
+    def close(self) -> None:
+        """Close shared SSH connections"""
+        with self._lock:
+            for host in self._masters:
+                subprocess.call(self.ssh_command() + ['-O', 'exit', host], stderr=subprocess.DEVNULL)
+            self._masters.clear()
+            if self._control_dir is not None:
+                shutil.rmtree(self._control_dir, ignore_errors=True)
+                self._control_dir = None
+
+
 class UploadConverter(Converter[UploadTask]):
-    def __init__(self) -> None:
-        pass
+    def __init__(self, scheduler: UploadScheduler | None = None) -> None:
+        self.scheduler = scheduler or UploadScheduler()
 
     def get_conversion_targets(self, task: BuildTask, builder: Builder) -> Sequence[UploadTask]:
         result = []
@@ -55,17 +163,7 @@ class UploadConverter(Converter[UploadTask]):
         return None
 
     def build(self, task: UploadTask) -> Any:
-        print(f'[.] Uploading {task.base_file.name} to {task.upload_config.host} ...')
-
-        subprocess.check_call(['rsync', '-apP', str(task.base_file), f'{task.upload_config.host}:{task.upload_config.path}'])
-
-        if task.upload_config.chmod:
-            output = task.upload_config.path
-            if task.upload_config.path.endswith('/'):
-                output += '/' + task.base_file.name
-            subprocess.check_call(['ssh', task.upload_config.host, 'chmod', oct(task.upload_config.chmod).replace('o', ''), output])
-
-        print(f'[*] Uploaded {task.base_file.name} to {task.upload_config.host}.')
+        self.scheduler.submit(task)
 
     def clean(self, task: UploadTask) -> None:
         pass
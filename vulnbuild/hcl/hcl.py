@@ -1,6 +1,8 @@
+import io
 import json
 from abc import ABC, abstractmethod
-from typing import Any, TypeAlias
+from json.encoder import encode_basestring_ascii
+from typing import Any, TypeAlias, TextIO
 
 from dataclasses import dataclass, field, fields
 
@@ -8,7 +10,17 @@ from dataclasses import dataclass, field, fields
 @dataclass
 class HclEntity(ABC):
     @abstractmethod
+    def write(self, out: TextIO, indent: int = 0) -> None:
+        """Serialize to a file handle or io.StringIO"""
+        raise NotImplementedError
+
     def to_string(self, indent: int = 0) -> str:
+        out = io.StringIO()
+        self.write(out, indent)
+        return out.getvalue()
+
+    @abstractmethod
+    def clone(self) -> 'HclEntity':
         raise NotImplementedError
 
 
@@ -16,8 +28,11 @@ class HclEntity(ABC):
 class HclConstant(HclEntity):
     name: str
 
-    def to_string(self, indent: int = 0) -> str:
-        return self.name
+    def write(self, out: TextIO, indent: int = 0) -> None:
+        out.write(self.name)
+
+    def clone(self) -> 'HclConstant':
+        return self  # never modified, can be shared
 
 
 ValueTypes: TypeAlias = str | int | float | bool | dict | list | HclConstant
@@ -28,22 +43,44 @@ class HclValue(HclEntity):
     value: ValueTypes
 
     @classmethod
-    def _serialize(cls, value: ValueTypes, indent: int = 0) -> str:
-        if isinstance(value, dict):
-            return '{\n' + \
-                ''.join(' ' * (indent + 4) + k + ' = ' + cls._serialize(v, indent + 4) + '\n' for k, v in value.items()) + \
-                (indent * ' ') + '}'
+    def _write(cls, out: TextIO, value: ValueTypes, indent: int = 0) -> None:
+        if isinstance(value, str):
+            out.write(encode_basestring_ascii(value))  # same as json.dumps, without the encoder setup
+        elif isinstance(value, dict):
+            out.write('{\n')
+            for k, v in value.items():
+                out.write(' ' * (indent + 4))
+                out.write(k)
+                out.write(' = ')
+                cls._write(out, v, indent + 4)
+                out.write('\n')
+            out.write(' ' * indent)
+            out.write('}')
         elif isinstance(value, list):
-            return '[' + ', '.join(cls._serialize(v, indent + 4) for v in value) + ']'
+            out.write('[')
+            for i, v in enumerate(value):
+                if i > 0:
+                    out.write(', ')
+                cls._write(out, v, indent + 4)
+            out.write(']')
         elif isinstance(value, HclConstant):
-            return value.to_string(indent)
-        # elif isinstance(value, str):
-        #     return f'"{value}"'
+            value.write(out, indent)
         else:
-            return json.dumps(value)
+            out.write(json.dumps(value))
 
-    def to_string(self, indent: int = 0) -> str:
-        return self._serialize(self.value, indent)
+    def write(self, out: TextIO, indent: int = 0) -> None:
+        self._write(out, self.value, indent)
+
+    @classmethod
+    def _copy(cls, value: ValueTypes) -> ValueTypes:
+        if isinstance(value, dict):
+            return {k: cls._copy(v) for k, v in value.items()}
+        elif isinstance(value, list):
+            return [cls._copy(v) for v in value]
+        return value  # immutable
+
+    def clone(self) -> 'HclValue':
+        return HclValue(self._copy(self.value))
 
 
 @dataclass
@@ -51,8 +88,13 @@ class HclArgument(HclEntity):
     name: str
     value: HclEntity
 
-    def to_string(self, indent: int = 0) -> str:
-        return f"{self.name} = {self.value.to_string(indent)}"
+    def write(self, out: TextIO, indent: int = 0) -> None:
+        out.write(self.name)
+        out.write(' = ')
+        self.value.write(out, indent)
+
+    def clone(self) -> 'HclArgument':
+        return HclArgument(self.name, self.value.clone())
 
     @classmethod
     def from_dict(cls, d: dict[str, Any]) -> list['HclArgument']:
@@ -70,12 +112,23 @@ class HclBlock(HclEntity):
     labels: list[str] = field(default_factory=list)
     children: list[HclEntity] = field(default_factory=list)
 
-    def to_string(self, indent: int = 0) -> str:
+    def write(self, out: TextIO, indent: int = 0) -> None:
         prefix: str = ' ' * indent
-        labels: str = "".join(" " + json.dumps(_) for _ in self.labels)
-        return f'{self.type}{labels} {{\n' + \
-            ''.join(prefix + '    ' + _.to_string(indent + 4) + '\n' for _ in self.children) + \
-            prefix + '}\n'
+        out.write(self.type)
+        for label in self.labels:
+            out.write(' ')
+            out.write(encode_basestring_ascii(label))
+        out.write(' {\n')
+        for child in self.children:
+            out.write(prefix)
+            out.write('    ')
+            child.write(out, indent + 4)
+            out.write('\n')
+        out.write(prefix)
+        out.write('}\n')
+
+    def clone(self) -> 'HclBlock':
+        return HclBlock(self.type, list(self.labels), [c.clone() for c in self.children])
 
     def get_argument(self, name: str) -> HclArgument | None:
         for c in self.children:
@@ -97,8 +150,16 @@ class HclBlock(HclEntity):
 class HclFile:
     blocks: list[HclEntity]
 
+    def write(self, out: TextIO) -> None:
+        for i, block in enumerate(self.blocks):
+            if i > 0:
+                out.write('\n')
+            block.write(out)
+
     def to_string(self) -> str:
-        return '\n'.join(block.to_string() for block in self.blocks)
+        out = io.StringIO()
+        self.write(out)
+        return out.getvalue()
 
     def get_blocks(self, type: str) -> list[HclBlock]:
         return [b for b in self.blocks if isinstance(b, HclBlock) and b.type == type]
@@ -117,5 +178,4 @@ class HclFile:
         self.blocks.append(var)
 
     def clone(self) -> 'HclFile':
-        from vulnbuild.hcl.parser import HclParser
-        return HclParser.parse(self.to_string())
+        return HclFile([b.clone() for b in self.blocks])
@@ -1,8 +1,11 @@
+import hashlib
 import json
+import os
+import pickle
+from pathlib import Path
 from typing import Any, Iterable, TypeVar
 
-import hcl2
-
+from vulnbuild.config import GlobalConfig
 from vulnbuild.hcl.hcl import HclFile, HclEntity, HclBlock, HclValue, HclArgument, HclConstant
 
 _T = TypeVar('_T')
@@ -18,6 +21,7 @@ def concat_lists(lsts: Iterable[list[_T]]) -> list[_T]:
 class HclParser:
     block_types: dict[str, int] = {
         'provisioner': 1,
+        'post-processor': 1,
         'required_plugins': 0,
         'vulnbuild': 1,
     }
@@ -75,7 +79,58 @@ class HclParser:
         else:
             raise ValueError(f"Unsupported type {type(value)}")
 
+    # path => ((mtime, size), parsed file)
+    _file_cache: dict[Path, tuple[tuple[int, int], HclFile]] = {}
+
+    # parsed files are pickled here, keyed by path and content hash. None disables the disk cache.
+    cache_dir: Path | None = GlobalConfig.base / '.build_cache' / 'hcl'
+    cache_version: int = 1  # increase if the parser output changes
+
     @classmethod
-    def parse(cls, text: str) -> HclFile:
+    def parse(cls, text: str, source: Path | None = None) -> HclFile:
+        """Parse HCL text. With the `source` file it was read from, the result is cached on disk."""
+        if cls.cache_dir is None or source is None:
+            return cls._parse(text)
+        # only the latest version of each file is kept, older ones are removed when a new one is written
+        prefix = hashlib.sha256(str(source.absolute()).encode()).hexdigest()[:16]
+        digest = hashlib.sha256(f'{cls.cache_version}\n{text}'.encode()).hexdigest()
+        cache_file = cls.cache_dir / f'{prefix}-{digest}.pickle'
+        try:
+            with open(cache_file, 'rb') as f:
+                result = pickle.load(f)
+            if isinstance(result, HclFile):
+                return result
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f'[-] Ignoring broken HCL cache file {cache_file}: {e}')
+        result = cls._parse(text)
+        try:
+            cls.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_file.rename(cache_file)
+            for old in cls.cache_dir.glob(f'{prefix}-*.pickle'):
+                if old != cache_file:
+                    old.unlink(missing_ok=True)
+        except OSError as e:
+            print(f'[-] Could not write HCL cache file {cache_file}: {e}')
+        return result
+
+    @classmethod
+    def _parse(cls, text: str) -> HclFile:
+        import hcl2  # slow to import, not needed for most commands
         d = hcl2.loads(text)
         return HclFile(cls._parse_collection(d, top_level=True))
+
+    @classmethod
+    def parse_file(cls, f: Path) -> HclFile:
+        """Parse a file, cached by modification time. The result is shared, clone() it before modifying."""
+        st = f.stat()
+        key = (st.st_mtime_ns, st.st_size)
+        cached = cls._file_cache.get(f)
+        if cached is None or cached[0] != key:
+            cached = (key, cls.parse(f.read_text(), f))
+            cls._file_cache[f] = cached
+        return cached[1]
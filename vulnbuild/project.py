@@ -14,12 +14,37 @@ class UploadConfig:
     host: str
     path: str
     chmod: int | None = None
+    chunk_index: bool = False  # upload <file>.chunks.json along with the file, for delta downloads
 
     @classmethod
     def from_dict(cls, uc: dict) -> 'UploadConfig':
         return cls(**uc)
 
 
+@dataclass
+class CompressionConfig:
+    threads: int = 0  # 0 = all cores
+    levels: dict[str, int] = field(default_factory=dict)  # per format (xz, zstd, gzip, 7z), tool defaults otherwise
+    rsyncable: bool = False  # gzip/zstd output that changes only locally if the input changes (for rsync and chunk indexes)
+    block_size: int = 0  # MiB, xz only: independent blocks, single files can be read without decompressing everything before
+
+    @classmethod
+    def from_dict(cls, cc: dict) -> 'CompressionConfig':
+        return cls(**cc)
+
+
+@dataclass
+class AptCacheConfig:
+    enabled: bool = True  # start a built-in apt cache if there is no apt-cacher-ng on this host
+    size_mb: int = 4096
+    mirrors: list[str] = field(default_factory=list)  # hosts whose packages are cached (even on private addresses), besides the Debian mirrors
+    clients: list[str] = field(default_factory=list)  # networks allowed to use the cache, besides loopback and docker/vbox bridges
+
+    @classmethod
+    def from_dict(cls, ac: dict) -> 'AptCacheConfig':
+        return cls(**ac)
+
+
 @dataclass
 class ServiceConfig:
     name: str
@@ -37,12 +62,29 @@ class ProjectConfig:
     title: str = ''
     version: str = ''
     vm_builder: str = ''
+    service_build_jobs: int = 1  # >1 builds services concurrently
+    service_build_cache_size: int = 3  # cached builds kept per service
+    service_build_package_cache: bool = True  # mount persistent apt/pip/npm/cargo/go caches into build containers
+    service_install_batch: bool = False  # upload all services as one tarball and install them in a single provisioner
+    service_install_jobs: int = 1  # >1 installs services concurrently inside the VM (implies service_install_batch)
+    compression: CompressionConfig = field(default_factory=CompressionConfig)
+    cloud_bundle_extractor: str = 'guestfish'  # reads the disk image without root, 'guestmount' mounts it with sudo
+    cloud_bundle_manifest: bool = True  # write <bundle>.manifest.json with digests of all files, see `vulnbuild diff`
+    release_fan_out: bool = False  # build 7z, bundle and encrypted bundle together in vm:<vm>:release when any of them is needed
+    apt_cache: AptCacheConfig = field(default_factory=AptCacheConfig)
+    artifact_store: bool = False  # keep built images/archives deduplicated in output/.store, see `vulnbuild stash-artifacts`
+    upload_jobs: int = 1  # >1 runs uploads concurrently
+    upload_bwlimit: int = 0  # KiB/s for all uploads together, 0 = unlimited
     uploads: list[UploadConfig] = field(default_factory=list)
     services: list[ServiceConfig] = field(default_factory=list)
 
     def __post_init__(self) -> None:
         if self.name == '':
             self.name = self.root.name
+        if isinstance(self.compression, dict):
+            self.compression = CompressionConfig.from_dict(self.compression)
+        if isinstance(self.apt_cache, dict):
+            self.apt_cache = AptCacheConfig.from_dict(self.apt_cache)
         for i, uc in enumerate(self.uploads):
             if isinstance(uc, dict):
                 self.uploads[i] = UploadConfig.from_dict(uc)
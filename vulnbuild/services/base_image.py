@@ -8,6 +8,14 @@ def docker_image_exists(image_name: str) -> bool:
     return len(output) >= 12
 
 
+def docker_image_id(image_name: str) -> str | None:
+    try:
+        output = subprocess.check_output(['docker', 'image', 'inspect', '--format', '{{.Id}}', image_name], stderr=subprocess.DEVNULL)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+    return output.decode().strip()
+
+
 class DefaultCiBaseImage:
     def __init__(self, image_name: str = 'saarsec/saarctf-ci-base') -> None:
         self.image_name = image_name
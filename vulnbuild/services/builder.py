@@ -1,17 +1,46 @@
+import hashlib
 import os
-import shutil
 import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
 from pathlib import Path
 
 from vulnbuild.builds import ServiceBuildTask, BuildTask, Builder
 from vulnbuild.project import ProjectConfig
-from vulnbuild.services.base_image import DefaultCiBaseImage
+from vulnbuild.services.base_image import DefaultCiBaseImage, docker_image_id
+from vulnbuild.services.cache import ServiceBuildCache
+from vulnbuild.services.package_cache import PackageCacheVolumes
 from vulnbuild.services.services import Service
+from vulnbuild.utils.hashing import update_with_tree
+from vulnbuild.utils.timings import timings
+
+
+_output_lock = threading.Lock()
+_base_image_lock = threading.Lock()
+
+
+def _run_prefixed(cmd: list[str], prefix: str) -> None:
+    """Run a command, prefix each line of its output (stdout+stderr) so that concurrent builds stay readable"""
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    assert proc.stdout is not None
+    for line in proc.stdout:
+        with _output_lock:
+            sys.stdout.write(f'[{prefix}] {line.decode(errors="replace")}')
+            sys.stdout.flush()
+    return_code = proc.wait()
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, cmd)
 
 
 class ServiceBuilder(Builder[ServiceBuildTask]):
     def __init__(self, project: ProjectConfig) -> None:
         self.project = project
+        self.cache = ServiceBuildCache(project.service_build_cache, project.service_build_cache_size)
+        self._digests: dict[str, str] = {}
+        self.package_cache: PackageCacheVolumes | None = None
+        if project.service_build_package_cache:
+            self.package_cache = PackageCacheVolumes(include_apt=project.service_build_jobs <= 1)
 
     @classmethod
     def accepts(cls, task: BuildTask) -> bool:
@@ -38,7 +67,7 @@ class ServiceBuilder(Builder[ServiceBuildTask]):
             print(f'[-] Service {service.name}: gamelib is not a git repository')
 
     def _cache_dir(self, service: Service) -> Path:
-        return self.project.service_build_cache / service.name
+        return self.cache.active_dir(service.name)
 
     def get_output_file(self, task: ServiceBuildTask) -> Path | None:
         return self._cache_dir(task.service)
@@ -46,48 +75,120 @@ class ServiceBuilder(Builder[ServiceBuildTask]):
     def dependencies(self, task: ServiceBuildTask) -> list[BuildTask]:
         return []
 
+    def _build_command(self) -> str:
+        commands = [
+            'cp -r /opt/input/*.sh /opt/input/service /opt/input/servicename /opt/input/gamelib /opt/output/',
+            '(timeout 3 /opt/input/gamelib/ci/buildscripts/test-and-configure-aptcache.sh || echo "no cache found.")',
+        ]
+        if self.package_cache is not None and self.package_cache.include_apt:
+            # debian images delete downloaded packages after each install, keep them in the mounted cache instead
+            commands.append('(rm -f /etc/apt/apt.conf.d/docker-clean; '
+                            'echo \'Binary::apt::APT::Keep-Downloaded-Packages "true";\' > /etc/apt/apt.conf.d/99vulnbuild-keep-downloads'
+                            ' || true) 2>/dev/null')
+        return ' && '.join(commands + [
+            'cd /opt/output',
+            './build.sh',
+            f'chown -R {os.getuid()} .'
+        ])
+
+    def source_digest(self, service: Service) -> str:
+        """Hash of everything that goes into a build: service tree (including gamelib), build image and build command"""
+        if service.name not in self._digests:
+            h = hashlib.sha256()
+            image = service.get_build_image()
+            h.update(f'{image}\0{docker_image_id(image) or ""}\0{self._build_command()}\0'.encode())
+            if service.exists:
+                update_with_tree(h, service.folder)
+            self._digests[service.name] = h.hexdigest()
+        return self._digests[service.name]
+
     def is_built(self, task: ServiceBuildTask) -> bool:
-        return self._cache_dir(task.service).exists()
+        return self.cache.active_digest(task.name) == self.source_digest(task.service)
 
     def clean(self, service: ServiceBuildTask, silent: bool = False) -> None:
-        cache = self._cache_dir(service.service)
-        if cache.exists():
-            shutil.rmtree(cache)
+        if self._cache_dir(service.service).exists() or self.cache.entries(service.name):
+            self.cache.remove(service.name)
             if not silent:
-                print(f'[*] Cached build for service {service.name} removed.')
+                print(f'[*] Cached builds for service {service.name} removed.')
         elif not silent:
             print(f'[*] Service {service.name} not cached.')
 
-    def build(self, task: ServiceBuildTask) -> None:
-        # Create cache folder
-        cache = self._cache_dir(task.service)
+    def build(self, task: ServiceBuildTask, prefix_output: bool = False) -> None:
         image = task.service.get_build_image()
-        self.clean(task)
-        cache.mkdir(parents=True, exist_ok=True)
-        cache.chmod(0o777)
 
         # ensure base image exists
         if image.startswith('saarsec/saarctf-ci-base'):
-            img = DefaultCiBaseImage()
-            if not img.exists():
-                img.build(task.service)
+            with _base_image_lock:
+                img = DefaultCiBaseImage()
+                if not img.exists():
+                    img.build(task.service)
+                    self._digests.pop(task.name, None)
+
+        digest = self.source_digest(task.service)
+        if self.cache.lookup(task.name, digest) is not None:
+            self.cache.activate(task.name, digest)
+            print(f'[*] Service {task.service.name} restored from build cache ({digest[:12]}).')
+            return
+
+        # Create staging folder
+        cache = self.cache.staging_dir(task.name, digest)
+        self.cache.discard_staging(task.name, digest)
+        cache.mkdir(parents=True, exist_ok=True)
+        cache.chmod(0o777)
 
         try:
             # Invoke Docker to build
-            build_cmd = ' && '.join([
-                'cp -r /opt/input/*.sh /opt/input/service /opt/input/servicename /opt/input/gamelib /opt/output/',
-                '(timeout 3 /opt/input/gamelib/ci/buildscripts/test-and-configure-aptcache.sh || echo "no cache found.")',
-                'cd /opt/output',
-                './build.sh',
-                f'chown -R {os.getuid()} .'
-            ])
             cmd = ['docker', 'run', '-v', f'{task.service.folder}/:/opt/input:ro', '-v', f'{cache}/:/opt/output:rw', '--rm']
+            if self.package_cache is not None:
+                cmd += self.package_cache.docker_args(image)
             cmd += [image]
-            cmd += ['/bin/sh', '-c', build_cmd]
+            cmd += ['/bin/sh', '-c', self._build_command()]
             print(f'[-] Invoking docker to build {task.service.name} ...')
             print('>', ' '.join(cmd))
-            subprocess.check_call(cmd)
-            print(f'[*] Service {task.service.name} has been built and cached.')
+            with timings.stage('docker build', task=task.fullname):
+                if prefix_output:
+                    _run_prefixed(cmd, task.service.name)
+                else:
+                    subprocess.check_call(cmd)
         except:
-            shutil.rmtree(cache)
+            self.cache.discard_staging(task.name, digest)
             raise
+        self.cache.add(task.name, digest)
+        self.cache.activate(task.name, digest)
+        for entry in self.cache.evict(task.name):
+            print(f'[.] Evicted cached build {entry.name[:12]} of service {task.service.name}')
+        print(f'[*] Service {task.service.name} has been built and cached ({digest[:12]}).')
+
+
+class ServiceBuildPool:
+    """
+    Builds services in background threads, with at most `jobs` builds at once.
+    doit considers a service task done once it has been submitted, everything that consumes build outputs must call wait() first.
+    """
+
+    def __init__(self, builder: ServiceBuilder, jobs: int) -> None:
+        self.builder = builder
+        self.jobs = jobs
+        self._executor: ThreadPoolExecutor | None = None
+        self._futures: dict[str, Future[None]] = {}
+        self.failed: list[str] = []
+
+    def submit(self, task: ServiceBuildTask) -> None:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix='service-build')
+        print(f'[-] Service {task.name} queued for build ({self.jobs} parallel builds)')
+        self._futures[task.name] = self._executor.submit(self.builder.build, task, prefix_output=True)
+
+    def wait(self) -> None:
+        """Block until all submitted builds are finished, raise if any of them failed"""
+        errors: list[str] = []
+        for name, future in sorted(self._futures.items()):
+            try:
+                future.result()
+            except Exception as e:
+                print(f'[!] Service {name} failed to build: {e}', file=sys.stderr)
+                errors.append(name)
+        self._futures.clear()
+        if errors:
+            self.failed += errors
+            raise Exception(f'Service build failed: {", ".join(errors)}')
@@ -0,0 +1,103 @@
+import os
+import shutil
+from pathlib import Path
+
+
+def copytree_linked(source: Path, target: Path) -> None:
+    """Copy a folder, hardlinking files where possible (same filesystem)"""
+
+    def link_or_copy(src: str, dst: str) -> None:
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    shutil.copytree(source, target, symlinks=True, copy_function=link_or_copy)
+
+
+class ServiceBuildCache:
+    """
+    Content-addressed store of service builds: <root>/.store/<service>/<digest>/
+    The active build of a service (<root>/<service>) is a hardlinked copy of one entry, <root>/<service>.digest tells which one.
+    At most `max_entries` builds are kept per service, the least recently used ones are evicted.
+    """
+
+    def __init__(self, root: Path, max_entries: int = 3) -> None:
+        self.root = root
+        self.max_entries = max_entries
+
+    @property
+    def store(self) -> Path:
+        return self.root / '.store'
+
+    def entry(self, service: str, digest: str) -> Path:
+        return self.store / service / digest
+
+    def staging_dir(self, service: str, digest: str) -> Path:
+        return self.store / service / f'{digest}.tmp'
+
+    def active_dir(self, service: str) -> Path:
+        return self.root / service
+
+    def _digest_file(self, service: str) -> Path:
+        return self.root / f'{service}.digest'
+
+    def active_digest(self, service: str) -> str | None:
+        if not self.active_dir(service).exists():
+            return None
+        try:
+            return self._digest_file(service).read_text().strip()
+        except FileNotFoundError:
+            return None
+
+    def lookup(self, service: str, digest: str) -> Path | None:
+        entry = self.entry(service, digest)
+        if not entry.is_dir():
+            return None
+        os.utime(entry)  # mark as recently used
+        return entry
+
+    def add(self, service: str, digest: str) -> Path:
+        """Move a finished build from the staging folder into the store"""
+        entry = self.entry(service, digest)
+        if entry.exists():
+            shutil.rmtree(entry)
+        self.staging_dir(service, digest).rename(entry)
+        os.utime(entry)
+        return entry
+
+    def discard_staging(self, service: str, digest: str) -> None:
+        shutil.rmtree(self.staging_dir(service, digest), ignore_errors=True)
+
+    def activate(self, service: str, digest: str) -> Path:
+        """Make a stored build the active build of a service"""
+        active = self.active_dir(service)
+        self.deactivate(service)
+        copytree_linked(self.entry(service, digest), active)
+        self._digest_file(service).write_text(digest + '\n')
+        return active
+
+    def deactivate(self, service: str) -> None:
+        active = self.active_dir(service)
+        if active.exists():
+            shutil.rmtree(active)
+        self._digest_file(service).unlink(missing_ok=True)
+
+    def entries(self, service: str) -> list[Path]:
+        """All stored builds of a service, most recently used first"""
+        folder = self.store / service
+        if not folder.is_dir():
+            return []
+        entries = [e for e in folder.iterdir() if e.is_dir() and not e.name.endswith('.tmp')]
+        return sorted(entries, key=lambda e: e.stat().st_mtime, reverse=True)
+
+    def evict(self, service: str) -> list[Path]:
+        evicted = self.entries(service)[self.max_entries:]
+        for entry in evicted:
+            shutil.rmtree(entry)
+        return evicted
+
+    def remove(self, service: str) -> None:
+        self.deactivate(service)
+        if (self.store / service).exists():
+            shutil.rmtree(self.store / service)
@@ -0,0 +1,61 @@
+import re
+import subprocess
+import threading
+
+
+class PackageCacheVolumes:
+    """
+    Persistent docker volumes with package manager caches (apt, pip, npm, cargo, go), one set per build image.
+    They are mounted into service build containers at the default cache locations,
+    so that repeated builds do not download the same packages again.
+    """
+
+    LABEL = 'vulnbuild.package-cache'
+
+    # cache name => mount points (a cache can have different locations, depending on the image)
+    paths: dict[str, list[str]] = {
+        'apt': ['/var/cache/apt/archives'],
+        'pip': ['/root/.cache/pip'],
+        'npm': ['/root/.npm'],
+        'cargo': ['/root/.cargo/registry', '/usr/local/cargo/registry'],
+        'go-mod': ['/root/go/pkg/mod', '/go/pkg/mod'],
+        'go-build': ['/root/.cache/go-build'],
+    }
+
+    def __init__(self, include_apt: bool = True) -> None:
+        # apt fails instead of waiting if another container holds the archive lock, don't share it between concurrent builds
+        self.include_apt = include_apt
+        self._created: set[str] = set()
+        self._lock = threading.Lock()
+
+    def caches(self) -> list[str]:
+        return [name for name in self.paths if self.include_apt or name != 'apt']
+
+    @classmethod
+    def volume_name(cls, image: str, cache: str) -> str:
+        return f'vulnbuild-cache-{re.sub(r"[^a-zA-Z0-9_.-]", "_", image)}-{cache}'
+
+    def ensure(self, image: str) -> None:
+        with self._lock:
+            for cache in self.caches():
+                volume = self.volume_name(image, cache)
+                if volume not in self._created:
+                    subprocess.check_call(['docker', 'volume', 'create', '--label', f'{self.LABEL}={image}', volume],
+                                          stdout=subprocess.DEVNULL)
+                    self._created.add(volume)
+
+    def docker_args(self, image: str) -> list[str]:
+        """Create the volumes of an image if necessary, return the mount arguments for `docker run`"""
+        self.ensure(image)
+        args = []
+        for cache in self.caches():
+            for path in self.paths[cache]:
+                args += ['-v', f'{self.volume_name(image, cache)}:{path}']
+        return args
+
+    @classmethod
+    def remove_all(cls) -> list[str]:
+        volumes = subprocess.check_output(['docker', 'volume', 'ls', '-q', '--filter', f'label={cls.LABEL}']).decode().split()
+        if volumes:
+            subprocess.check_call(['docker', 'volume', 'rm'] + volumes, stdout=subprocess.DEVNULL)
+        return volumes
@@ -1,6 +1,6 @@
 import os
 import sys
-from functools import partial
+from functools import partial, cached_property
 from pathlib import Path
 from typing import Callable, Iterator, TypedDict, Literal, Any
 
@@ -13,16 +13,19 @@ from vulnbuild.config import GlobalConfig
 from vulnbuild.converter.cloud_bundle import CloudBundleConverter
 from vulnbuild.converter.cloud_bundle_encrypt import CloudBundleEncryptConverter
 from vulnbuild.converter.cloud_image import CloudImageConverter, CloudImageTask
-from vulnbuild.converter.converter import Converter, ConverterTask
+from vulnbuild.converter.converter import Converter, ConverterTask, ConversionGraph
 from vulnbuild.converter.ova_encrypt import OvaEncryptConverter
-from vulnbuild.converter.upload import UploadConverter, UploadTask
+from vulnbuild.converter.release import ReleaseConverter, ReleaseTask
+from vulnbuild.converter.upload import UploadConverter, UploadTask, UploadScheduler
 from vulnbuild.project import ProjectConfig
-from vulnbuild.services.builder import ServiceBuilder
+from vulnbuild.services.builder import ServiceBuilder, ServiceBuildPool
 from vulnbuild.services.clone import ServiceCloneTask, ServiceCloner
 from vulnbuild.targets.password import PasswordTask, PasswordBuilder
 from vulnbuild.targets.ssh import SshKeyTask, SshKeyBuilder
 from vulnbuild.ui import query_yes_no
+from vulnbuild.utils.artifact_store import ArtifactStore
 from vulnbuild.utils.initial_checks import InitialCheckers
+from vulnbuild.utils.timings import timings, TimingReporter
 from vulnbuild.vmbuilder.build_targets import VmBuildTargetFactory, VmBuildTarget
 from vulnbuild.vmbuilder.vmbuilder import VmBuilder
 
@@ -38,6 +41,7 @@ class DoitTask(TypedDict, total=False):
     task_dep: list[str]
     file_dep: list[str | Path]
     uptodate: list[Callable]
+    teardown: list[Callable]
     params: list[dict[str, Any]]
 
 
@@ -47,16 +51,23 @@ class TaskCreator:
         self.services = project.get_services()
         self.service_tasks = [ServiceBuildTask(s.name, project, s) for s in self.services]
         self.service_builder = ServiceBuilder(project)
+        self.service_pool = ServiceBuildPool(self.service_builder, project.service_build_jobs)
+        self.upload_scheduler = UploadScheduler(project.upload_jobs, project.upload_bwlimit)
         self.vm_builder = VmBuilder(project, self.services)
         self.vms = VmBuildTargetFactory.from_project(self.project, self.vm_builder.get_backend().shortname())
+        self.artifact_store = ArtifactStore(project.output_dir.parent) if project.artifact_store else None
+        ova_encrypt = OvaEncryptConverter('vulnbox')
+        cloud_bundle = CloudBundleConverter('box')
+        cloud_bundle_encrypt = CloudBundleEncryptConverter('vulnbox')
+        self.release_converter = ReleaseConverter(ova_encrypt, cloud_bundle, cloud_bundle_encrypt)
         self.converters: list[Converter] = [
-            OvaEncryptConverter('vulnbox'),
-            CloudBundleConverter('box'),
-            CloudBundleEncryptConverter('vulnbox'),
+            ova_encrypt,
+            cloud_bundle,
+            cloud_bundle_encrypt,
+            self.release_converter,
             CloudImageConverter('vulnbox'),
-            UploadConverter(),
+            UploadConverter(self.upload_scheduler),
         ]
-        self.converter_tasks: list[ConverterTask] = self._build_converter_tasks()
 
     def task_builder(self, task: BuildTask) -> Builder:
         if isinstance(task, ServiceBuildTask):
@@ -75,18 +86,15 @@ class TaskCreator:
                     return converter
         raise NotImplementedError(f'task_builder of {type(task)} {task}')
 
-    def _build_converter_tasks(self) -> list[ConverterTask]:
-        result: list[ConverterTask] = []
-        for converter in self.converters:
-            result += converter.get_conversion_targets(PasswordTask(self.project), PasswordBuilder())
-            result += converter.get_conversion_targets(SshKeyTask(self.project), SshKeyBuilder())
-            for service in self.service_tasks:
-                result += converter.get_conversion_targets(service, self.task_builder(service))
-            for vm in self.vms.values():
-                result += converter.get_conversion_targets(vm, self.task_builder(vm))
-            for conversion_target in result:
-                result += converter.get_conversion_targets(conversion_target, self.task_builder(conversion_target))
-        return result
+    @cached_property
+    def converter_graph(self) -> ConversionGraph:
+        graph = ConversionGraph(self.converters, self.task_builder)
+        graph.resolve([PasswordTask(self.project), SshKeyTask(self.project)] + list(self.service_tasks) + list(self.vms.values()))
+        return graph
+
+    @property
+    def converter_tasks(self) -> list[ConverterTask]:
+        return list(self.converter_graph.tasks.values())
 
     def _basic_task(self, build_task: BuildTask) -> DoitTask:
         builder = self.task_builder(build_task)
@@ -114,25 +122,47 @@ class TaskCreator:
 
         return task
 
+    def _store_artifact(self, output: Path) -> None:
+        if self.artifact_store is not None and output.is_file():
+            print(f'[.] Adding {output.name} to the artifact store ...')
+            self.artifact_store.add(output)
+
+    def _use_artifact_store(self, task: DoitTask, build_task: BuildTask) -> None:
+        """Stashed artifacts are restored before doit checks them, new builds are added to the store"""
+        output = self.task_builder(build_task).get_output_file(build_task)
+        if self.artifact_store is None or output is None:
+            return
+        task['uptodate'].insert(0, partial(self.artifact_store.restore, output))
+        task['actions'].append((self._store_artifact, [output], {}))
+        if isinstance(task['clean'], list):
+            task['clean'].append(partial(self.artifact_store.forget, output))
+
     def get_initial_check_task(self) -> DoitTask:
+        checkers = InitialCheckers(self.project)
         return {
             'basename': 'initial_check',
             'verbosity': 2,
-            'actions': [InitialCheckers(self.project).check_required_programs]
+            'actions': [checkers.check_required_programs, checkers.start_apt_cache]
         }
 
     def build_service(self, service: ServiceBuildTask, dryrun: bool = False) -> None:
         print(f'[=] Service {service.name}')
-        if not dryrun:
-            self.service_builder.build(service)
-        else:
+        if dryrun:
             print('f[-] Skipping VM build due to dry run.')
+        elif self.project.service_build_jobs > 1:
+            self.service_pool.submit(service)
+        else:
+            self.service_builder.build(service)
+
+    def wait_for_services(self) -> None:
+        self.service_pool.wait()
 
     def get_service_version_tasks(self) -> Iterator[DoitTask]:
         for service in sorted(self.service_tasks):
+            # content hash of the service sources, covers uncommitted changes as well
             task: DoitTask = {
                 'name': service.name,
-                'actions': [f"git -C '{service.service.folder}' rev-parse HEAD"]
+                'actions': [(self.service_builder.source_digest, [service.service], {})]
             }
             if not service.service.exists:
                 task['task_dep'] = [ServiceCloneTask(self.project, self.project.get_service_config(service.name)).fullname]
@@ -144,8 +174,13 @@ class TaskCreator:
             task['task_dep'] = ['initial_check'] + task['task_dep']
             task['doc'] = f'Build Service {service.name} from ({service.service.folder})'
             task['actions'] = [(self.build_service, [service], {})]
+            # With parallel builds doit records the version on submission. A failed background build never becomes the active build,
+            # so is_built() forces a rebuild on the next run regardless of the recorded version.
             task['uptodate'].append(result_dep(f'_service_version:{service.name}'))
             task['clean'] = [partial(self.service_builder.clean, service)]
+            if self.project.service_build_jobs > 1:
+                # builds run in the background, doit must wait for them before finishing
+                task['teardown'] = [self.wait_for_services]
             yield task
 
     def get_service_pull_tasks(self) -> Iterator[DoitTask]:
@@ -181,6 +216,7 @@ class TaskCreator:
 
     def build_vm(self, vm: VmBuildTarget, dryrun: bool = False, force: bool = False) -> None:
         print(f'[.] Building VM {vm.name} ...')
+        self.wait_for_services()
         if not dryrun:
             if self.vm_builder.get_backend().is_registered(vm.name):
                 print(f'[!] Warning: VM {vm.name} already present.')
@@ -198,6 +234,7 @@ class TaskCreator:
             task['actions'] = [(self.build_vm, [vm], {})]
             task['params'] = [{'name': 'force', 'long': 'force', 'type': bool, 'default': False}]
             task['clean'] = [partial(self.vm_builder.clean, vm)]
+            self._use_artifact_store(task, vm)
             yield task
 
     def _simple_task(self, target: BuildTask, doc: str | None = None) -> DoitTask:
@@ -217,10 +254,21 @@ class TaskCreator:
         yield self._simple_task(SshKeyTask(self.project), doc='Create orga SSH key')
 
     def get_converter_tasks(self) -> Iterator[DoitTask]:
+        releases = {member.fullname: t for t in self.converter_tasks if isinstance(t, ReleaseTask) for member in t.members}
         for target in self.converter_tasks:
             task = self._simple_task(target, doc=target.doc)
+            if target.fullname in releases:
+                # outputs created by vm:<vm>:release are not built again
+                release = releases[target.fullname]
+                task['actions'] = [(self.release_converter.build_member, [release, target], {})]
+                if self.project.release_fan_out:
+                    task['task_dep'].append(release.fullname)
             if isinstance(target, CloudImageTask) or isinstance(target, UploadTask):
                 del task['uptodate']
+            if isinstance(target, UploadTask) and self.project.upload_jobs > 1:
+                # uploads run in the background, doit must wait for them before finishing
+                task['teardown'] = [self.upload_scheduler.wait]
+            self._use_artifact_store(task, target)
             yield task
 
 
@@ -238,10 +286,17 @@ class TaskCreatorFactory:
                 raise FileNotFoundError(GlobalConfig.projects / project_name)
             else:
                 project = ProjectConfig.from_path(GlobalConfig.projects / project_name)
+                timings.output_dir = project.output_dir / 'timings'
                 self._creator = TaskCreator(project)
                 self._print_project(project)
         return self._creator
 
+    def background_failed(self) -> bool:
+        """Failures of background service builds and uploads are only reported in doit's teardown"""
+        if self._creator is None:
+            return False
+        return len(self._creator.service_pool.failed) > 0 or len(self._creator.upload_scheduler.failed) > 0
+
     def with_project(self, f: Callable[[TaskCreator], DoitTask | Iterator[DoitTask]]) -> Callable[[], DoitTask | Iterator[DoitTask]]:
         def task_creator() -> DoitTask | Iterator[DoitTask]:
             return f(self._get_task_creator())
@@ -261,6 +316,7 @@ class TaskCreatorFactory:
 
             'DOIT_CONFIG': {
                 # 'default_tasks': ['list']
+                **({'reporter': TimingReporter} if timings.enabled else {})
             }
         }
 
@@ -0,0 +1,246 @@
+import hashlib
+import ipaddress
+import os
+import shutil
+import socket
+import threading
+import urllib.error
+import urllib.request
+from http.client import HTTPMessage
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import BinaryIO, Any, Iterable
+from urllib.parse import urlsplit
+
+# files that never change once published, everything else (Release, Packages, ...) is always fetched from the mirror
+CACHEABLE_SUFFIXES = ('.deb', '.udeb', '.dsc', '.tar.gz', '.tar.xz', '.tar.bz2', '.diff.gz')
+# the only hosts whose files are cached, other repositories are forwarded uncached (and only if they have public addresses)
+DEBIAN_MIRRORS = ('deb.debian.org', 'security.debian.org', 'ftp.debian.org', 'http.us.debian.org')
+# loopback (includes VirtualBox NAT), docker bridges, podman's default network, VirtualBox host-only networks
+CLIENT_NETWORKS = ('127.0.0.0/8', '::1/128', '172.16.0.0/12', '10.88.0.0/16', '192.168.56.0/21')
+
+
+def is_cacheable(url: str) -> bool:
+    path = urlsplit(url).path
+    return path.endswith(CACHEABLE_SUFFIXES) or '/by-hash/' in path
+
+
+def upstream_url(url: str) -> str:
+    """apt-cacher-ng convention: http://HTTPS///host/path is fetched from https://host/path"""
+    parts = urlsplit(url)
+    if parts.netloc.upper() == 'HTTPS' and parts.path.startswith('///'):
+        return 'https://' + url[len('http://HTTPS///'):]
+    return url
+
+
+class AptCacheStore:
+    """
+    Files downloaded through the proxy, stored by hash of their URL.
+    Once the total size exceeds `max_size` bytes, the least recently used files are evicted.
+    """
+
+    def __init__(self, root: Path, max_size: int) -> None:
+        self.root = root
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._size = sum(f.stat().st_size for f in self.files())
+
+    def files(self) -> list[Path]:
+        return [f for f in self.root.glob('*/*') if f.is_file() and not f.name.endswith('.tmp')]
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def path(self, url: str) -> Path:
+        digest = hashlib.sha256(url.encode()).hexdigest()
+        return self.root / digest[:2] / digest
+
+    def lookup(self, url: str) -> Path | None:
+        f = self.path(url)
+        try:
+            os.utime(f)  # mark as recently used
+        except FileNotFoundError:
+            return None
+        return f
+
+    def temp_file(self, url: str) -> Path:
+        f = self.path(url)
+        f.parent.mkdir(exist_ok=True)
+        return f.with_name(f'{f.name}.{threading.get_ident()}.tmp')
+
+    def add(self, url: str, tmp_file: Path) -> None:
+        f = self.path(url)
+        with self._lock:
+            if f.exists():
+                self._size -= f.stat().st_size
+            tmp_file.rename(f)
+            self._size += f.stat().st_size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self) -> None:
+        files = sorted(((f.stat().st_mtime, f.stat().st_size, f) for f in self.files()), key=lambda x: x[0])
+        for _, size, f in files:
+            if self._size <= self.max_size:
+                break
+            f.unlink(missing_ok=True)
+            self._size -= size
+
+
+class _ProxyHandler(BaseHTTPRequestHandler):
+    server: 'AptCacheProxy'
+    protocol_version = 'HTTP/1.1'
+    forwarded_headers = ('Range', 'If-Range', 'If-Modified-Since', 'If-None-Match', 'User-Agent')
+    returned_headers = ('Content-Type', 'Content-Length', 'Content-Range', 'Last-Modified', 'ETag', 'Accept-Ranges')
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send_simple(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if not self.server.is_allowed_client(self.client_address[0]):
+            self._send_simple(403, b'Forbidden\n')
+            return
+        if not self.path.startswith('http://'):
+            # clients detect apt-cacher-ng by this page
+            self._send_simple(200, b'vulnbuild Apt-Cacher compatible proxy\n')
+            return
+        url = upstream_url(self.path)
+        mirror = urlsplit(url).hostname in self.server.mirrors
+        if not mirror and not self.server.is_public_host(urlsplit(url).hostname):
+            self._send_simple(403, b'Forbidden: not a public host\n')
+            return
+        # third-party repositories are passed through, only the Debian mirrors are cached
+        cacheable = mirror and is_cacheable(url) and 'Range' not in self.headers
+        if cacheable:
+            cached = self.server.store.lookup(url)
+            if cached is not None:
+                self._send_cached(cached)
+                return
+        self._forward(url, cacheable)
+
+    def _send_cached(self, f: Path) -> None:
+        with open(f, 'rb') as fin:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(os.fstat(fin.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(fin, self.wfile, 1024 * 1024)
+
+    def _forward(self, url: str, cacheable: bool) -> None:
+        request = urllib.request.Request(url, headers={h: self.headers[h] for h in self.forwarded_headers if h in self.headers})
+        try:
+            response = self.server.opener.open(request, timeout=60)
+        except urllib.error.HTTPError as e:
+            response = e  # 304, 404 etc. are passed to the client
+        except OSError as e:
+            self._send_simple(502, f'Upstream error: {e}\n'.encode())
+            return
+        with response:
+            status = response.status if hasattr(response, 'status') else response.code
+            self.send_response(status)
+            for h in self.returned_headers:
+                if response.headers.get(h) is not None:
+                    self.send_header(h, response.headers[h])
+            if response.headers.get('Content-Length') is None:
+                self.send_header('Connection', 'close')
+                self.close_connection = True
+            self.end_headers()
+            if cacheable and status == 200:
+                self._copy_and_store(url, response, int(response.headers.get('Content-Length', -1)))
+            else:
+                shutil.copyfileobj(response, self.wfile, 1024 * 1024)
+
+    def _copy_and_store(self, url: str, response: BinaryIO, length: int) -> None:
+        tmp_file = self.server.store.temp_file(url)
+        last = b''
+        try:
+            with open(tmp_file, 'wb') as fout:
+                while chunk := response.read(1024 * 1024):
+                    fout.write(chunk)
+                    self.wfile.write(last)
+                    last = chunk
+            # the client must not see the end of the response before the file is cached, it might request it again right away
+            if length < 0 or tmp_file.stat().st_size == length:
+                self.server.store.add(url, tmp_file)
+            self.wfile.write(last)
+        finally:
+            tmp_file.unlink(missing_ok=True)
+
+
+class _RedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Follows redirects only to mirrors and public hosts, a public repository must not lead the proxy into internal networks"""
+
+    def __init__(self, proxy: 'AptCacheProxy') -> None:
+        self.proxy = proxy
+
+    def redirect_request(self, req: urllib.request.Request, fp: Any, code: int, msg: str, headers: HTTPMessage,
+                         newurl: str) -> urllib.request.Request | None:
+        host = urlsplit(newurl).hostname
+        if host not in self.proxy.mirrors and not self.proxy.is_public_host(host):
+            raise urllib.error.HTTPError(newurl, 403, 'Redirect to a non-public host', headers, fp)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+class AptCacheProxy(ThreadingHTTPServer):
+    """
+    Minimal caching HTTP proxy for apt, a stand-in for apt-cacher-ng on hosts that do not have it.
+    Listens on all interfaces (VMs and containers reach it through their gateway), but only serves clients in `clients`
+    (networks). Files from the hosts in `mirrors` are cached, requests to other hosts are forwarded uncached,
+    and only if the host has public addresses: the proxy gives no access to networks the build host is in.
+    """
+    daemon_threads = True
+
+    def __init__(self, store: AptCacheStore, port: int = 3142, host: str = '0.0.0.0',
+                 mirrors: Iterable[str] = DEBIAN_MIRRORS, clients: Iterable[str] = CLIENT_NETWORKS) -> None:
+        super().__init__((host, port), _ProxyHandler)
+        self.store = store
+        self.mirrors = frozenset(mirrors)
+        self.clients = [ipaddress.ip_network(network) for network in clients]
+        # never loop through ourselves
+        self.opener = urllib.request.build_opener(urllib.request.ProxyHandler({}), _RedirectHandler(self))
+        self._thread: threading.Thread | None = None
+
+    def is_allowed_client(self, address: str) -> bool:
+        ip = ipaddress.ip_address(address)
+        if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+            ip = ip.ipv4_mapped
+        return any(ip in network for network in self.clients)
+
+    @staticmethod
+    def is_public_host(host: str | None) -> bool:
+        """All addresses of the host are globally routable"""
+        try:
+            addresses = {str(info[4][0]) for info in socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)} if host else set()
+        except OSError:
+            return False
+        for address in addresses:
+            ip = ipaddress.ip_address(address.split('%')[0])
+            if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+                ip = ip.ipv4_mapped
+            if not ip.is_global:
+                return False
+        return bool(addresses)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.serve_forever, name='apt-cache-proxy', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
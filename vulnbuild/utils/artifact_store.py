@@ -0,0 +1,185 @@
+import hashlib
+import os
+from pathlib import Path
+
+from vulnbuild.utils.chunking import Chunk, ChunkIndex, iter_chunks
+
+
+class ArtifactStore:
+    """
+    Deduplicating store of build artifacts (images, archives) in <output>/.store:
+    - chunks/<xx>/<sha256>: content-defined chunks, shared by all artifacts and versions
+    - manifests/<artifact>/<sha256>.json: one chunk index per stored version of <output>/<artifact>
+    - manifests/<artifact>/current: the version that gets restored if <output>/<artifact> is missing
+    - files/<sha256>: hardlink of the last output file with that content, removed by gc once the output file is gone
+    Stashed artifacts only exist as chunks (and in files/ until the next gc), they are materialized again when a build needs them.
+    At most `max_versions` old versions are kept per artifact, `gc` removes older versions and unused chunks.
+    """
+
+    def __init__(self, output_root: Path, max_versions: int = 3) -> None:
+        self.output_root = output_root
+        self.root = output_root / '.store'
+        self.max_versions = max_versions
+
+    def chunk_file(self, sha256: str) -> Path:
+        return self.root / 'chunks' / sha256[:2] / sha256
+
+    def manifest_dir(self, f: Path) -> Path:
+        return self.root / 'manifests' / f.absolute().relative_to(self.output_root.absolute())
+
+    def _current_file(self, f: Path) -> Path:
+        return self.manifest_dir(f) / 'current'
+
+    def _linked_file(self, sha256: str) -> Path:
+        return self.root / 'files' / sha256
+
+    def current(self, f: Path) -> ChunkIndex | None:
+        try:
+            sha256 = self._current_file(f).read_text().strip()
+            return ChunkIndex.load(self.manifest_dir(f) / f'{sha256}.json')
+        except FileNotFoundError:
+            return None
+
+    def versions(self, f: Path) -> list[Path]:
+        """Manifests of all stored versions of an artifact, most recent first"""
+        folder = self.manifest_dir(f)
+        if not folder.is_dir():
+            return []
+        return sorted(folder.glob('*.json'), key=lambda m: m.stat().st_mtime, reverse=True)
+
+    def _write_atomic(self, target: Path, data: bytes) -> None:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f'{target.name}.{os.getpid()}.tmp')
+        tmp.write_bytes(data)
+        tmp.rename(target)
+
+    def add(self, f: Path) -> ChunkIndex:
+        """Store the current content of an artifact and make it the version to restore"""
+        h = hashlib.sha256()
+        chunks = []
+        offset = 0
+        with open(f, 'rb') as fin:
+            for data in iter_chunks(fin):
+                h.update(data)
+                chunk = Chunk(offset, len(data), hashlib.sha256(data).hexdigest())
+                if not self.chunk_file(chunk.sha256).exists():
+                    self._write_atomic(self.chunk_file(chunk.sha256), data)
+                chunks.append(chunk)
+                offset += len(data)
+        sha256 = h.hexdigest()
+        self._link(f, sha256)
+        index = ChunkIndex(f.name, offset, sha256, f.stat().st_mtime_ns, chunks)
+        self.manifest_dir(f).mkdir(parents=True, exist_ok=True)
+        index.save(self.manifest_dir(f) / f'{sha256}.json')
+        self._current_file(f).write_text(sha256 + '\n')
+        return index
+
+    def _link(self, f: Path, sha256: str) -> None:
+        linked = self._linked_file(sha256)
+        linked.parent.mkdir(parents=True, exist_ok=True)
+        linked.unlink(missing_ok=True)
+        try:
+            os.link(f, linked)
+        except OSError:
+            pass  # different filesystem
+
+    def stash(self, f: Path) -> bool:
+        """Remove an artifact that is stored unchanged, it can be restored later"""
+        index = self.current(f)
+        if index is None or not f.is_file():
+            return False
+        st = f.stat()
+        if index.size != st.st_size or index.mtime_ns != st.st_mtime_ns:
+            return False
+        f.unlink()
+        linked = self._linked_file(index.sha256)
+        if linked.exists() and linked.stat().st_nlink == 1:
+            linked.unlink()
+        return True
+
+    def restore(self, f: Path) -> None:
+        """Materialize a stashed artifact if it is missing. Returns None, so that it can be used as doit uptodate check."""
+        if f.exists():
+            return None
+        index = self.current(f)
+        if index is not None:
+            print(f'[.] Restoring {f.name} from the artifact store ...')
+            self.materialize(index, f)
+        return None
+
+    def materialize(self, index: ChunkIndex, target: Path) -> None:
+        tmp = target.with_name(f'{target.name}.{os.getpid()}.tmp')
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Builds might overwrite their output in place, so an inode is never shared by two output files.
+        # A stashed file is still there if gc did not run since, and was not modified if size and mtime match.
+        linked = self._linked_file(index.sha256)
+        try:
+            st = linked.stat()
+            if st.st_nlink == 1 and st.st_size == index.size and st.st_mtime_ns == index.mtime_ns:
+                os.link(linked, tmp)
+                tmp.rename(target)
+                return
+        except OSError:
+            pass  # not there or different filesystem, copy from chunks
+        with open(tmp, 'wb') as fout:
+            for chunk in index.chunks:
+                with open(self.chunk_file(chunk.sha256), 'rb') as fin:
+                    self._copy_chunk(fin.fileno(), fout.fileno(), chunk.length)
+        os.utime(tmp, ns=(index.mtime_ns, index.mtime_ns))
+        tmp.rename(target)
+        self._link(target, index.sha256)
+
+    @staticmethod
+    def _copy_chunk(fin: int, fout: int, length: int) -> None:
+        # copy_file_range copies inside the kernel without passing the data through userspace.
+        # Chunks are content-defined and end at arbitrary offsets, extents are not shared (no reflink) even where supported.
+        copied = 0
+        while copied < length:
+            try:
+                n = os.copy_file_range(fin, fout, length - copied)
+            except OSError:
+                data = memoryview(os.read(fin, min(length - copied, 1024 * 1024)))
+                n = len(data)
+                while data:
+                    data = data[os.write(fout, data):]
+            if n == 0:
+                raise IOError('Chunk file is truncated')
+            copied += n
+
+    def forget(self, f: Path) -> None:
+        """Do not restore an artifact anymore (after clean), its versions stay until the next gc"""
+        self._current_file(f).unlink(missing_ok=True)
+
+    def artifacts(self) -> list[Path]:
+        """Output files that have stored versions"""
+        manifests = self.root / 'manifests'
+        if not manifests.is_dir():
+            return []
+        return sorted(set(self.output_root / m.parent.relative_to(manifests) for m in manifests.glob('**/*.json')))
+
+    def gc(self) -> tuple[int, int]:
+        """Evict old versions, unused hardlinks and unreferenced chunks. Returns (removed chunks, freed bytes)."""
+        referenced: set[str] = set()
+        for f in self.artifacts():
+            current = self._current_file(f).read_text().strip() if self._current_file(f).exists() else None
+            old = [m for m in self.versions(f) if m.stem != current]
+            keep = self.max_versions if current is None else self.max_versions - 1
+            for manifest in old[max(keep, 0):]:
+                manifest.unlink()
+            for manifest in self.versions(f):
+                referenced.update(c.sha256 for c in ChunkIndex.load(manifest).chunks)
+        if (self.root / 'files').is_dir():
+            for linked in (self.root / 'files').iterdir():
+                if linked.stat().st_nlink <= 1:
+                    linked.unlink()
+        removed, freed = 0, 0
+        if (self.root / 'chunks').is_dir():
+            for chunk_file in (self.root / 'chunks').glob('*/*'):
+                if chunk_file.name not in referenced:
+                    freed += chunk_file.stat().st_size
+                    chunk_file.unlink()
+                    removed += 1
+        return removed, freed
+
+    def disk_usage(self) -> int:
+        return sum(c.stat().st_size for c in (self.root / 'chunks').glob('*/*')) if (self.root / 'chunks').is_dir() else 0
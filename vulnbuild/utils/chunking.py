@@ -0,0 +1,100 @@
+import hashlib
+import json
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Iterator, BinaryIO
+
+# Content-defined chunking: a chunk ends after the next occurrence of MARKER, but not before MIN_SIZE and not after MAX_SIZE.
+# Vulnbuild artifacts are compressed, the marker appears about every 64 KiB there.
+# An insertion or deletion only changes the chunks around it, later chunk boundaries are found at the same content again.
+MARKER = b'\x8e\x3b'
+MIN_SIZE = 16 * 1024
+MAX_SIZE = 256 * 1024
+READ_SIZE = 4 * 1024 * 1024
+
+
+def iter_chunks(f: BinaryIO) -> Iterator[bytes]:
+    buffer = b''
+    start = 0
+    eof = False
+    while True:
+        if not eof and len(buffer) - start < MAX_SIZE:
+            data = f.read(READ_SIZE)
+            eof = len(data) == 0
+            buffer = buffer[start:] + data
+            start = 0
+            continue
+        if start >= len(buffer):
+            return
+        pos = buffer.find(MARKER, start + MIN_SIZE - len(MARKER), start + MAX_SIZE)
+        end = pos + len(MARKER) if pos >= 0 else min(len(buffer), start + MAX_SIZE)
+        yield buffer[start:end]
+        start = end
+
+
+@dataclass
+class Chunk:
+    offset: int
+    length: int
+    sha256: str
+
+
+@dataclass
+class ChunkIndex:
+    """
+    Index of the content-defined chunks of a file, stored next to it as <file>.chunks.json.
+    Someone who has the previous version of a file only needs to fetch the chunks that are not in the old index.
+    """
+    file: str
+    size: int
+    sha256: str
+    mtime_ns: int = 0
+    chunks: list[Chunk] = field(default_factory=list)
+
+    @classmethod
+    def index_file(cls, f: Path) -> Path:
+        return f.with_name(f.name + '.chunks.json')
+
+    @classmethod
+    def from_file(cls, f: Path) -> 'ChunkIndex':
+        h = hashlib.sha256()
+        chunks = []
+        offset = 0
+        with open(f, 'rb') as fin:
+            for chunk in iter_chunks(fin):
+                h.update(chunk)
+                chunks.append(Chunk(offset, len(chunk), hashlib.sha256(chunk).hexdigest()))
+                offset += len(chunk)
+        return ChunkIndex(f.name, offset, h.hexdigest(), f.stat().st_mtime_ns, chunks)
+
+    @classmethod
+    def load(cls, f: Path) -> 'ChunkIndex':
+        d = json.loads(f.read_text())
+        d['chunks'] = [Chunk(*c) for c in d['chunks']]
+        return ChunkIndex(**d)
+
+    def save(self, f: Path) -> None:
+        d = asdict(self)
+        d['chunks'] = [[c.offset, c.length, c.sha256] for c in self.chunks]
+        f.write_text(json.dumps(d))
+
+    @classmethod
+    def for_file(cls, f: Path) -> 'ChunkIndex':
+        """Index of a file, reusing <file>.chunks.json if the file did not change since"""
+        index_file = cls.index_file(f)
+        st = f.stat()
+        if index_file.exists():
+            index = cls.load(index_file)
+            if index.size == st.st_size and index.mtime_ns == st.st_mtime_ns:
+                return index
+        index = cls.from_file(f)
+        index.save(index_file)
+        return index
+
+    def missing_chunks(self, old: 'ChunkIndex') -> list[Chunk]:
+        """Chunks of this file that are not part of an older version"""
+        known = set(c.sha256 for c in old.chunks)
+        return [c for c in self.chunks if c.sha256 not in known]
+
+    def missing_bytes(self, old: 'ChunkIndex') -> int:
+        return sum(c.length for c in self.missing_chunks(old))
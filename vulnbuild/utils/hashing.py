@@ -0,0 +1,41 @@
+import hashlib
+import os
+import stat
+from pathlib import Path
+from typing import Iterable
+
+_BUFFER_SIZE = 1024 * 1024
+
+
+def file_digest(f: Path, algorithm: str = 'sha256') -> str:
+    h = hashlib.new(algorithm)
+    with open(f, 'rb') as fp:
+        while chunk := fp.read(_BUFFER_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def update_with_tree(h: 'hashlib._Hash', folder: Path, exclude: Iterable[str] = ('.git',)) -> None:
+    """Feed names, modes, link targets and file contents of a folder (recursively, sorted) into a hash"""
+    excluded = set(exclude)
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = sorted(d for d in dirs if d not in excluded)
+        # symlinks to folders are listed in dirs, os.walk does not follow them
+        links = [d for d in dirs if os.path.islink(os.path.join(root, d))]
+        for name in [''] + sorted([f for f in files if f not in excluded] + links):
+            path = Path(root) / name
+            st = path.lstat()
+            h.update(f'{path.relative_to(folder)}\0{stat.S_IMODE(st.st_mode) & 0o111:o}\0'.encode())
+            if stat.S_ISLNK(st.st_mode):
+                h.update(b'L' + os.readlink(path).encode() + b'\0')
+            elif stat.S_ISREG(st.st_mode):
+                h.update(b'F%d\0' % st.st_size)
+                with open(path, 'rb') as fp:
+                    while chunk := fp.read(_BUFFER_SIZE):
+                        h.update(chunk)
+
+
+def tree_digest(folder: Path, exclude: Iterable[str] = ('.git',), algorithm: str = 'sha256') -> str:
+    h = hashlib.new(algorithm)
+    update_with_tree(h, folder, exclude)
+    return h.hexdigest()
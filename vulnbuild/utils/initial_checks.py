@@ -1,88 +1,185 @@
+import atexit
 import functools
+import json
+import os
 import subprocess
 import sys
-from typing import ParamSpec, TypeVar, Callable
-
-import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import ParamSpec, TypeVar, Callable, Any
 
+from vulnbuild.config import GlobalConfig
 from vulnbuild.project import ProjectConfig
 
 Param = ParamSpec("Param")
 RetType = TypeVar("RetType")
 
+TOOL_TTL = 3600  # seconds a successful tool check is remembered
+
 
 def cache_result(func: Callable[Param, RetType]) -> Callable[Param, RetType]:
     result: list[RetType] = []
+    lock = threading.Lock()
 
     @functools.wraps(func)
     def cached_func(*args: Param.args, **kwargs: Param.kwargs) -> RetType:
-        if not result:
-            result.append(func(*args, **kwargs))
-        return result[0]
+        with lock:  # probes run concurrently, but each one only once
+            if not result:
+                result.append(func(*args, **kwargs))
+            return result[0]
 
     return cached_func
 
 
+class ProbeCache:
+    """Results of slow environment probes, persisted between runs with a time to live"""
+
+    def __init__(self, f: Path) -> None:
+        self.f = f
+        self._lock = threading.Lock()
+        self._data: dict[str, dict[str, Any]] | None = None
+
+    def _load(self) -> dict[str, dict[str, Any]]:
+        if self._data is None:
+            try:
+                self._data = json.loads(self.f.read_text())
+            except (FileNotFoundError, ValueError):
+                self._data = {}
+        return self._data
+
+    def get(self, key: str, ttl: float) -> Any | None:
+        with self._lock:
+            entry = self._load().get(key)
+        if entry is None or time.time() - entry['time'] > ttl:
+            return None
+        return entry['value']
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._load()[key] = {'time': time.time(), 'value': value}
+            try:
+                self.f.parent.mkdir(parents=True, exist_ok=True)
+                tmp_file = self.f.with_name(f'{self.f.name}.{os.getpid()}.tmp')
+                tmp_file.write_text(json.dumps(self._data, indent=2))
+                tmp_file.rename(self.f)
+            except OSError:
+                pass  # cache only
+
+
+probe_cache = ProbeCache(GlobalConfig.base / '.build_cache' / 'probes.json')
+
+
+def _tool_available(cmd: list[str]) -> bool:
+    """Successful checks are cached, failed ones are repeated on the next run"""
+    key = 'tool:' + ' '.join(cmd)
+    if probe_cache.get(key, TOOL_TTL):
+        return True
+    try:
+        subprocess.check_call(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError):
+        return False
+    probe_cache.set(key, True)
+    return True
+
+
 @cache_result
 def assert_docker() -> None:
-    try:
-        subprocess.check_call(['docker', 'ps'], stdout=subprocess.DEVNULL, timeout=10)
-    except subprocess.CalledProcessError:
+    if not _tool_available(['docker', 'ps']):
         print('Docker is required in order to build the services. Please install docker.', file=sys.stderr)
         raise Exception('Tool missing: Docker')
 
 
 @cache_result
 def assert_podman() -> None:
-    try:
-        subprocess.check_call(['podman', 'ps'], stdout=subprocess.DEVNULL, timeout=10)
-    except subprocess.CalledProcessError:
+    if not _tool_available(['podman', 'ps']):
         print('Podman is required in order to build this image. Please podman docker.', file=sys.stderr)
         raise Exception('Tool missing: Podman')
 
 
 @cache_result
 def assert_packer() -> None:
-    try:
-        subprocess.check_call(['packer', '--version'], stdout=subprocess.DEVNULL, timeout=10)
-    except subprocess.CalledProcessError:
+    if not _tool_available(['packer', '--version']):
         print('Packer (https://packer.io) is required in order to build the vulnbox. Please install packer.', file=sys.stderr)
         raise Exception('Tool missing: Packer')
 
 
 @cache_result
 def assert_virtualbox() -> None:
-    try:
-        subprocess.check_call(['vboxmanage', '--version'], stdout=subprocess.DEVNULL, timeout=10)
-    except subprocess.CalledProcessError:
+    if not _tool_available(['vboxmanage', '--version']):
         print('Virtualbox is required in order to build the vulnbox. Please install Virtualbox.', file=sys.stderr)
         raise Exception('Tool missing: Virtualbox')
 
 
-@cache_result
-def apt_cacher_ng_present() -> bool:
+def _probe_apt_cacher_ng() -> bool:
+    import requests  # slow to import, not needed for most commands
     try:
         response = requests.get('http://localhost:3142/', timeout=1)
-        if 'Apt-Cacher' in response.text:
-            print('[*] Local apt-cacher-ng will be used to speed up build')
-            return True
+        return 'Apt-Cacher' in response.text
     except requests.RequestException:
-        print('[!] Hint: Install apt-cacher-ng to speed up builds')
+        return False
+
+
+@cache_result
+def apt_cacher_ng_present() -> bool:
+    if _probe_apt_cacher_ng():
+        print('[*] Local apt-cacher-ng will be used to speed up build')
+        return True
+    print('[!] Hint: Install apt-cacher-ng to speed up builds')
     return False
 
 
 class InitialCheckers:
     def __init__(self, project: ProjectConfig) -> None:
         self.project = project
+        self._apt_cacher_ng: bool | None = None
 
-    def check_required_programs(self) -> None:
-        assert_docker()
+    def _required_programs(self) -> list[Callable[[], None]]:
         match self.project.vm_builder:
             case 'virtualbox':
-                assert_packer()
-                assert_virtualbox()
+                return [assert_docker, assert_packer, assert_virtualbox]
             case 'podman':
-                assert_packer()
-                assert_podman()
+                return [assert_docker, assert_packer, assert_podman]
             case _:
-                assert_packer()
+                return [assert_docker, assert_packer]
+
+    def _prefetches(self) -> list[Callable[[], Any]]:
+        """Network lookups the build needs later on"""
+        if self.project.vm_builder == 'virtualbox':
+            from vulnbuild.vmbuilder.backends.backend import get_current_debian_version
+            return [get_current_debian_version]
+        return []
+
+    def start_apt_cache(self) -> None:
+        """Start the built-in apt cache for the rest of this run, unless apt-cacher-ng is running on this host"""
+        if not self.project.apt_cache.enabled:
+            return
+        present = self._apt_cacher_ng if self._apt_cacher_ng is not None else _probe_apt_cacher_ng()
+        if present:
+            return
+        from vulnbuild.utils.apt_proxy import AptCacheProxy, AptCacheStore, DEBIAN_MIRRORS, CLIENT_NETWORKS
+        config = self.project.apt_cache
+        store = AptCacheStore(GlobalConfig.base / '.build_cache' / 'apt', config.size_mb * 1024 * 1024)
+        try:
+            proxy = AptCacheProxy(store, mirrors=[*DEBIAN_MIRRORS, *config.mirrors], clients=[*CLIENT_NETWORKS, *config.clients])
+        except OSError as e:
+            print(f'[!] Could not start built-in apt cache on port 3142: {e}')
+            return
+        proxy.start()
+        atexit.register(proxy.stop)
+        print(f'[*] Started built-in apt cache on port 3142 ({store.size // 1024 // 1024} / {self.project.apt_cache.size_mb} MB used)')
+
+    def check_required_programs(self) -> None:
+        """Run all probes concurrently. Raises if a required program is missing, prefetches are not awaited."""
+        pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='probe')
+        try:
+            checks = [pool.submit(check) for check in self._required_programs()]
+            apt_cacher_ng = pool.submit(_probe_apt_cacher_ng)
+            for prefetch in self._prefetches():
+                pool.submit(prefetch)  # cached for later, errors are raised again once the value is needed
+            for check in checks:
+                check.result()
+            self._apt_cacher_ng = apt_cacher_ng.result()
+        finally:
+            pool.shutdown(wait=False)
@@ -5,6 +5,8 @@ import sys
 from base64 import b64encode, b64decode
 from typing import Any, TypeVar, ParamSpec, TypeAlias, Callable
 
+from vulnbuild.utils.timings import timings
+
 RT = TypeVar('RT')
 P = ParamSpec('P')
 
@@ -44,7 +46,8 @@ class SudoHelper:
 
         if not last_line.startswith(cls._result_prefix):
             raise Exception('sudo process returned no result')
-        success, result = pickle.loads(b64decode(last_line.strip()[len(cls._result_prefix):]))
+        success, result, records = pickle.loads(b64decode(last_line.strip()[len(cls._result_prefix):]))
+        timings.merge(records)
         if success:
             return result
         else:
@@ -57,7 +60,7 @@ class SudoHelper:
             result = (True, target(*args, **kwargs))
         except Exception as e:
             result = (False, e)
-        data = cls._result_prefix + b64encode(pickle.dumps(result))
+        data = cls._result_prefix + b64encode(pickle.dumps(result + (timings.records,)))
         print(data.decode())
 
 
@@ -0,0 +1,171 @@
+import hashlib
+import io
+import queue
+import tarfile
+import threading
+from typing import IO, Iterator
+
+COPY_BUFSIZE = 1024 * 1024
+
+
+class ArchiveReader:
+    """
+    Forward-only reader of a streamed tar archive that tells its position, so that tarfile can open it as seekable file (mode 'r:').
+    That avoids the buffering of tarfile's stream mode, which copies its buffer on every read.
+    The raw header blocks of each member are recorded, unmodified members can be copied to the output verbatim.
+    """
+
+    def __init__(self, f: IO[bytes]) -> None:
+        self._f = f
+        self._pos = 0
+        self._record_from = -1
+        self._record = bytearray()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._f.read(size)
+        if self._record_from >= 0:
+            skip = self._record_from - self._pos
+            self._record += data[skip:] if skip > 0 else data
+        self._pos += len(data)
+        return data
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, pos: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence != io.SEEK_SET or pos < self._pos:
+            raise io.UnsupportedOperation('archive stream can only seek forward')
+        while pos > self._pos and self.read(min(pos - self._pos, COPY_BUFSIZE)):
+            pass
+        return self._pos
+
+    def start_recording(self, pos: int) -> None:
+        """Record everything read from position `pos` on"""
+        self._record_from = pos
+        self._record = bytearray()
+
+    def stop_recording(self) -> bytes:
+        self._record_from = -1
+        return bytes(self._record)
+
+    def drain(self) -> None:
+        while self._f.read(COPY_BUFSIZE):
+            pass
+
+    def copy(self, length: int) -> Iterator[bytes]:
+        while length > 0:
+            data = self._f.read(min(length, COPY_BUFSIZE))
+            if not data:
+                raise tarfile.ReadError('unexpected end of data')
+            self._pos += len(data)
+            length -= len(data)
+            yield data
+
+
+class ArchiveWriter:
+    """
+    Output of tarfile (mode 'w:') that can be written to directly as well, tarfile only needs tell().
+    Everything is written to all given files (e.g. the inputs of several compressors).
+    """
+
+    def __init__(self, *outputs: IO[bytes]) -> None:
+        self._outputs = outputs
+        self._pos = 0
+
+    def write(self, data: bytes) -> int:
+        for f in self._outputs:
+            f.write(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+
+def iter_members(fi: tarfile.TarFile, reader: ArchiveReader) -> Iterator[tuple[tarfile.TarInfo, bytes]]:
+    """
+    Members of an archive opened on `reader` (call reader.start_recording(0) before opening it) with their raw header blocks.
+    Members are not collected in fi.members, memory usage does not grow with the number of files.
+    """
+    while (member := fi.next()) is not None:
+        yield member, reader.stop_recording()
+        fi.members.clear()  # type: ignore[attr-defined]
+        reader.start_recording(fi.offset)
+
+
+def strip_dot_header(header: bytes) -> bytes | None:
+    """Remove './' from name and hardlink target of a single-block ustar/gnu header, None if that is not possible"""
+    if len(header) != tarfile.BLOCKSIZE or header[257:262] != b'ustar':
+        return None
+    if header[257:265] == tarfile.POSIX_MAGIC and header[345] != 0:
+        return None  # name is split into prefix and name
+    buf = bytearray(header)
+    if buf[0:2] == b'./':
+        buf[0:100] = buf[2:100] + b'\0\0'
+    if buf[156:157] == tarfile.LNKTYPE and buf[157:159] == b'./':
+        buf[157:257] = buf[159:257] + b'\0\0'
+    buf[148:156] = b' ' * 8
+    buf[148:155] = b'%06o\0' % sum(buf)
+    return bytes(buf)
+
+
+class MemberHasher:
+    """
+    Digests of archive members. Large members are hashed in `jobs` threads (hashlib releases the GIL on large updates),
+    small ones right away, passing them to a thread costs more than hashing them.
+    """
+    threaded_size = 1024 * 1024
+
+    def __init__(self, jobs: int, algorithm: str = 'sha256') -> None:
+        self.algorithm = algorithm
+        self.digests: dict[str, str] = {}
+        self._queues: list[queue.Queue[tuple[str, bytes | None] | None]] = [queue.Queue(maxsize=16) for _ in range(jobs)]
+        self._threads = [threading.Thread(target=self._work, args=(q,), daemon=True) for q in self._queues]
+        self._current: queue.Queue[tuple[str, bytes | None] | None] | None = None
+        self._hash = hashlib.new(algorithm)
+        self._name = ''
+        self._count = 0
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self, q: 'queue.Queue[tuple[str, bytes | None] | None]') -> None:
+        pending: dict[str, 'hashlib._Hash'] = {}
+        while (item := q.get()) is not None:
+            name, data = item
+            if name not in pending:
+                pending[name] = hashlib.new(self.algorithm)
+            if data is None:
+                self.digests[name] = pending.pop(name).hexdigest()
+            else:
+                pending[name].update(data)
+
+    def start(self, name: str, size: int) -> None:
+        """Following updates belong to member `name`"""
+        self._name = name
+        if size >= self.threaded_size:
+            self._current = self._queues[self._count % len(self._queues)]
+            self._count += 1
+        else:
+            self._current = None
+            self._hash = hashlib.new(self.algorithm)
+
+    def update(self, data: bytes) -> None:
+        if self._current is not None:
+            self._current.put((self._name, data))
+        else:
+            self._hash.update(data)
+
+    def finish(self) -> None:
+        if self._current is not None:
+            self._current.put((self._name, None))
+        else:
+            self.digests[self._name] = self._hash.hexdigest()
+
+    def close(self) -> dict[str, str]:
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+        return self.digests
@@ -0,0 +1,167 @@
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Any
+
+from doit.reporter import ConsoleReporter  # type: ignore
+
+ENV_VARIABLE = 'VULNBUILD_TIMINGS'
+
+
+@dataclass
+class StageTiming:
+    task: str
+    stage: str  # '' for the whole task
+    wall: float  # seconds
+    cpu: float  # seconds, user+system of vulnbuild and its (finished) subprocesses
+    # KiB, high-water mark of vulnbuild and its largest subprocess since vulnbuild started, not the peak of this stage:
+    # ru_maxrss never decreases, every record after the largest subprocess shows its peak
+    max_rss: int
+    success: bool = True
+
+    @property
+    def key(self) -> str:
+        return f'{self.task} / {self.stage}' if self.stage else self.task
+
+
+def _cpu_time() -> float:
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _max_rss() -> int:
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+class Timings:
+    """
+    Records wall time and CPU time of doit tasks and of stages within them, and the memory high-water mark at their end.
+    Only active if VULNBUILD_TIMINGS=1 (set by `vulnbuild --timings`), so that processes started with sudo record as well.
+    """
+
+    def __init__(self) -> None:
+        self.records: list[StageTiming] = []
+        self.current_task: str = ''
+        self.output_dir: Path | None = None
+        self._lock = threading.Lock()
+        self._started: dict[str, tuple[float, float]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return os.environ.get(ENV_VARIABLE) == '1'
+
+    def start_task(self, task: str) -> None:
+        self.current_task = task
+        self._started[task] = (time.perf_counter(), _cpu_time())
+
+    def end_task(self, task: str, success: bool) -> None:
+        if task in self._started:
+            wall, cpu = self._started.pop(task)
+            self._add(StageTiming(task, '', time.perf_counter() - wall, _cpu_time() - cpu, _max_rss(), success))
+
+    @contextmanager
+    def stage(self, name: str, task: str | None = None) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        task = self.current_task if task is None else task
+        wall, cpu = time.perf_counter(), _cpu_time()
+        success = False
+        try:
+            yield
+            success = True
+        finally:
+            self._add(StageTiming(task, name, time.perf_counter() - wall, _cpu_time() - cpu, _max_rss(), success))
+
+    def _add(self, record: StageTiming) -> None:
+        with self._lock:
+            self.records.append(record)
+
+    def merge(self, records: list[StageTiming]) -> None:
+        """Add records of a child process (e.g. run with sudo)"""
+        for record in records:
+            self._add(StageTiming(record.task or self.current_task, record.stage, record.wall, record.cpu, record.max_rss, record.success))
+
+    def save(self) -> Path | None:
+        if not self.records or self.output_dir is None:
+            return None
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        name = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        json_file = self.output_dir / f'{name}.json'
+        json_file.write_text(json.dumps([asdict(r) for r in self.records], indent=2))
+        (self.output_dir / f'{name}.txt').write_text(format_table(self.records))
+        return json_file
+
+
+def load_timings(f: Path) -> list[StageTiming]:
+    records = json.loads(f.read_text())
+    for r in records:
+        if 'peak_rss' in r:
+            r['max_rss'] = r.pop('peak_rss')  # recorded before the rename, the same measurement
+    return [StageTiming(**r) for r in records]
+
+
+def _format_rows(rows: list[list[str]]) -> str:
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return ''.join('  '.join(c.ljust(w) if i == 0 else c.rjust(w) for i, (c, w) in enumerate(zip(row, widths))) + '\n' for row in rows)
+
+
+def format_table(records: list[StageTiming]) -> str:
+    rows = [['Task / Stage', 'Wall', 'CPU', 'Max RSS so far', '']]
+    for r in records:
+        rows.append([r.key, f'{r.wall:.1f}s', f'{r.cpu:.1f}s', f'{r.max_rss // 1024} MB', '' if r.success else 'FAILED'])
+    return _format_rows(rows)
+
+
+def compare_timings(old: list[StageTiming], new: list[StageTiming]) -> str:
+    def by_key(records: list[StageTiming]) -> dict[str, StageTiming]:
+        return {r.key: r for r in records}
+
+    def diff(a: float, b: float) -> str:
+        return f'{b - a:+.1f}s ({(b - a) / a * 100:+.0f}%)' if a > 0 else f'{b - a:+.1f}s'
+
+    old_records, new_records = by_key(old), by_key(new)
+    rows = [['Task / Stage', 'Wall (old)', 'Wall (new)', 'Wall diff', 'CPU diff']]
+    for key in list(old_records) + [k for k in new_records if k not in old_records]:
+        a, b = old_records.get(key), new_records.get(key)
+        if a and b:
+            rows.append([key, f'{a.wall:.1f}s', f'{b.wall:.1f}s', diff(a.wall, b.wall), diff(a.cpu, b.cpu)])
+        elif a:
+            rows.append([key, f'{a.wall:.1f}s', '-', '', ''])
+        elif b:
+            rows.append([key, '-', f'{b.wall:.1f}s', '', ''])
+    # the memory high-water mark is not attributable to stages, it is compared for the whole run only
+    old_rss, new_rss = max((r.max_rss for r in old), default=0), max((r.max_rss for r in new), default=0)
+    return _format_rows(rows) + f'Max RSS of the run: {old_rss // 1024} MB -> {new_rss // 1024} MB\n'
+
+
+timings = Timings()
+
+
+class TimingReporter(ConsoleReporter):
+    """doit reporter that times every executed task and writes a report at the end of the run"""
+
+    def execute_task(self, task: Any) -> None:
+        super().execute_task(task)
+        timings.start_task(task.name)
+
+    def add_success(self, task: Any) -> None:
+        super().add_success(task)
+        timings.end_task(task.name, True)
+
+    def add_failure(self, task: Any, fail: Any) -> None:
+        super().add_failure(task, fail)
+        timings.end_task(task.name, False)
+
+    def complete_run(self) -> None:
+        super().complete_run()
+        f = timings.save()
+        if f is not None:
+            self.write(f'\n{format_table(timings.records)}')
+            self.write(f'[*] Timings written to {f}\n')
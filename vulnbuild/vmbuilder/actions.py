@@ -1,14 +1,23 @@
+import hashlib
+import os
+import re
+import shlex
+import subprocess
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from typing import Any, ClassVar
 
 from vulnbuild.config import GlobalConfig
+from vulnbuild.converter.compression import get_compressor
 from vulnbuild.hcl.hcl import HclBlock, HclArgument
 from vulnbuild.hcl.parser import HclParser
-from vulnbuild.project import ProjectConfig
+from vulnbuild.project import ProjectConfig, CompressionConfig
+from vulnbuild.services.cache import ServiceBuildCache
 from vulnbuild.services.services import Service
+from vulnbuild.utils.hashing import update_with_tree
 from vulnbuild.utils.initial_checks import apt_cacher_ng_present
+from vulnbuild.utils.timings import timings
 
 
 @dataclass
@@ -17,6 +26,21 @@ class Action(ABC):
     def provisioners(self, **kwargs: Any) -> list[HclBlock]:
         raise NotImplementedError()
 
+    def fingerprint(self, variables: dict[str, str], **kwargs: Any) -> str:
+        """Hash of everything this action does to an image. `variables` are known packer variables (var.xyz) for referenced files."""
+        h = hashlib.sha256()
+        for block in self.provisioners(**kwargs):
+            h.update(block.to_string().encode())
+        return h.hexdigest()
+
+    def replay_after_snapshot(self) -> bool:
+        """Actions that configure access to the build host (apt cache) are repeated when a build starts from a snapshot"""
+        return False
+
+    def prepare(self) -> None:
+        """Create files the provisioners need, called right before packer runs"""
+        pass
+
 
 @dataclass
 class ScriptAction(Action):
@@ -29,6 +53,14 @@ class ScriptAction(Action):
             }))
         )]
 
+    def fingerprint(self, variables: dict[str, str], **kwargs: Any) -> str:
+        h = hashlib.sha256(super().fingerprint(variables, **kwargs).encode())
+        h.update(self.script.read_bytes())
+        return h.hexdigest()
+
+    def replay_after_snapshot(self) -> bool:
+        return self.script.name.endswith('_apt_cacher_ng.sh')
+
     def __str__(self) -> str:
         return f'Script {self.script.relative_to(GlobalConfig.projects)}'
 
@@ -36,7 +68,12 @@ class ScriptAction(Action):
 @dataclass
 class PackerAction(Action):
     name: str
-    provisioner_blocks: list[HclBlock]
+    filename: Path
+
+    @property
+    def provisioner_blocks(self) -> list[HclBlock]:
+        # parsed on first use, listing tasks does not need it
+        return HclParser.parse_file(self.filename).get_blocks('provisioner')
 
     def provisioners(self, **kwargs: Any) -> list[HclBlock]:
         return self.provisioner_blocks
@@ -45,12 +82,33 @@ class PackerAction(Action):
     def from_file(cls, filename: Path) -> 'PackerAction':
         # with open(filename, 'r') as f:
         # return PackerAction(filename.name, yaml.safe_load(f))
-        return PackerAction(filename.name, HclParser.parse(filename.read_text()).get_blocks('provisioner'))
+        return PackerAction(filename.name, filename)
+
+    def fingerprint(self, variables: dict[str, str], **kwargs: Any) -> str:
+        h = hashlib.sha256(super().fingerprint(variables, **kwargs).encode())
+        # include contents of uploaded files
+        for block in self.provisioner_blocks:
+            source = block.get_argument('source')
+            if block.labels == ['file'] and source is not None and isinstance(source.get_raw_value(), str):
+                unresolved = [m.group(0) for m in re.finditer(r'\$\{var\.(\w+)}', str(source.get_raw_value())) if m.group(1) not in variables]
+                if unresolved:
+                    # the uploaded content is unknown, an image with this action must never be taken for unchanged
+                    print(f'[!] {self.filename.name}: cannot resolve {", ".join(unresolved)}, snapshots after this action are not reused')
+                    h.update(b'unresolved\0' + str(source.get_raw_value()).encode() + os.urandom(16))
+                    continue
+                f = self.filename.parent / re.sub(r'\$\{var\.(\w+)}', lambda m: variables[m.group(1)], str(source.get_raw_value()))
+                if f.is_dir():
+                    update_with_tree(h, f)
+                elif f.is_file():
+                    h.update(f.read_bytes())
+        return h.hexdigest()
 
     def __str__(self) -> str:
         return f'Packer commands {self.name}'
 
     def required_ssh_keypair(self) -> bool:
+        if 'ssh_vulnbox' not in self.filename.read_text():
+            return False
         return any('ssh_vulnbox' in block.to_string() for block in self.provisioner_blocks)
 
 
@@ -88,6 +146,9 @@ class AptCacherNgAction(Action):
         else:
             return []
 
+    def replay_after_snapshot(self) -> bool:
+        return True
+
     def __str__(self) -> str:
         return 'Configure apt-cacher-ng if available'
 
@@ -135,10 +196,170 @@ class ServiceAction(Action):
                 }))
             )]
 
+    def fingerprint(self, variables: dict[str, str], **kwargs: Any) -> str:
+        h = hashlib.sha256(super().fingerprint(variables, **kwargs).encode())
+        h.update((ServiceBuildCache(self.build_dir.parent).active_digest(self.service.name) or '').encode())
+        return h.hexdigest()
+
     def __str__(self) -> str:
         return f'Install service {self.service.name}'
 
 
+@dataclass
+class ServiceBatchAction(Action):
+    """
+    Installs all services with one upload: the builds are packed into a single tarball,
+    a single shell provisioner extracts it and installs the services in order.
+    Output of each installation is prefixed with the service name.
+    With jobs > 1, up to `jobs` services are installed concurrently. Package managers are serialized by lock files then.
+    """
+    services: list[ServiceAction]
+    bundle: Path
+    compression: CompressionConfig
+    jobs: int = 1
+
+    # lock name => package managers that must not run concurrently
+    locked_tools: ClassVar[dict[str, list[str]]] = {
+        'apt': ['apt', 'apt-get', 'aptitude', 'dpkg'],
+        'pip': ['pip', 'pip3'],
+    }
+    apt_lock_config: ClassVar[str] = '/etc/apt/apt.conf.d/99vulnbuild-lock-timeout'
+
+    def provisioners(self, tmp_dir: str = '/dev/shm', **kwargs: Any) -> list[HclBlock]:
+        folder = f'{tmp_dir}/vulnbuild-services'
+        lines = [
+            'set -o pipefail',
+            f'mkdir -p {folder}',
+            f'tar -xzf {tmp_dir}/{self.bundle.name} -C {folder}',
+            f'rm -f {tmp_dir}/{self.bundle.name}',
+            'install_service() {',
+            f'  cd {folder}/$1',
+            '  . ./gamelib/ci/buildscripts/prepare-install.sh',
+            '  ./install.sh',
+            '  ./gamelib/ci/buildscripts/post-install.sh',
+            '}',
+        ]
+        if self.jobs > 1:
+            lines += self._parallel_install(folder)
+        else:
+            for action in self.services:
+                name = shlex.quote(action.service.name)
+                lines += [
+                    f'echo "===== Installing service {action.service.name} ... ====="',
+                    f'(install_service {name}) 2>&1 | sed -u "s/^/[{action.service.name}] /"',
+                ]
+        lines += ['cd /', f'rm -rf {folder}']
+        return [
+            HclBlock(
+                'provisioner', ['file'], list(HclArgument.from_dict({
+                    'source': str(self.bundle),
+                    'destination': f'{tmp_dir}/{self.bundle.name}'
+                }))
+            ),
+            HclBlock(
+                'provisioner', ['shell'], list(HclArgument.from_dict({
+                    'inline_shebang': '/bin/bash -e',
+                    'inline': lines,
+                    'environment_vars': ['NO_DOCKER_SYSTEMD=1']
+                }))
+            )
+        ]
+
+    def _parallel_install(self, folder: str) -> list[str]:
+        names = ' '.join(shlex.quote(a.service.name) for a in self.services)
+        lines = [f'mkdir -p {folder}/.bin {folder}/.status']
+        # wrappers take a lock before running a package manager, absolute calls of apt wait for the dpkg lock.
+        # Package managers call each other (maintainer scripts run dpkg while apt-get holds the lock),
+        # nested calls see the marker variable and run the tool directly.
+        for lock, tools in self.locked_tools.items():
+            marker = f'VULNBUILD_{lock.upper()}_LOCKED'
+            lines += [
+                f'for tool in {" ".join(tools)}; do',
+                '  real=$(command -v $tool) || continue',
+                f'  printf \'#!/bin/sh\\nif [ -n "${marker}" ]; then exec %s "$@"; fi\\nexport {marker}=1\\n'
+                f'exec flock /run/lock/vulnbuild-{lock}.lock %s "$@"\\n\' "$real" "$real" > {folder}/.bin/$tool',
+                f'  chmod +x {folder}/.bin/$tool',
+                'done',
+            ]
+        lines += [
+            f'if [ -d $(dirname {self.apt_lock_config}) ]; then echo \'DPkg::Lock::Timeout "3600";\' > {self.apt_lock_config}; fi',
+            f'export PATH={folder}/.bin:$PATH',
+            'start_service() {',
+            '  echo "===== Installing service $1 ... ====="',
+            '  ( set +e',
+            '    bash -e -o pipefail -c "$(declare -f install_service); install_service $1" 2>&1 | sed -u "s/^/[$1] /"',
+            f'    echo ${{PIPESTATUS[0]}} > {folder}/.status/$1 ) &',
+            '}',
+            f'for service in {names}; do',
+            f'  while [ "$(jobs -rp | wc -l)" -ge {self.jobs} ]; do wait -n || true; done',
+            '  start_service $service',
+            'done',
+            'wait',
+            f'rm -f {self.apt_lock_config}',
+            'failed=""',
+            f'for service in {names}; do',
+            f'  [ "$(cat {folder}/.status/$service)" = 0 ] || failed="$failed $service"',
+            'done',
+            'if [ -n "$failed" ]; then echo "===== Installation failed:$failed ====="; exit 1; fi',
+        ]
+        return lines
+
+    def _digests(self) -> str:
+        cache = ServiceBuildCache(self.bundle.parent)
+        return ''.join(f'{a.service.name} {cache.active_digest(a.service.name)}\n' for a in self.services)
+
+    def fingerprint(self, variables: dict[str, str], **kwargs: Any) -> str:
+        h = hashlib.sha256(super().fingerprint(variables, **kwargs).encode())
+        h.update(self._digests().encode())
+        return h.hexdigest()
+
+    def prepare(self) -> None:
+        digest_file = self.bundle.with_name(self.bundle.name + '.digest')
+        digests = self._digests()
+        if self.bundle.exists() and digest_file.exists() and digest_file.read_text() == digests:
+            print(f'[*] Service bundle {self.bundle.name} is up to date')
+            return
+        print(f'[-] Packing {len(self.services)} services into {self.bundle.name} ...')
+        tmp_file = self.bundle.with_name(self.bundle.name + '.tmp')
+        compressor = get_compressor('gzip', self.compression)
+        try:
+            with timings.stage('pack services'), open(tmp_file, 'wb') as f:
+                tar = subprocess.Popen(['tar', '-cf', '-', '--owner=0', '--group=0', '-C', str(self.bundle.parent)]
+                                       + [a.build_dir.name for a in self.services], stdout=subprocess.PIPE)
+                assert tar.stdout is not None
+                try:
+                    subprocess.check_call(compressor.compress_command(), stdin=tar.stdout, stdout=f)
+                finally:
+                    tar.stdout.close()
+                    tar.wait()
+                if tar.returncode != 0:
+                    raise subprocess.CalledProcessError(tar.returncode, 'tar')
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
+        tmp_file.rename(self.bundle)
+        digest_file.write_text(digests)
+
+    def __str__(self) -> str:
+        jobs = f' ({self.jobs} parallel)' if self.jobs > 1 else ''
+        return f'Install services {", ".join(a.service.name for a in self.services)}{jobs}'
+
+
+@dataclass
+class AptProxyResetAction(Action):
+    """Snapshots must not depend on the apt cache of the building host"""
+
+    def provisioners(self, **kwargs: Any) -> list[HclBlock]:
+        return [HclBlock(
+            'provisioner', ['shell'], list(HclArgument.from_dict({
+                'inline': ['rm -f /etc/apt/apt.conf.d/01proxy']
+            }))
+        )]
+
+    def __str__(self) -> str:
+        return 'Remove apt proxy configuration'
+
+
 class ActionFactory:
     def __init__(self, project: ProjectConfig, services: list[Service]) -> None:
         self.project = project
@@ -156,7 +377,11 @@ class ActionFactory:
         if f.name.endswith('_apt_cacher_ng.sh'):
             return [AptCacherNgScriptAction(f)]
         if f.name.endswith('_services'):
-            return [ServiceAction(service, self.project.service_build_cache / service.name) for service in self.services]
+            actions = [ServiceAction(service, self.project.service_build_cache / service.name) for service in self.services]
+            if (self.project.service_install_batch or self.project.service_install_jobs > 1) and actions:
+                bundle = self.project.service_build_cache / 'services.tar.gz'
+                return [ServiceBatchAction(actions, bundle, self.project.compression, self.project.service_install_jobs)]
+            return list(actions)
         return []
 
     def create_many(self, files: list[Path]) -> list[Action]:
@@ -4,19 +4,43 @@ from abc import ABC, abstractmethod
 from pathlib import Path
 from typing import Any
 
-import requests
-
 from vulnbuild.config import GlobalConfig
 from vulnbuild.hcl.hcl import HclFile
 from vulnbuild.project import ProjectConfig
-from vulnbuild.utils.initial_checks import cache_result
+from vulnbuild.utils.initial_checks import cache_result, probe_cache
+from vulnbuild.utils.timings import timings
 from vulnbuild.vmbuilder.build_targets import VmBuildTarget
+from vulnbuild.vmbuilder.debian_iso import DebianIsoStore
+
+
+DEBIAN_VERSION_TTL = 24 * 3600
+
+
+def debian_iso_store() -> DebianIsoStore:
+    return DebianIsoStore(GlobalConfig.base / '.build_cache' / 'iso')
 
 
 @cache_result
 def get_current_debian_version() -> str:
-    response = requests.get('http://cdimage.debian.org/cdimage/release/')
-    return re.findall(r'href="(\d+\.\d+.\d+)/"', response.text)[0]
+    """Latest Debian release, cached for a day. Offline, the last known release or the newest local ISO is used."""
+    version = probe_cache.get('debian_version', DEBIAN_VERSION_TTL)
+    if version is not None:
+        return version
+    import requests  # slow to import, not needed for most commands
+    try:
+        response = requests.get('http://cdimage.debian.org/cdimage/release/', timeout=10)
+        version = re.findall(r'href="(\d+\.\d+.\d+)/"', response.text)[0]
+    except (requests.RequestException, IndexError) as e:
+        version = probe_cache.get('debian_version', float('inf'))
+        if version is None:
+            local_versions = debian_iso_store().versions()
+            if not local_versions:
+                raise
+            version = local_versions[0]
+        print(f'[!] Could not resolve current Debian release ({e}), using {version}')
+        return version
+    probe_cache.set('debian_version', version)
+    return version
 
 
 class VmBuilderBackend(ABC):
@@ -66,7 +90,7 @@ class VmBuilderBackend(ABC):
             'base': str(GlobalConfig.base),
             'project_output_dir': str(target.project.output_dir)
         }
-        if target.packer_script and target.packer_script.get_variable('debian_version'):
+        if target.packer_script.get_variable('debian_version'):
             variables['debian_version'] = get_current_debian_version()
         return variables
 
@@ -77,22 +101,64 @@ class VmBuilderBackend(ABC):
     def _process_hcl(self, target: VmBuildTarget, hcl: HclFile) -> HclFile:
         return hcl
 
+    def snapshot_base_id(self, target: VmBuildTarget) -> str:
+        """Identifies the image a target starts from, snapshots of this target are invalid once it changes"""
+        return ''
+
+    def supports_snapshots(self, target: VmBuildTarget, hcl: HclFile) -> bool:
+        return False
+
+    def has_snapshot(self, target: VmBuildTarget, fingerprint: str) -> bool:
+        return False
+
+    def build_snapshot(self, target: VmBuildTarget, hcl: HclFile, fingerprint: str) -> None:
+        """Build an intermediate image (only the first actions), which later builds of this target can start from"""
+        raise NotImplementedError()
+
+    def from_snapshot(self, target: VmBuildTarget, hcl: HclFile, fingerprint: str) -> HclFile:
+        """Modify a packer script to start from a previously built snapshot"""
+        raise NotImplementedError()
+
+    def _snapshot_dir(self, target: VmBuildTarget) -> Path:
+        return target.project.output_dir / '.snapshots' / target.name
+
     def build(self, target: VmBuildTarget, hcl: HclFile) -> Path | str | None:
-        hcl = self._process_hcl(target, hcl)
+        self._run_packer(target, self._process_hcl(target, hcl))
+        return None
+
+    def _use_local_iso(self, hcl: HclFile, variables: dict[str, str]) -> None:
+        """Point Debian ISO sources to the local ISO store (downloaded once per version)"""
+        version = variables.get('debian_version')
+        if version is None:
+            return
+        for source in hcl.get_blocks('source'):
+            iso_url = source.get_argument('iso_url')
+            if iso_url is None or 'debian-${var.debian_version}' not in str(iso_url.get_raw_value()):
+                continue
+            store = debian_iso_store()
+            iso = store.ensure(version)
+            if iso is not None:
+                print(f'[*] Using local ISO {iso}')
+                source.set_argument('iso_url', iso.as_uri())
+                source.set_argument('iso_checksum', f'sha512:{store.checksum(version)}')
+
+    def _run_packer(self, target: VmBuildTarget, hcl: HclFile) -> None:
         variables = self._filter_known_variables(hcl, self._packer_variables(target, hcl))
+        self._use_local_iso(hcl, variables)
         hcl_file: Path = target.packer_template.parent / f'temp-{target.packer_template.name}'
-        hcl_file.write_text(hcl.to_string())
+        with hcl_file.open('w') as f:
+            hcl.write(f)
 
-        subprocess.check_call(['packer', 'init', str(hcl_file)])
+        with timings.stage(f'packer init {hcl_file.name}'):
+            subprocess.check_call(['packer', 'init', str(hcl_file)])
         cmd: list[str] = ['packer', 'build', '-force']
         for k, v in variables.items():
             cmd.append('-var')
             cmd.append(f'{k}={v}')
         cmd.append(str(hcl_file))
-        subprocess.check_call(cmd, cwd=str(hcl_file.parent))
+        with timings.stage(f'packer build {hcl_file.name}'):
+            subprocess.check_call(cmd, cwd=str(hcl_file.parent))
 
         hcl_file.unlink(missing_ok=True)
 
-        return None
-
 
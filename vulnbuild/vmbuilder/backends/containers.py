@@ -1,7 +1,9 @@
+import subprocess
 from pathlib import Path
 from typing import Any
 
-from vulnbuild.hcl.hcl import HclFile
+from vulnbuild.hcl.hcl import HclFile, HclArgument, HclBlock
+from vulnbuild.services.base_image import docker_image_id
 from vulnbuild.vmbuilder.backends.backend import VmBuilderBackend
 from vulnbuild.vmbuilder.build_targets import VmBuildTarget
 
@@ -36,6 +38,54 @@ class ContainerBackend(VmBuilderBackend):
                 source.set_argument('export_path', str(self.get_output_file(target)))
         return hcl
 
+    def snapshot_base_id(self, target: VmBuildTarget) -> str:
+        # the image the build starts from, a moved tag (after a pull) invalidates the snapshots
+        if self.shortname() != 'docker':
+            return ''
+        ids = []
+        for source in target.packer_script.get_blocks('source'):
+            image = source.get_argument('image')
+            if source.labels[0] == 'docker' and image is not None:
+                pull = source.get_argument('pull')
+                if pull is None or pull.get_raw_value() is not False:
+                    # packer pulls before building, the snapshot must be based on what it would get
+                    subprocess.call(['docker', 'pull', '-q', str(image.get_raw_value())], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                ids.append(docker_image_id(str(image.get_raw_value())) or str(image.get_raw_value()))
+        return ' '.join(ids)
+
+    def supports_snapshots(self, target: VmBuildTarget, hcl: HclFile) -> bool:
+        return self.shortname() == 'docker' and any(source.labels[0] == 'docker' for source in hcl.get_blocks('source'))
+
+    def _snapshot_image(self, target: VmBuildTarget, fingerprint: str) -> str:
+        return f'vulnbuild-snapshot-{target.project.name.lower()}-{target.name}:{fingerprint[:16]}'
+
+    def has_snapshot(self, target: VmBuildTarget, fingerprint: str) -> bool:
+        return docker_image_id(self._snapshot_image(target, fingerprint)) is not None
+
+    def build_snapshot(self, target: VmBuildTarget, hcl: HclFile, fingerprint: str) -> None:
+        repository, tag = self._snapshot_image(target, fingerprint).split(':')
+        for source in hcl.get_blocks('source'):
+            if source.labels[0] == 'docker':
+                source.children = [c for c in source.children if not (isinstance(c, HclArgument) and c.name == 'export_path')]
+                source.set_argument('commit', True)
+        for build_block in hcl.get_blocks('build'):
+            build_block.children.append(HclBlock('post-processor', ['docker-tag'], list(HclArgument.from_dict({
+                'repository': repository,
+                'tags': [tag]
+            }))))
+        old_images = subprocess.check_output(['docker', 'images', '-q', repository]).decode().split()
+        self._run_packer(target, hcl)
+        # only the latest snapshot of a target is useful
+        for image in old_images:
+            subprocess.call(['docker', 'rmi', image], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def from_snapshot(self, target: VmBuildTarget, hcl: HclFile, fingerprint: str) -> HclFile:
+        for source in hcl.get_blocks('source'):
+            if source.labels[0] == 'docker':
+                source.set_argument('image', self._snapshot_image(target, fingerprint))
+                source.set_argument('pull', False)
+        return hcl
+
     def build(self, target: VmBuildTarget, hcl: HclFile) -> Path | str | None:
         super().build(target, hcl)
         return self.get_output_file(target)
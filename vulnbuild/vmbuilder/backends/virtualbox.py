@@ -1,4 +1,5 @@
 import re
+import shutil
 import subprocess
 from pathlib import Path
 
@@ -80,6 +81,44 @@ class VirtualboxBackend(VmBuilderBackend):
                 source.set_argument('output_filename', str(f.name)[:-4])
         return hcl
 
+    def snapshot_base_id(self, target: VmBuildTarget) -> str:
+        base = self._output_file(self._base_image_target)
+        if target.name == 'debian' or not base.exists():
+            return ''
+        st = base.stat()
+        return f'{st.st_size}:{st.st_mtime_ns}'
+
+    def supports_snapshots(self, target: VmBuildTarget, hcl: HclFile) -> bool:
+        return any(source.labels[0] == 'virtualbox-ovf' for source in hcl.get_blocks('source'))
+
+    def _snapshot_file(self, target: VmBuildTarget, fingerprint: str) -> Path:
+        return self._snapshot_dir(target) / fingerprint[:16] / 'snapshot.ova'
+
+    def has_snapshot(self, target: VmBuildTarget, fingerprint: str) -> bool:
+        return self._snapshot_file(target, fingerprint).exists()
+
+    def build_snapshot(self, target: VmBuildTarget, hcl: HclFile, fingerprint: str) -> None:
+        f = self._snapshot_file(target, fingerprint)
+        for source in hcl.get_blocks('source'):
+            if source.labels[0] == 'virtualbox-ovf':
+                source.set_argument('output_directory', str(f.parent))
+                source.set_argument('output_filename', f.name[:-4])
+                source.set_argument('keep_registered', False)
+                vm_name = source.get_argument('vm_name')
+                if vm_name is not None:
+                    source.set_argument('vm_name', f'{vm_name.get_raw_value()}-snapshot')
+        self._run_packer(target, hcl)
+        # only the latest snapshot of a target is useful
+        for d in self._snapshot_dir(target).iterdir():
+            if d != f.parent and d.is_dir():
+                shutil.rmtree(d)
+
+    def from_snapshot(self, target: VmBuildTarget, hcl: HclFile, fingerprint: str) -> HclFile:
+        for source in hcl.get_blocks('source'):
+            if source.labels[0] == 'virtualbox-ovf':
+                source.set_argument('source_path', str(self._snapshot_file(target, fingerprint)))
+        return hcl
+
     def build(self, target: VmBuildTarget, hcl: HclFile) -> Path | str | None:
         if target.name == 'debian':
             print('[!] This step might take some time to finish (up to 30min) without any visible progress.')
@@ -11,7 +11,11 @@ from vulnbuild.project import ProjectConfig
 @dataclass
 class VmBuildTarget(BuildTask):
     packer_template: Path
-    packer_script: HclFile | None = None
+
+    @property
+    def packer_script(self) -> HclFile:
+        """Parsed on first use (shared, do not modify)"""
+        return HclParser.parse_file(self.packer_template)
 
     @property
     def fullname(self) -> str:
@@ -26,7 +30,7 @@ class VmBuildTarget(BuildTask):
 
     @classmethod
     def from_hcl(cls, name: str, project: ProjectConfig, f: Path) -> 'VmBuildTarget':
-        return VmBuildTarget(name, project, f, packer_script=HclParser.parse(f.read_text()))
+        return VmBuildTarget(name, project, f)
 
 
 class VmBuildTargetFactory:
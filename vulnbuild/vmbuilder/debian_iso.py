@@ -0,0 +1,106 @@
+import hashlib
+import re
+from pathlib import Path
+
+from vulnbuild.utils.timings import timings
+
+
+def _version_key(version: str) -> tuple[int, ...]:
+    return tuple(int(x) for x in version.split('.'))
+
+
+class DebianIsoStore:
+    """
+    Local copies of Debian netinst ISOs and their checksums: <root>/<version>/debian-<version>-amd64-netinst.iso
+    Packer uses these instead of downloading the ISO again for every base image build.
+    """
+
+    base_url = 'https://cdimage.debian.org/cdimage/release'
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    @staticmethod
+    def iso_name(version: str) -> str:
+        return f'debian-{version}-amd64-netinst.iso'
+
+    def iso_path(self, version: str) -> Path:
+        return self.root / version / self.iso_name(version)
+
+    def checksums_path(self, version: str) -> Path:
+        return self.root / version / 'SHA512SUMS'
+
+    def checksum(self, version: str) -> str | None:
+        try:
+            checksums = self.checksums_path(version).read_text()
+        except FileNotFoundError:
+            return None
+        for line in checksums.splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[1] == self.iso_name(version):
+                return parts[0]
+        return None
+
+    def versions(self) -> list[str]:
+        """Versions with a local ISO, newest first"""
+        if not self.root.is_dir():
+            return []
+        versions = [d.name for d in self.root.iterdir() if re.fullmatch(r'\d+\.\d+\.\d+', d.name) and self.iso_path(d.name).exists()]
+        return sorted(versions, key=_version_key, reverse=True)
+
+    def _verify(self, version: str) -> bool:
+        """Check the ISO against SHA512SUMS, remembered until the file changes"""
+        iso = self.iso_path(version)
+        checksum = self.checksum(version)
+        if checksum is None or not iso.exists():
+            return False
+        st = iso.stat()
+        marker = iso.with_name(iso.name + '.verified')
+        stamp = f'{st.st_size} {st.st_mtime_ns} {checksum}'
+        if marker.exists() and marker.read_text() == stamp:
+            return True
+        h = hashlib.sha512()
+        with open(iso, 'rb') as f:
+            while chunk := f.read(1024 * 1024):
+                h.update(chunk)
+        if h.hexdigest() != checksum:
+            print(f'[!] Checksum mismatch for {iso}, removing it')
+            iso.unlink()
+            marker.unlink(missing_ok=True)
+            return False
+        marker.write_text(stamp)
+        return True
+
+    def local_iso(self, version: str) -> Path | None:
+        return self.iso_path(version) if self._verify(version) else None
+
+    def download(self, version: str) -> Path:
+        import requests  # slow to import, not needed for most commands
+        folder = self.root / version
+        folder.mkdir(parents=True, exist_ok=True)
+        response = requests.get(f'{self.base_url}/{version}/amd64/iso-cd/SHA512SUMS', timeout=30)
+        response.raise_for_status()
+        self.checksums_path(version).write_text(response.text)
+        iso = self.iso_path(version)
+        tmp_file = iso.with_name(iso.name + '.tmp')
+        print(f'[-] Downloading {self.iso_name(version)} ...')
+        with timings.stage('debian iso download'), requests.get(f'{self.base_url}/{version}/amd64/iso-cd/{iso.name}', stream=True, timeout=30) as r:
+            r.raise_for_status()
+            with open(tmp_file, 'wb') as f:
+                for chunk in r.iter_content(1024 * 1024):
+                    f.write(chunk)
+        tmp_file.rename(iso)
+        if not self._verify(version):
+            raise ValueError(f'Downloaded {iso.name} does not match SHA512SUMS')
+        return iso
+
+    def ensure(self, version: str) -> Path | None:
+        """Local ISO of this version, downloaded if necessary. None if it is not available (offline)."""
+        iso = self.local_iso(version)
+        if iso is not None:
+            return iso
+        try:
+            return self.download(version)
+        except Exception as e:
+            print(f'[!] Could not download Debian {version} ISO: {e}')
+            return None
@@ -1,3 +1,5 @@
+import hashlib
+import json
 from pathlib import Path
 
 from vulnbuild.builds import BuildTask, ServiceBuildTask, Builder
@@ -7,7 +9,8 @@ from vulnbuild.hcl.parser import concat_lists
 from vulnbuild.project import ProjectConfig
 from vulnbuild.services.services import Service
 from vulnbuild.targets.password import PasswordTask
-from vulnbuild.vmbuilder.actions import Action, ActionFactory, ServiceAction, PackerAction
+from vulnbuild.vmbuilder.actions import Action, ActionFactory, ServiceAction, PackerAction, AptProxyResetAction, \
+    ServiceBatchAction
 from vulnbuild.vmbuilder.backends.backend import VmBuilderBackend
 from vulnbuild.vmbuilder.backends.containers import PodmanBackend, DockerBackend
 from vulnbuild.vmbuilder.backends.virtualbox import VirtualboxBackend
@@ -87,9 +90,7 @@ class VmBuilder(Builder[VmBuildTarget]):
         files: list[Path] = self._files_for_target(target)
         return ActionFactory(self.project, self.services).create_many(files)
 
-    def _hcl_buildscript(self, target: VmBuildTarget) -> HclFile:
-        if not target.packer_script:
-            raise ValueError('No packer script found')
+    def _hcl_buildscript(self, target: VmBuildTarget, actions: list[Action] | None = None) -> HclFile:
         script: HclFile = target.packer_script.clone()
 
         # add custom provisioners
@@ -98,23 +99,81 @@ class VmBuilder(Builder[VmBuildTarget]):
             while i < len(build_block.children):
                 b = build_block.children[i]
                 if isinstance(b, HclBlock) and b.type == 'vulnbuild':
-                    build_block.children = build_block.children[:i] + self._hcl_provisioners(target, b) + build_block.children[i + 1:]
+                    build_block.children = build_block.children[:i] + self._hcl_provisioners(target, b, actions) + build_block.children[i + 1:]
                 i += 1
 
         return script
 
-    def _hcl_provisioners(self, target: VmBuildTarget, b: HclBlock) -> list[HclBlock]:
+    def _hcl_provisioners(self, target: VmBuildTarget, b: HclBlock, actions: list[Action] | None = None) -> list[HclBlock]:
         if b.labels[0] == 'actions':
-            actions = self.find_actions(target)
+            if actions is None:
+                actions = self.find_actions(target)
             vars = self.get_backend().action_variables()
             return concat_lists(a.provisioners(**vars) for a in actions)
         else:
             raise KeyError(f'Unknown vulnbuild type: {b.labels}')
 
+    def _snapshot_split(self, actions: list[Action]) -> int:
+        """Snapshots are taken right before the first service is installed"""
+        for i, action in enumerate(actions):
+            if isinstance(action, (ServiceAction, ServiceBatchAction)):
+                return i
+        return 0
+
+    def action_fingerprints(self, target: VmBuildTarget, actions: list[Action]) -> list[str]:
+        """Fingerprint of each prefix of the action list - if it is unchanged, the image after this action is unchanged."""
+        h = hashlib.sha256()
+        h.update(target.packer_template.read_bytes())
+        h.update(self.get_backend().snapshot_base_id(target).encode())
+        variables = {'base': str(GlobalConfig.base), 'project_output_dir': str(self.project.output_dir)}
+        result = []
+        for action in actions:
+            if action.replay_after_snapshot():
+                h.update(str(action).encode())
+            else:
+                h.update(action.fingerprint(variables, **self.get_backend().action_variables()).encode())
+            result.append(h.hexdigest())
+        return result
+
+    def _report_fingerprints(self, target: VmBuildTarget, actions: list[Action], fingerprints: list[str]) -> None:
+        record = self.project.output_dir / '.snapshots' / f'{target.name}.json'
+        try:
+            previous = json.loads(record.read_text())
+        except FileNotFoundError:
+            previous = []
+        for i, (action, fingerprint) in enumerate(zip(actions, fingerprints)):
+            if i >= len(previous) or previous[i]['fingerprint'] != fingerprint:
+                print(f'[.] First changed action since last build: {action}')
+                break
+        record.parent.mkdir(parents=True, exist_ok=True)
+        record.write_text(json.dumps([{'action': str(a), 'fingerprint': f} for a, f in zip(actions, fingerprints)], indent=2))
+
+    def _prepare_actions(self, actions: list[Action]) -> None:
+        for action in actions:
+            action.prepare()
+
     def build(self, target: VmBuildTarget) -> None:
-        print(f'[-] Invoking packer to build {target.name} ...')
         backend = self.get_backend()
-        result = backend.build(target, self._hcl_buildscript(target))
+        actions = self.find_actions(target)
+        split = self._snapshot_split(actions)
+        if split > 0 and backend.supports_snapshots(target, target.packer_script):
+            fingerprints = self.action_fingerprints(target, actions)
+            self._report_fingerprints(target, actions, fingerprints)
+            fingerprint = fingerprints[split - 1]
+            if backend.has_snapshot(target, fingerprint):
+                print(f'[*] Base provisioning of {target.name} is unchanged, starting from snapshot {fingerprint[:16]}')
+            else:
+                print(f'[-] Invoking packer to build snapshot of {target.name} ({len(actions[:split])} actions) ...')
+                self._prepare_actions(actions[:split])
+                backend.build_snapshot(target, self._hcl_buildscript(target, actions[:split] + [AptProxyResetAction()]), fingerprint)
+            remaining = [a for a in actions[:split] if a.replay_after_snapshot()] + actions[split:]
+            self._prepare_actions(remaining)
+            hcl = backend.from_snapshot(target, self._hcl_buildscript(target, remaining), fingerprint)
+        else:
+            self._prepare_actions(actions)
+            hcl = self._hcl_buildscript(target, actions)
+        print(f'[-] Invoking packer to build {target.name} ...')
+        result = backend.build(target, hcl)
         if result is None:
             result = backend.export(target)
         print(f'[*] Created {result}')
@@ -130,6 +189,9 @@ class VmBuilder(Builder[VmBuildTarget]):
         for action in self.find_actions(task):
             if isinstance(action, ServiceAction):
                 dependencies.append(ServiceBuildTask(action.service.name, self.project, action.service))
+            elif isinstance(action, ServiceBatchAction):
+                for service_action in action.services:
+                    dependencies.append(ServiceBuildTask(service_action.service.name, self.project, service_action.service))
             elif isinstance(action, PackerAction):
                 if action.required_ssh_keypair():
                     dependencies.append(PasswordTask(self.project))